@@ -17,13 +17,14 @@ jwt = JWTManager()
 socketio = SocketIO()
 
 
-def create_app(config_name=None):
+def create_app(config_name=None, **overrides):
     """
     Application factory function
 
     Args:
         config_name: Configuration to use (development, testing, production)
                      If None, uses FLASK_ENV environment variable
+        overrides: settings replacing those of the configuration
 
     Returns:
         Configured Flask application instance
@@ -36,6 +37,7 @@ def create_app(config_name=None):
         app.config.from_object(config[config_name])
     else:
         app.config.from_object(get_config())
+    app.config.update(overrides)
 
     # Initialize extensions with app
     db.init_app(app)
@@ -53,6 +55,9 @@ def create_app(config_name=None):
         cors_allowed_origins=app.config['CORS_ORIGINS']
     )
 
+    # Initialize in-process services
+    init_services(app)
+
     # Register error handlers
     register_error_handlers(app)
 
@@ -65,14 +70,70 @@ def create_app(config_name=None):
     # Health check endpoint
     @app.route('/health')
     def health_check():
+        from app.services.telemetry_buffer import telemetry_buffer
+
         return jsonify({
             'status': 'healthy',
-            'environment': app.config.get('ENV', 'unknown')
+            'environment': app.config.get('ENV', 'unknown'),
+            'telemetry_buffer': telemetry_buffer.stats()
         })
 
     return app
 
 
+def init_services(app):
+    """Configure per-worker service singletons"""
+    from app.services.aggregate_cache import aggregate_cache
+    from app.services.alert_engine import alert_engine
+    from app.services.credential_cache import credential_cache
+    from app.services.dedup import sequence_deduplicator
+    from app.services.last_seen import last_seen_tracker
+    from app.services.offline_detector import offline_detector
+    from app.services.open_alerts import open_alert_index
+    from app.services.rate_limit import telemetry_rate_limiter
+    from app.services.rule_index import rule_index
+    from app.services.telemetry_buffer import telemetry_buffer
+
+    telemetry_rate_limiter.init_app(app)
+    credential_cache.init_app(app)
+    sequence_deduplicator.init_app(app)
+    telemetry_buffer.init_app(app)
+    last_seen_tracker.init_app(app)
+    aggregate_cache.init_app(app)
+    rule_index.init_app(app)
+    open_alert_index.init_app(app)
+    alert_engine.init_app(app)
+    offline_detector.init_app(app)
+
+
+def reset_services():
+    """
+    Drop what the service singletons hold about database rows
+
+    For tests, which recreate the tables between cases: cached credentials,
+    rules and open alerts would otherwise point at rows that no longer exist.
+    """
+    from app.services.alert_engine import alert_engine
+    from app.services.credential_cache import credential_cache
+    from app.services.dedup import sequence_deduplicator
+    from app.services.last_seen import last_seen_tracker
+    from app.services.offline_detector import offline_detector
+    from app.services.open_alerts import open_alert_index
+    from app.services.rate_limit import telemetry_rate_limiter
+    from app.services.rule_index import rule_index
+    from app.services.telemetry_buffer import telemetry_buffer
+
+    telemetry_rate_limiter.clear()
+    credential_cache.clear()
+    sequence_deduplicator.clear()
+    telemetry_buffer.clear()
+    last_seen_tracker.clear()
+    rule_index.clear()
+    open_alert_index.clear()
+    alert_engine.clear()
+    offline_detector.clear()
+
+
 def register_blueprints(app):
     """Register all Flask blueprints"""
     from app.routes.auth import auth_bp
@@ -0,0 +1,39 @@
+"""
+Celery Application
+Background workers and periodic tasks
+
+Run a worker with the embedded beat scheduler:
+    celery -A app.celery worker --beat --loglevel=info
+"""
+from celery import Celery, Task
+
+from app import create_app
+
+
+def make_celery(app):
+    """Celery app configured from the CELERY_* settings, running tasks in an app context"""
+
+    class FlaskTask(Task):
+        def __call__(self, *args, **kwargs):
+            with app.app_context():
+                return self.run(*args, **kwargs)
+
+    celery_app = Celery(app.import_name, task_cls=FlaskTask, include=['app.tasks'])
+    celery_app.config_from_object(app.config, namespace='CELERY')
+
+    interval = app.config['ALERT_EVALUATION_INTERVAL']
+    celery_app.conf.beat_schedule = {
+        'evaluate-alert-rules': {
+            'task': 'alerts.evaluate_rules',
+            'schedule': interval,
+            # A tick still queued when the next one is due is dropped
+            'options': {'expires': interval},
+        },
+    }
+
+    app.extensions['celery'] = celery_app
+    return celery_app
+
+
+# Ingest-side flush and offline-check threads belong to the web workers
+celery = make_celery(create_app(BACKGROUND_WORKERS_ENABLED=False))
@@ -0,0 +1,455 @@
+"""
+Ingestion Gateway
+asyncio HTTP server for device telemetry, run apart from the Flask API
+
+Serves only the device endpoints (POST /v1/equipments/telemetry and
+/v1/equipments/telemetry/batch) with the same payload formats, status codes
+and response bodies as the Flask routes, so devices can be pointed at either.
+Validation, rate limiting, credential caching and sequence deduplication are
+the ones in app.services; table and column names come from the models.
+
+Readings from concurrent requests are group-committed: a writer collects
+rows for up to GATEWAY_WRITE_MAX_DELAY seconds or GATEWAY_WRITE_BATCH_SIZE
+rows and writes them with one INSERT ... SELECT FROM unnest(...) per batch,
+with up to GATEWAY_DB_POOL_SIZE batches in flight on separate connections.
+Requests are acknowledged once their rows are committed. Readings are
+range-checked before they are queued; should the database still reject a
+batch, each request's rows are retried on their own so that only the
+offending request fails.
+
+Run with: python ingest_gateway.py
+"""
+import asyncio
+import logging
+import time
+import uuid
+from types import SimpleNamespace
+
+import asyncpg
+from aiohttp import web
+
+from config import get_config
+from app.models import Company, CompanyStatus, Equipment, Telemetry
+from app.services import last_seen, offline_detector, rate_limit
+from app.services.aggregate_cache import aggregate_cache
+from app.services.credential_cache import CredentialCache
+from app.services.dedup import sequence_deduplicator
+from app.services.payload_decoding import decode_batch, decode_reading
+from app.services.rate_limit import telemetry_rate_limiter
+from app.services.telemetry_ingest import (
+    IngestError, IngestResult, RateLimitExceeded,
+    build_entries, claim_sequences, prepare_batch, prepare_reading,
+    release_sequences, resolve_equipment, utcnow
+)
+from app.services.telemetry_store import COPY_COLUMNS, mark_history_sql, upsert_latest_sql
+
+logger = logging.getLogger('ingest_gateway')
+
+# Array types used to pass row columns to unnest(); analog values are sent as
+# float8 and cast to the column's NUMERIC type by the INSERT
+UNNEST_TYPES = {
+    'time': 'timestamptz',
+    'equipment_id': 'uuid',
+    'temperature': 'float8',
+    'pressure': 'float8',
+    'door': 'int2',
+    'heater': 'int2',
+    'compressor': 'int2',
+    'fan': 'int2',
+}
+
+# The inserted rows also refresh latest_telemetry and, when they are older
+# than the HTTP cache horizon ($9 seconds), the equipment's history stamp
+INSERT_TELEMETRY_SQL = (
+    f'WITH inserted AS ('
+    f'INSERT INTO {Telemetry.__tablename__} ({", ".join(COPY_COLUMNS)}) '
+    'SELECT * FROM unnest('
+    + ', '.join(f'${i}::{UNNEST_TYPES[name]}[]' for i, name in enumerate(COPY_COLUMNS, 1))
+    + f') ON CONFLICT DO NOTHING RETURNING {", ".join(COPY_COLUMNS)}'
+    f'), latest AS ({upsert_latest_sql("inserted")}), '
+    f'history AS ({mark_history_sql("inserted", "$9::float8")}) '
+    'SELECT time, equipment_id FROM inserted'
+)
+
+# Errors caused by the rows themselves (bad values, deleted equipment), as opposed to the database being unavailable
+REJECTED_ERRORS = (asyncpg.DataError, asyncpg.IntegrityConstraintViolationError)
+
+LOAD_CREDENTIALS_SQL = (
+    # The ORM's Enum(CompanyStatus) stores member names
+    f'SELECT e.serial, e.id, e.company_id, c.status::text, e.api_key '
+    f'FROM {Equipment.__tablename__} e '
+    f'JOIN {Company.__tablename__} c ON c.id = e.company_id '
+    'WHERE e.serial = ANY($1::text[])'
+)
+
+UPDATE_LAST_SEEN_SQL = (
+    f'UPDATE {Equipment.__tablename__} AS e SET last_seen_at = seen.last_seen_at '
+    'FROM unnest($1::uuid[], $2::timestamptz[]) AS seen(id, last_seen_at) '
+    'WHERE e.id = seen.id AND (e.last_seen_at IS NULL OR e.last_seen_at < seen.last_seen_at)'
+)
+
+
+def load_settings():
+    """Expose the active Flask config class like app.config so services can init_app from it"""
+    settings = get_config()
+    return SimpleNamespace(config={
+        key: getattr(settings, key) for key in dir(settings) if key.isupper()
+    })
+
+
+def asyncpg_dsn(uri):
+    """Strip the SQLAlchemy driver suffix (postgresql+psycopg2:// -> postgresql://)"""
+    scheme, sep, rest = uri.partition('://')
+    return scheme.split('+')[0] + sep + rest
+
+
+class AsyncCredentialCache(CredentialCache):
+    """Credential cache whose misses are loaded with asyncpg"""
+
+    def __init__(self):
+        super().__init__()
+        self.pool = None
+
+    async def authenticate_many(self, credentials):
+        now = time.monotonic()
+        cached, misses = self._lookup(credentials, now)
+        if misses:
+            records = await self.pool.fetch(LOAD_CREDENTIALS_SQL, misses)
+            loaded = self._store_loaded(
+                [(serial, equipment_id, company_id, CompanyStatus[status], api_key)
+                 for serial, equipment_id, company_id, status, api_key in records],
+                misses, now
+            )
+            for serial in misses:
+                cached[serial] = loaded.get(serial)
+        return self.match_keys(cached, credentials)
+
+
+class TelemetryWriter:
+    """Group-commits rows from concurrent requests"""
+
+    def __init__(self, batch_size=5000, max_delay=0.005, concurrency=10, history_horizon=86400):
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.history_horizon = history_horizon
+        self.pool = None
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(concurrency)
+        self._flushes = set()
+        self._task = None
+
+    def start(self, pool):
+        self.pool = pool
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    def depth(self):
+        return self._queue.qsize()
+
+    async def write(self, rows):
+        """Queue rows and wait for their batch to commit; returns the number inserted"""
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((rows, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            count = len(batch[0][0])
+            deadline = loop.time() + self.max_delay
+            while count < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                count += len(item[0])
+
+            await self._slots.acquire()
+            flush = asyncio.create_task(self._flush(batch))
+            self._flushes.add(flush)
+            flush.add_done_callback(self._flushes.discard)
+
+    async def _insert(self, rows):
+        """Write rows with one statement; returns the inserted (time, equipment_id) keys"""
+        columns = [[row[name] for row in rows] for name in COPY_COLUMNS]
+        async with self.pool.acquire() as connection:
+            return {
+                (record['time'], record['equipment_id'])
+                for record in await connection.fetch(
+                    INSERT_TELEMETRY_SQL, *columns, float(self.history_horizon)
+                )
+            }
+
+    async def _flush(self, batch):
+        written = []
+        error = None
+        try:
+            try:
+                written.append((batch, await self._insert([row for item, _ in batch for row in item])))
+            except REJECTED_ERRORS:
+                if len(batch) == 1:
+                    raise
+                # Some request's rows were rejected: write each request on its own so only that one fails
+                for item, future in batch:
+                    try:
+                        written.append(([(item, future)], await self._insert(item)))
+                    except REJECTED_ERRORS as e:
+                        future.set_exception(e)
+        except Exception as e:
+            error = e
+        finally:
+            self._slots.release()
+
+        # Attribute inserted keys back to the request that sent them; requests
+        # committed before a failure of the per-request retry still succeed
+        for requests, inserted in written:
+            for item, future in requests:
+                stored = 0
+                for row in item:
+                    key = (row['time'], row['equipment_id'])
+                    if key in inserted:
+                        inserted.discard(key)
+                        stored += 1
+                if not future.done():
+                    future.set_result(stored)
+        if error is not None:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+
+
+class IngestGateway:
+    """Shared state of one gateway process"""
+
+    def __init__(self, settings):
+        config = settings.config
+        self.config = config
+        self.pool = None
+        self.credentials = AsyncCredentialCache()
+        self.credentials.init_app(settings)
+        telemetry_rate_limiter.init_app(settings)
+        sequence_deduplicator.init_app(settings)
+        aggregate_cache.init_app(settings)
+        self.writer = TelemetryWriter(
+            batch_size=config['GATEWAY_WRITE_BATCH_SIZE'],
+            max_delay=config['GATEWAY_WRITE_MAX_DELAY'],
+            concurrency=config['GATEWAY_DB_POOL_SIZE'],
+            history_horizon=config['TELEMETRY_CACHE_HORIZON']
+        )
+        if config['LAST_SEEN_BACKEND'] == 'redis':
+            self.last_seen = last_seen.RedisBackend(config['REDIS_URL'])
+        else:
+            self.last_seen = last_seen.MemoryBackend()
+        # Offline deadlines are checked by the Flask workers; they only see the gateway's readings through Redis
+        self.offline = None
+        if config['OFFLINE_DETECTION_ENABLED'] and config['OFFLINE_DETECTOR_BACKEND'] == 'redis':
+            self.offline = offline_detector.make_backend(config)
+        self._last_seen_task = None
+
+    async def start(self, app):
+        self.pool = await asyncpg.create_pool(
+            asyncpg_dsn(self.config['SQLALCHEMY_DATABASE_URI']),
+            min_size=1,
+            max_size=self.config['GATEWAY_DB_POOL_SIZE']
+        )
+        self.credentials.pool = self.pool
+        self.writer.start(self.pool)
+        self._last_seen_task = asyncio.create_task(self._flush_last_seen_periodically())
+
+    async def stop(self, app):
+        self._last_seen_task.cancel()
+        await asyncio.gather(self._last_seen_task, return_exceptions=True)
+        await self.writer.stop()
+        await self.flush_last_seen()
+        await self.pool.close()
+
+    async def _blocking(self, func, *args):
+        """Run service calls that may do a Redis round trip off the event loop"""
+        if isinstance(telemetry_rate_limiter.backend, rate_limit.RedisBackend) \
+                or isinstance(self.last_seen, last_seen.RedisBackend):
+            return await asyncio.to_thread(func, *args)
+        return func(*args)
+
+    async def _flush_last_seen_periodically(self):
+        while True:
+            await asyncio.sleep(self.config['LAST_SEEN_FLUSH_INTERVAL'])
+            try:
+                await self.flush_last_seen()
+            except Exception:
+                logger.exception('last-seen flush failed')
+
+    async def flush_last_seen(self):
+        """Write all pending last-seen timestamps with one UPDATE ... FROM unnest(...)"""
+        pending = await self._blocking(self.last_seen.drain)
+        if not pending:
+            return 0
+        try:
+            await self.pool.execute(
+                UPDATE_LAST_SEEN_SQL,
+                [uuid.UUID(key) for key in pending],
+                list(pending.values())
+            )
+        except Exception:
+            await self._blocking(self.last_seen.restore, pending)
+            raise
+        return len(pending)
+
+    async def store(self, parsed, credentials, received_at):
+        equipment_ids = resolve_equipment(await self.credentials.authenticate_many(credentials), credentials)
+        entries = build_entries(parsed, equipment_ids)
+        rows, claimed = claim_sequences(entries)
+        if not rows:
+            return IngestResult(0, len(entries), False, received_at)
+
+        try:
+            stored = await self.writer.write(rows)
+        except asyncpg.ForeignKeyViolationError:
+            # Credentials cached before the equipment was deleted
+            release_sequences(claimed)
+            self.credentials.invalidate_equipment({row['equipment_id'] for row in rows})
+            raise IngestError('Equipment no longer exists', 401)
+        except REJECTED_ERRORS as e:
+            release_sequences(claimed)
+            logger.warning('telemetry rows rejected: %s', e)
+            raise IngestError('Readings rejected by the database', 400)
+        except (asyncpg.PostgresError, OSError):
+            release_sequences(claimed)
+            logger.exception('telemetry write failed')
+            raise IngestError('Telemetry store unavailable, retry later', 503)
+
+        equipment_ids = {row['equipment_id'] for row in rows}
+        seen_at = utcnow()
+        await self._blocking(self.last_seen.touch, equipment_ids, seen_at)
+        if self.offline is not None:
+            await asyncio.to_thread(self.offline.touch, equipment_ids, seen_at)
+        if aggregate_cache.enabled:
+            await asyncio.to_thread(aggregate_cache.invalidate, rows)
+        return IngestResult(stored, len(entries) - stored, False, received_at)
+
+    async def ingest_reading(self, serial, api_key, reading):
+        received_at = utcnow()
+        parsed = await self._blocking(prepare_reading, serial, reading, received_at)
+        return await self.store(parsed, {serial: api_key}, received_at)
+
+    async def ingest_batch(self, readings, default_api_key=None, api_keys=None):
+        received_at = utcnow()
+        parsed, credentials, rate_limited = await self._blocking(
+            prepare_batch, readings, received_at, default_api_key, api_keys,
+            self.config['TELEMETRY_BATCH_MAX_READINGS']
+        )
+        result = await self.store(parsed, credentials, received_at)
+        return result._replace(rate_limited=rate_limited)
+
+
+def _mimetype(request):
+    # aiohttp reports application/octet-stream when the header is missing;
+    # Flask reports an empty mimetype, which the decoders treat as JSON
+    return request.content_type if 'Content-Type' in request.headers else ''
+
+
+def _ingest_error(error):
+    headers = {'Retry-After': str(error.retry_after)} if isinstance(error, RateLimitExceeded) else None
+    return web.json_response({'error': error.message}, status=error.status_code, headers=headers)
+
+
+def _ingest_status(result):
+    return 201 if result.accepted else 200
+
+
+async def submit_telemetry(request):
+    """Same contract as POST /v1/equipments/telemetry in app.routes.telemetry"""
+    gateway = request.app['gateway']
+    api_key = request.headers.get('X-API-Key')
+
+    try:
+        data = decode_reading(_mimetype(request), await request.read())
+    except IngestError as e:
+        return _ingest_error(e)
+
+    if not api_key or not data.get('serial'):
+        return web.json_response({'error': 'Invalid request'}, status=400)
+
+    try:
+        result = await gateway.ingest_reading(data['serial'], api_key, data)
+    except IngestError as e:
+        return _ingest_error(e)
+
+    return web.json_response({
+        'success': True,
+        'duplicate': result.duplicates > 0,
+        'timestamp': result.received_at.isoformat()
+    }, status=_ingest_status(result))
+
+
+async def submit_telemetry_batch(request):
+    """Same contract as POST /v1/equipments/telemetry/batch in app.routes.telemetry"""
+    gateway = request.app['gateway']
+
+    try:
+        data = decode_batch(_mimetype(request), await request.read())
+    except IngestError as e:
+        return _ingest_error(e)
+
+    if 'readings' not in data:
+        return web.json_response({'error': 'Invalid request'}, status=400)
+
+    try:
+        result = await gateway.ingest_batch(
+            data['readings'],
+            default_api_key=request.headers.get('X-API-Key'),
+            api_keys=data.get('api_keys')
+        )
+    except IngestError as e:
+        return _ingest_error(e)
+
+    return web.json_response({
+        'success': True,
+        'accepted': result.accepted,
+        'duplicates': result.duplicates,
+        'rate_limited': result.rate_limited,
+        'timestamp': result.received_at.isoformat()
+    }, status=_ingest_status(result))
+
+
+async def health_check(request):
+    gateway = request.app['gateway']
+    return web.json_response({
+        'status': 'healthy',
+        'pending_rows': gateway.writer.depth(),
+        'db_pool_idle': gateway.pool.get_idle_size() if gateway.pool else 0
+    })
+
+
+def create_gateway(settings=None):
+    """
+    Gateway application factory
+
+    Args:
+        settings: object with a `config` dict; defaults to the config class
+                  selected by FLASK_ENV
+
+    Returns:
+        aiohttp Application
+    """
+    settings = settings or load_settings()
+    gateway = IngestGateway(settings)
+
+    app = web.Application(client_max_size=settings.config['MAX_CONTENT_LENGTH'])
+    app['gateway'] = gateway
+    app.on_startup.append(gateway.start)
+    app.on_cleanup.append(gateway.stop)
+
+    app.router.add_post('/v1/equipments/telemetry', submit_telemetry)
+    app.router.add_post('/v1/equipments/telemetry/batch', submit_telemetry_batch)
+    app.router.add_get('/health', health_check)
+    return app
@@ -220,6 +220,8 @@ class Equipment(db.Model):
     status = db.Column(Enum(EquipmentStatus), nullable=False, default=EquipmentStatus.OFFLINE)
     api_key = db.Column(db.String(255), nullable=False, unique=True)
     last_seen_at = db.Column(db.DateTime(timezone=True))
+    # Last time readings were written behind the HTTP cache horizon
+    history_changed_at = db.Column(db.DateTime(timezone=True))
     installed_at = db.Column(db.DateTime(timezone=True))
     created_at = db.Column(db.DateTime(timezone=True), nullable=False, server_default=func.now())
     updated_at = db.Column(db.DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
@@ -235,6 +237,10 @@ class Equipment(db.Model):
         return f'<Equipment {self.serial}>'
 
     def to_dict(self):
+        from app.services.last_seen import last_seen_tracker
+
+        # Readings update last_seen_at in memory first; prefer the fresher value
+        last_seen_at = last_seen_tracker.merge(self.id, self.last_seen_at)
         return {
             'id': str(self.id),
             'serial': self.serial,
@@ -244,7 +250,7 @@ class Equipment(db.Model):
             'manufacturer': self.manufacturer,
             'model': self.model,
             'status': self.status.value,
-            'last_seen_at': self.last_seen_at.isoformat() if self.last_seen_at else None,
+            'last_seen_at': last_seen_at.isoformat() if last_seen_at else None,
             'installed_at': self.installed_at.isoformat() if self.installed_at else None,
             'created_at': self.created_at.isoformat(),
         }
@@ -326,6 +332,23 @@ class Telemetry(db.Model):
         }
 
 
+class LatestTelemetry(db.Model):
+    """Newest reading of each equipment, upserted by the ingest path"""
+    __tablename__ = 'latest_telemetry'
+
+    equipment_id = db.Column(UUID(as_uuid=True), db.ForeignKey('equipments.id', ondelete='CASCADE'), primary_key=True)
+    time = db.Column(db.DateTime(timezone=True), nullable=False)
+    temperature = db.Column(db.Numeric(5, 2))
+    pressure = db.Column(db.Numeric(7, 2))
+    door = db.Column(db.SmallInteger)
+    heater = db.Column(db.SmallInteger)
+    compressor = db.Column(db.SmallInteger)
+    fan = db.Column(db.SmallInteger)
+
+    def __repr__(self):
+        return f'<LatestTelemetry {self.equipment_id} at {self.time}>'
+
+
 class Alert(db.Model):
     __tablename__ = 'alerts'
 
@@ -341,6 +364,15 @@ class Alert(db.Model):
     acknowledgment_notes = db.Column(db.Text)
     resolved_at = db.Column(db.DateTime(timezone=True))
     created_at = db.Column(db.DateTime(timezone=True), nullable=False, server_default=func.now())
+    last_matched_at = db.Column(db.DateTime(timezone=True))
+
+    # At most one open alert per equipment and rule; repeated matches update last_matched_at
+    __table_args__ = (
+        Index(
+            'alerts_open_rule_unique', 'equipment_id', 'alert_rule_id', unique=True,
+            postgresql_where=status.in_([AlertStatus.ACTIVE, AlertStatus.ACKNOWLEDGED])
+        ),
+    )
 
     # Relationships
     equipment = db.relationship('Equipment', back_populates='alerts')
@@ -364,6 +396,7 @@ class Alert(db.Model):
             'acknowledgment_notes': self.acknowledgment_notes,
             'resolved_at': self.resolved_at.isoformat() if self.resolved_at else None,
             'created_at': self.created_at.isoformat(),
+            'last_matched_at': self.last_matched_at.isoformat() if self.last_matched_at else None,
         }
 
 
@@ -7,6 +7,7 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 
 from app import db
 from app.models import AlertRule, User, UserRole
+from app.services.rule_index import rule_index
 
 alert_rules_bp = Blueprint('alert_rules', __name__)
 
@@ -85,6 +86,7 @@ def create_alert_rule():
 
     db.session.add(alert_rule)
     db.session.commit()
+    rule_index.rule_changed(alert_rule.id)
 
     return jsonify(alert_rule.to_dict()), 201
 
@@ -115,6 +117,7 @@ def update_alert_rule(rule_id):
         alert_rule.is_active = data['is_active']
 
     db.session.commit()
+    rule_index.rule_changed(alert_rule.id)
 
     return jsonify(alert_rule.to_dict()), 200
 
@@ -135,5 +138,6 @@ def delete_alert_rule(rule_id):
 
     db.session.delete(alert_rule)
     db.session.commit()
+    rule_index.rule_changed(rule_id)
 
     return jsonify({'message': 'Alert rule deleted'}), 200
@@ -8,6 +8,9 @@ from datetime import datetime
 
 from app import db
 from app.models import Alert, Equipment, User
+from app.services.open_alerts import open_alert_index
+from app.services.projection import ProjectionError, parse_fields
+from app.services.read_layer import json_response, select_rows
 
 alerts_bp = Blueprint('alerts', __name__)
 
@@ -15,7 +18,7 @@ alerts_bp = Blueprint('alerts', __name__)
 @alerts_bp.route('', methods=['GET'])
 @jwt_required()
 def get_alerts():
-    """Get alerts with filtering and pagination"""
+    """Get alerts with filtering and pagination; `fields` selects the returned attributes"""
     user_id = get_jwt_identity()
     user = User.query.get(user_id)
 
@@ -40,10 +43,17 @@ def get_alerts():
 
     query = query.order_by(Alert.created_at.desc())
 
+    try:
+        fields = parse_fields(request.args.get('fields'), Alert)
+    except ProjectionError as e:
+        return jsonify({'error': e.message}), e.status_code
+
+    query, to_row = select_rows(query, Alert, fields)
+
     alerts = query.paginate(page=page, per_page=limit, error_out=False)
 
-    return jsonify({
-        'alerts': [a.to_dict() for a in alerts.items],
+    return json_response({
+        'alerts': [to_row(a) for a in alerts.items],
         'pagination': {
             'page': page,
             'limit': limit,
@@ -97,5 +107,6 @@ def resolve_alert(alert_id):
     alert.resolved_at = datetime.utcnow()
 
     db.session.commit()
+    open_alert_index.closed(alert)
 
     return jsonify(alert.to_dict()), 200
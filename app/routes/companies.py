@@ -7,6 +7,7 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 
 from app import db
 from app.models import Company, User, UserRole
+from app.services.credential_cache import credential_cache
 
 companies_bp = Blueprint('companies', __name__)
 
@@ -113,6 +114,7 @@ def update_company(company_id):
         company.status = data['status']
 
     db.session.commit()
+    credential_cache.invalidate_company(company.id)
 
     return jsonify(company.to_dict()), 200
 
@@ -133,5 +135,6 @@ def delete_company(company_id):
 
     db.session.delete(company)
     db.session.commit()
+    credential_cache.invalidate_company(company_id)
 
     return jsonify({'message': 'Company deleted'}), 200
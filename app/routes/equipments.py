@@ -4,10 +4,16 @@ CRUD operations for equipment
 """
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from functools import partial
 import secrets
 
 from app import db
 from app.models import Equipment, User, UserRole
+from app.services.credential_cache import credential_cache
+from app.services.last_seen import last_seen_tracker
+from app.services.projection import PROJECTABLE_FIELDS, ProjectionError, parse_fields
+from app.services.read_layer import json_response, select_rows
+from app.services.rule_index import rule_index
 
 equipments_bp = Blueprint('equipments', __name__)
 
@@ -15,7 +21,7 @@ equipments_bp = Blueprint('equipments', __name__)
 @equipments_bp.route('', methods=['GET'])
 @jwt_required()
 def get_equipments():
-    """Get equipment with pagination"""
+    """Get equipment with pagination; `fields` selects the returned attributes"""
     user_id = get_jwt_identity()
     user = User.query.get(user_id)
 
@@ -35,10 +41,23 @@ def get_equipments():
     if status:
         query = query.filter_by(status=status)
 
+    try:
+        fields = parse_fields(request.args.get('fields'), Equipment)
+    except ProjectionError as e:
+        return jsonify({'error': e.message}), e.status_code
+
+    tracked = {}
+    query, to_row = select_rows(query, Equipment, fields, computed={
+        'last_seen_at': ((Equipment.id, Equipment.last_seen_at), partial(last_seen_tracker.merge, tracked=tracked))
+    })
+
     equipments = query.paginate(page=page, per_page=limit, error_out=False)
+    if 'last_seen_at' in (fields or PROJECTABLE_FIELDS[Equipment]):
+        # One lookup of the tracked timestamps for the whole page
+        tracked.update(last_seen_tracker.get_many([row.id for row in equipments.items]))
 
-    return jsonify({
-        'equipments': [e.to_dict() for e in equipments.items],
+    return json_response({
+        'equipments': [to_row(e) for e in equipments.items],
         'pagination': {
             'page': page,
             'limit': limit,
@@ -84,6 +103,9 @@ def create_equipment():
     db.session.add(equipment)
     db.session.commit()
 
+    # Drop any negative entry cached while the serial was unknown
+    credential_cache.invalidate(equipment.serial)
+
     result = equipment.to_dict()
     result['api_key'] = api_key  # Return API key only on creation
 
@@ -108,6 +130,7 @@ def update_equipment(equipment_id):
         equipment.status = data['status']
 
     db.session.commit()
+    credential_cache.invalidate(equipment.serial)
 
     return jsonify(equipment.to_dict()), 200
 
@@ -120,7 +143,10 @@ def delete_equipment(equipment_id):
     if not equipment:
         return jsonify({'error': 'Equipment not found'}), 404
 
+    serial = equipment.serial
     db.session.delete(equipment)
     db.session.commit()
+    credential_cache.invalidate(serial)
+    rule_index.equipment_changed(equipment_id)
 
     return jsonify({'message': 'Equipment deleted'}), 200
@@ -2,57 +2,208 @@
 Telemetry Routes
 Equipment telemetry submission and retrieval
 """
-from flask import Blueprint, request, jsonify
-from datetime import datetime
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from datetime import datetime, timedelta, timezone
+import uuid
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.wsgi import get_input_stream
 
-from app import db
-from app.models import Telemetry, Equipment
+from app.models import Telemetry, User
+from app.services.access import equipment_selection_query, resolve_equipment_selection
+from app.services.http_cache import cache_headers, not_modified, range_etag
+from app.services.payload_decoding import decode_batch, decode_reading, decode_stream
+from app.services.projection import ProjectionError, parse_fields, select_fields, serialize_value
+from app.services.read_layer import json_response, select_rows
+from app.services.telemetry_ingest import (
+    IngestError, RateLimitExceeded, ingest_backlog, ingest_batch, ingest_reading
+)
+from app.services.telemetry_export import EXPORT_FORMATS, export_query, generate_export
+from app.services.telemetry_query import (
+    SERIES_FIELDS, QueryError, aggregate_telemetry, count_telemetry, downsample_telemetry, keyset_page,
+    history_version, latest_readings, parse_interval, telemetry_by_equipment, to_columnar
+)
 
 telemetry_bp = Blueprint('telemetry', __name__)
 
 
+def _ingest_error(error):
+    response = jsonify({'error': error.message})
+    response.status_code = error.status_code
+    if isinstance(error, RateLimitExceeded):
+        response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+
+def _parse_ids(value):
+    """Parse a comma-separated list of UUIDs; raises ValueError"""
+    return [uuid.UUID(item.strip()) for item in value.split(',') if item.strip()] if value else []
+
+
+def _parse_id(value):
+    """Parse an optional UUID; raises ValueError"""
+    return uuid.UUID(value) if value else None
+
+
+def _reading_points(rows, series):
+    """Serialize (time, equipment_id, *series) row tuples as reading objects"""
+    return [
+        {'time': row.time.isoformat(), **{name: serialize_value(getattr(row, name)) for name in series}}
+        for row in rows
+    ]
+
+
+def _switch_state(value, on, off):
+    return None if value is None else (on if value else off)
+
+
+def _realtime_item(row):
+    """Serialize a latest_readings row as a RealtimeTelemetry object"""
+    return {
+        'equipment_id': str(row.equipment_id),
+        'serial': row.serial,
+        'branch_id': str(row.branch_id),
+        'temperature': serialize_value(row.temperature),
+        'pressure': serialize_value(row.pressure),
+        'door': _switch_state(row.door, 'open', 'closed'),
+        'heater': _switch_state(row.heater, 'on', 'off'),
+        'compressor': _switch_state(row.compressor, 'on', 'off'),
+        'fan': _switch_state(row.fan, 'on', 'off'),
+        'status': row.status.value,
+        'last_update': row.time.isoformat() if row.time else None,
+    }
+
+
+def _ingest_status(result):
+    """202 when queued for write-behind, 201 when rows were created, 200 for pure replays"""
+    if result.buffered:
+        return 202
+    return 201 if result.accepted else 200
+
+
 @telemetry_bp.route('/equipments/telemetry', methods=['POST'])
 def submit_telemetry():
-    """Equipment submits telemetry data (API key auth)"""
-    data = request.get_json()
+    """
+    Equipment submits telemetry data (API key auth)
+
+    Accepts JSON, form-encoded, MessagePack or a packed binary record.
+    """
     api_key = request.headers.get('X-API-Key')
 
-    if not api_key or not data or not data.get('serial'):
+    try:
+        data = decode_reading(request.mimetype, request.get_data(cache=False))
+    except IngestError as e:
+        return _ingest_error(e)
+
+    if not api_key or not data.get('serial'):
         return jsonify({'error': 'Invalid request'}), 400
 
-    # Validate equipment and API key
-    equipment = Equipment.query.filter_by(serial=data['serial'], api_key=api_key).first()
-
-    if not equipment:
-        return jsonify({'error': 'Invalid serial or API key'}), 401
-
-    # Create telemetry record
-    telemetry = Telemetry(
-        time=datetime.utcnow(),
-        equipment_id=equipment.id,
-        temperature=data.get('temperature'),
-        pressure=data.get('pressure'),
-        door=data.get('door'),
-        heater=data.get('heater'),
-        compressor=data.get('compressor'),
-        fan=data.get('fan')
-    )
+    try:
+        result = ingest_reading(data['serial'], api_key, data)
+    except IngestError as e:
+        return _ingest_error(e)
 
-    # Update equipment last seen
-    equipment.last_seen_at = datetime.utcnow()
+    return jsonify({
+        'success': True,
+        'duplicate': result.duplicates > 0,
+        'timestamp': result.received_at.isoformat()
+    }), _ingest_status(result)
+
+
+@telemetry_bp.route('/equipments/telemetry/batch', methods=['POST'])
+def submit_telemetry_batch():
+    """
+    Gateway submits readings for many equipments in one request
 
-    db.session.add(telemetry)
-    db.session.commit()
+    Each distinct serial is authenticated once per batch, either with its
+    entry in `api_keys` or with the X-API-Key header, and all readings are
+    written with a single multi-row INSERT (or buffered in write-behind mode).
+    Accepts JSON, MessagePack or concatenated packed binary records.
+    """
+    try:
+        data = decode_batch(request.mimetype, request.get_data(cache=False))
+    except IngestError as e:
+        return _ingest_error(e)
+
+    if 'readings' not in data:
+        return jsonify({'error': 'Invalid request'}), 400
+
+    try:
+        result = ingest_batch(
+            data['readings'],
+            default_api_key=request.headers.get('X-API-Key'),
+            api_keys=data.get('api_keys'),
+            max_readings=current_app.config['TELEMETRY_BATCH_MAX_READINGS']
+        )
+    except IngestError as e:
+        return _ingest_error(e)
 
     return jsonify({
         'success': True,
-        'timestamp': telemetry.time.isoformat()
-    }), 201
+        'accepted': result.accepted,
+        'duplicates': result.duplicates,
+        'rate_limited': result.rate_limited,
+        'timestamp': result.received_at.isoformat()
+    }), _ingest_status(result)
+
+
+@telemetry_bp.route('/equipments/telemetry/backlog', methods=['POST'])
+def submit_telemetry_backlog():
+    """
+    Equipment replays its stored readings after an outage (PRD 6.2)
+
+    The NDJSON or CSV body is read in TELEMETRY_BACKLOG_CHUNK_SIZE chunks and
+    streamed into COPY, so it is never held in memory and may exceed
+    MAX_CONTENT_LENGTH up to TELEMETRY_BACKLOG_MAX_CONTENT_LENGTH. Chunked
+    transfer encoding is accepted when the server marks the input terminated.
+    """
+    api_key = request.headers.get('X-API-Key')
+    serial = request.args.get('serial')
+    if not api_key or not serial:
+        return jsonify({'error': 'Invalid request'}), 400
+
+    try:
+        # Read the raw WSGI input so the app-wide MAX_CONTENT_LENGTH does not apply
+        stream = get_input_stream(
+            request.environ,
+            max_content_length=current_app.config['TELEMETRY_BACKLOG_MAX_CONTENT_LENGTH']
+        )
+        readings = decode_stream(request.mimetype, stream, current_app.config['TELEMETRY_BACKLOG_CHUNK_SIZE'])
+        result = ingest_backlog(serial, api_key, readings)
+    except IngestError as e:
+        return _ingest_error(e)
+    except RequestEntityTooLarge:
+        return jsonify({'error': 'Backlog exceeds the maximum upload size'}), 413
+
+    return jsonify({
+        'success': True,
+        'accepted': result.accepted,
+        'duplicates': result.duplicates,
+        'timestamp': result.received_at.isoformat()
+    }), 201 if result.accepted else 200
 
 
 @telemetry_bp.route('/equipments/<equipment_id>/telemetry', methods=['GET'])
 def get_telemetry(equipment_id):
-    """Get telemetry data for an equipment"""
+    """
+    Get telemetry data for an equipment
+
+    With `interval` other than raw, returns one aggregated point per bucket
+    (see app.services.telemetry_query) instead of raw readings. Raw readings
+    are paged with the opaque `cursor` from pagination.next_cursor /
+    prev_cursor; `count=exact` or `count=estimate` adds a total. `fields`
+    limits raw readings to the listed columns and buckets to the aggregates
+    of those columns. `format=columnar` returns `data` as one array per
+    series with epoch-second timestamps instead of an array of objects.
+    `max_points` returns the whole raw range downsampled with LTTB; its
+    range defaults to the day before end_date (or now) and may hold at most
+    TELEMETRY_DOWNSAMPLE_MAX_ROWS readings.
+
+    Ranges with an end_date before the ingestion horizon carry an ETag that
+    changes only when late readings are written into them; If-None-Match
+    is answered with 304 without querying telemetry (see
+    app.services.http_cache).
+    """
     page = request.args.get('page', 1, type=int)
     limit = request.args.get('limit', 100, type=int)
     limit = min(limit, 1000)  # Max 1000
@@ -60,24 +211,240 @@ def get_telemetry(equipment_id):
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
 
+    try:
+        width = parse_interval(request.args.get('interval'))
+        fields = parse_fields(request.args.get('fields'), Telemetry)
+        start = datetime.fromisoformat(start_date) if start_date else None
+        end = datetime.fromisoformat(end_date) if end_date else None
+    except ValueError:
+        return jsonify({'error': 'Invalid start_date or end_date'}), 400
+    except (QueryError, ProjectionError) as e:
+        return jsonify({'error': e.message}), e.status_code
+
+    response_format = request.args.get('format', 'rows')
+    if response_format not in ('rows', 'columnar'):
+        return jsonify({'error': f'Unsupported format: {response_format}'}), 400
+    columnar = response_format == 'columnar'
+
+    max_points = request.args.get('max_points', type=int)
+    if max_points is not None and not 3 <= max_points <= current_app.config['TELEMETRY_MAX_POINTS']:
+        return jsonify({
+            'error': f'max_points must be between 3 and {current_app.config["TELEMETRY_MAX_POINTS"]}'
+        }), 400
+    if max_points is not None and width is not None:
+        return jsonify({'error': 'max_points applies to raw readings only'}), 400
+
+    etag, fresh = range_etag(end, version=lambda: history_version([equipment_id]))
+    if fresh:
+        return not_modified(etag)
+
+    if width is not None:
+        points, has_more = aggregate_telemetry(
+            equipment_id, width, start, end, limit=limit, offset=max(page - 1, 0) * limit, fields=fields,
+            columnar=columnar
+        )
+        return cache_headers(jsonify({
+            'equipment_id': equipment_id,
+            'interval': request.args.get('interval'),
+            'data': points,
+            'pagination': {
+                'page': page,
+                'limit': limit,
+                'has_more': has_more
+            }
+        }), etag), 200
+
     query = Telemetry.query.filter_by(equipment_id=equipment_id)
 
-    if start_date:
-        query = query.filter(Telemetry.time >= datetime.fromisoformat(start_date))
-    if end_date:
-        query = query.filter(Telemetry.time <= datetime.fromisoformat(end_date))
+    if start:
+        query = query.filter(Telemetry.time >= start)
+    if end:
+        query = query.filter(Telemetry.time <= end)
 
-    query = query.order_by(Telemetry.time.desc())
+    if max_points is not None:
+        if start is None:
+            # Never load an equipment's whole history
+            query = query.filter(Telemetry.time >= (end or datetime.now(timezone.utc)) - timedelta(days=1))
+        series = tuple(name for name in fields or SERIES_FIELDS if name in SERIES_FIELDS) or SERIES_FIELDS
+        try:
+            points, source_points = downsample_telemetry(
+                query, series, max_points, current_app.config['TELEMETRY_DOWNSAMPLE_MAX_ROWS']
+            )
+        except QueryError as e:
+            return jsonify({'error': e.message}), e.status_code
+        return cache_headers(jsonify({
+            'equipment_id': equipment_id,
+            'data': to_columnar(points, series) if columnar else _reading_points(points, series),
+            'downsampling': {
+                'algorithm': 'lttb',
+                'max_points': max_points,
+                'source_points': source_points
+            }
+        }), etag), 200
 
-    telemetry = query.paginate(page=page, per_page=limit, error_out=False)
+    # The cursor keys are always selected so pages can be chained
+    if columnar:
+        series = tuple(name for name in fields or SERIES_FIELDS if name in SERIES_FIELDS)
+        query, _ = select_fields(query, Telemetry, series, required=('time', 'equipment_id'))
+    else:
+        query, to_row = select_rows(query, Telemetry, fields, required=('time', 'equipment_id'))
 
-    return jsonify({
+    try:
+        telemetry, next_cursor, prev_cursor = keyset_page(query, request.args.get('cursor'), limit)
+    except QueryError as e:
+        return jsonify({'error': e.message}), e.status_code
+
+    pagination = {
+        'limit': limit,
+        'next_cursor': next_cursor,
+        'prev_cursor': prev_cursor
+    }
+    count = request.args.get('count')
+    if count in ('exact', 'estimate'):
+        pagination['total'] = count_telemetry(equipment_id, start, end, estimate=count == 'estimate')
+        pagination['total_is_estimate'] = count == 'estimate'
+
+    return cache_headers(json_response({
         'equipment_id': equipment_id,
-        'data': [t.to_dict() for t in telemetry.items],
-        'pagination': {
-            'page': page,
-            'limit': limit,
-            'total': telemetry.total,
-            'total_pages': telemetry.pages
-        }
-    }), 200
+        'data': to_columnar(telemetry, series) if columnar else [to_row(t) for t in telemetry],
+        'pagination': pagination
+    }), etag), 200
+
+
+@telemetry_bp.route('/telemetry', methods=['GET'])
+@jwt_required()
+def get_multi_equipment_telemetry():
+    """
+    Raw telemetry of several equipments in one request (branch dashboards)
+
+    Equipment is selected with `equipment_ids` (comma-separated) and/or
+    `branch_id`, limited to what the user may access. All series are read
+    with one query and returned grouped per equipment, in the order of
+    `equipment_ids`. The range defaults to the last 24 hours; ranges ending
+    before the ingestion horizon are cached like get_telemetry's.
+    """
+    response_format = request.args.get('format', 'rows')
+    if response_format not in ('rows', 'columnar'):
+        return jsonify({'error': f'Unsupported format: {response_format}'}), 400
+
+    try:
+        equipment_ids = _parse_ids(request.args.get('equipment_ids'))
+        branch_id = _parse_id(request.args.get('branch_id'))
+        fields = parse_fields(request.args.get('fields'), Telemetry)
+        start_date = request.args.get('start_date')
+        end_date = request.args.get('end_date')
+        end = datetime.fromisoformat(end_date) if end_date else datetime.now(timezone.utc)
+        start = datetime.fromisoformat(start_date) if start_date else end - timedelta(days=1)
+    except ValueError:
+        return jsonify({'error': 'Invalid equipment_ids, branch_id, start_date or end_date'}), 400
+    except ProjectionError as e:
+        return jsonify({'error': e.message}), e.status_code
+
+    if not equipment_ids and not branch_id:
+        return jsonify({'error': 'equipment_ids or branch_id is required'}), 400
+
+    user = User.query.get(get_jwt_identity())
+    serials = resolve_equipment_selection(user, equipment_ids, branch_id)
+    if serials is None:
+        return jsonify({'error': 'Equipment not found'}), 404
+
+    # The ETag is per user since the selection depends on their access
+    etag, fresh = range_etag(
+        end if end_date else None, identity=get_jwt_identity(), version=lambda: history_version(serials)
+    )
+    if fresh:
+        return not_modified(etag)
+
+    series = tuple(name for name in fields or SERIES_FIELDS if name in SERIES_FIELDS)
+    try:
+        grouped = telemetry_by_equipment(
+            serials, series, start, end, current_app.config['TELEMETRY_MULTI_MAX_ROWS']
+        )
+    except QueryError as e:
+        return jsonify({'error': e.message}), e.status_code
+
+    order = list(dict.fromkeys(equipment_ids)) or sorted(serials, key=serials.get)
+    result = []
+    for equipment_id in order:
+        rows = grouped.get(equipment_id, [])
+        result.append({
+            'equipment_id': str(equipment_id),
+            'serial': serials[equipment_id],
+            'data': to_columnar(rows, series) if response_format == 'columnar' else _reading_points(rows, series)
+        })
+
+    return cache_headers(jsonify({
+        'start_date': start.isoformat(),
+        'end_date': end.isoformat(),
+        'series': result
+    }), etag), 200
+
+
+@telemetry_bp.route('/telemetry/realtime', methods=['GET'])
+@jwt_required()
+def get_realtime_telemetry():
+    """
+    Current values of all accessible equipment (PRD 11.11)
+
+    Optionally narrowed with `equipment_ids` (comma-separated) and/or
+    `branch_id`. Values come from the latest_telemetry table maintained by
+    the ingest path, one primary-key row per equipment.
+    """
+    user = User.query.get(get_jwt_identity())
+
+    try:
+        equipment_ids = _parse_ids(request.args.get('equipment_ids'))
+        branch_id = _parse_id(request.args.get('branch_id'))
+    except ValueError:
+        return jsonify({'error': 'Invalid equipment_ids or branch_id'}), 400
+
+    rows = latest_readings(equipment_selection_query(user, equipment_ids, branch_id))
+    if equipment_ids and len(rows) != len(set(equipment_ids)):
+        return jsonify({'error': 'Equipment not found'}), 404
+
+    return jsonify({'equipments': [_realtime_item(row) for row in rows]}), 200
+
+
+@telemetry_bp.route('/telemetry/export', methods=['GET'])
+@jwt_required()
+def export_telemetry():
+    """
+    Stream a telemetry range for one or many equipments (HACCP audits)
+
+    Equipment is selected with `equipment_ids` (comma-separated) and/or
+    `branch_id`, limited to what the user may access. The body is NDJSON
+    (default) or CSV (`format=csv`), written while rows stream from a
+    server-side cursor.
+    """
+    user = User.query.get(get_jwt_identity())
+
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f'Unsupported format: {fmt}'}), 400
+
+    try:
+        equipment_ids = _parse_ids(request.args.get('equipment_ids'))
+        branch_id = _parse_id(request.args.get('branch_id'))
+        start_date = request.args.get('start_date')
+        end_date = request.args.get('end_date')
+        start = datetime.fromisoformat(start_date) if start_date else None
+        end = datetime.fromisoformat(end_date) if end_date else None
+    except ValueError:
+        return jsonify({'error': 'Invalid equipment_ids, branch_id, start_date or end_date'}), 400
+
+    if not equipment_ids and not branch_id:
+        return jsonify({'error': 'equipment_ids or branch_id is required'}), 400
+
+    serials = resolve_equipment_selection(user, equipment_ids, branch_id)
+    if serials is None:
+        return jsonify({'error': 'Equipment not found'}), 404
+
+    body = generate_export(
+        export_query(serials, start, end), serials, fmt,
+        batch_size=current_app.config['TELEMETRY_EXPORT_BATCH_SIZE']
+    )
+    return Response(
+        stream_with_context(body),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename=telemetry.{fmt}'}
+    )
@@ -11,6 +11,8 @@ import re
 
 from app import db
 from app.models import User, UserRole, UserStatus, UserBranchAccess, BranchAccessType
+from app.services.projection import ProjectionError, parse_fields
+from app.services.read_layer import json_response, select_rows
 
 users_bp = Blueprint('users', __name__)
 
@@ -18,7 +20,7 @@ users_bp = Blueprint('users', __name__)
 @users_bp.route('', methods=['GET'])
 @jwt_required()
 def get_users():
-    """Get users with pagination"""
+    """Get users with pagination; `fields` selects the returned attributes"""
     user_id = get_jwt_identity()
     user = User.query.get(user_id)
 
@@ -31,10 +33,17 @@ def get_users():
     if user.role != UserRole.GLOBAL_ADMIN:
         query = query.filter_by(company_id=user.company_id)
 
+    try:
+        fields = parse_fields(request.args.get('fields'), User)
+    except ProjectionError as e:
+        return jsonify({'error': e.message}), e.status_code
+
+    query, to_row = select_rows(query, User, fields)
+
     users = query.paginate(page=page, per_page=limit, error_out=False)
 
-    return jsonify({
-        'users': [u.to_dict() for u in users.items],
+    return json_response({
+        'users': [to_row(u) for u in users.items],
         'pagination': {
             'page': page,
             'limit': limit,
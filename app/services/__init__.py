@@ -0,0 +1,4 @@
+"""
+Polo Sanca Refrigeration Monitoring System
+Business logic services shared by the API blueprints
+"""
@@ -0,0 +1,53 @@
+"""
+Equipment Access
+Tenant and branch scoping of equipment for the current user (PRD 5.6)
+"""
+from app import db
+from app.models import BranchAccessType, Equipment, UserBranchAccess, UserRole
+
+
+def accessible_equipment_query(user):
+    """
+    Equipment query limited to what the user may see
+
+    Global admins see everything; other users only their company's
+    equipment, and restricted users only equipment in their assigned branches.
+    """
+    query = Equipment.query
+    if user.role != UserRole.GLOBAL_ADMIN:
+        query = query.filter(Equipment.company_id == user.company_id)
+    if user.branch_access_type == BranchAccessType.RESTRICTED:
+        branch_ids = db.session.query(UserBranchAccess.branch_id)\
+            .filter(UserBranchAccess.user_id == user.id)
+        query = query.filter(Equipment.branch_id.in_(branch_ids.scalar_subquery()))
+    return query
+
+
+def equipment_selection_query(user, equipment_ids=None, branch_id=None):
+    """Accessible equipment narrowed to an equipment_ids / branch_id selection"""
+    query = accessible_equipment_query(user)
+    if equipment_ids:
+        query = query.filter(Equipment.id.in_(equipment_ids))
+    if branch_id:
+        query = query.filter(Equipment.branch_id == branch_id)
+    return query
+
+
+def resolve_equipment_selection(user, equipment_ids=None, branch_id=None):
+    """
+    Resolve an equipment_ids / branch_id selection to accessible equipment
+
+    Args:
+        equipment_ids: optional list of equipment ids
+        branch_id: optional branch id (all its equipment)
+
+    Returns:
+        dict equipment_id -> serial, or None when an explicitly requested
+        equipment does not exist or is not accessible
+    """
+    query = equipment_selection_query(user, equipment_ids, branch_id)\
+        .with_entities(Equipment.id, Equipment.serial)
+    selection = {equipment_id: serial for equipment_id, serial in query.all()}
+    if equipment_ids and len(selection) != len(set(equipment_ids)):
+        return None
+    return selection
@@ -0,0 +1,205 @@
+"""
+Aggregate Result Cache
+Shared Redis cache of bucketed telemetry (`interval=`) results
+
+Each (equipment, bucket width, aggregate columns) has a sorted set of
+closed buckets scored by their start (epoch seconds) and a small hash with
+the contiguous range [from, to) the set covers. A query takes the covered
+buckets from Redis, computes only the buckets after `to` (normally just the
+newest, still open one) and extends the coverage with the buckets that
+closed since. Ingestion truncates the coverage of an equipment at the
+bucket of its oldest new reading, so late readings (clock skew, backlog
+replays) only recompute the buckets they fall into. It also bumps the
+equipment's generation counter; a computed result is only stored when the
+generation is unchanged since the query read the coverage.
+"""
+from datetime import datetime, timezone
+from types import SimpleNamespace
+import json
+import math
+import time
+
+# time_bucket() origin for intervals without months (Monday 2000-01-03 UTC)
+BUCKET_ORIGIN = 946857600
+
+KEY_PREFIX = 'telemetry:agg:'
+
+# KEYS: per-equipment index sets; ARGV[1] bucket origin, ARGV[2] ttl,
+# ARGV[i + 2]: oldest new reading of KEYS[i] (epoch seconds)
+# Every call bumps the equipment's generation, even when no cached bucket is
+# touched, so results computed concurrently with the write are not stored
+INVALIDATE_SCRIPT = """
+local origin = tonumber(ARGV[1])
+for i, index in ipairs(KEYS) do
+    local t = tonumber(ARGV[i + 2])
+    redis.call('INCR', index .. ':generation')
+    redis.call('EXPIRE', index .. ':generation', ARGV[2])
+    for _, base in ipairs(redis.call('SMEMBERS', index)) do
+        local meta = base .. ':meta'
+        local state = redis.call('HMGET', meta, 'from', 'to', 'width')
+        local from, to, width = tonumber(state[1]), tonumber(state[2]), tonumber(state[3])
+        if not to then
+            redis.call('SREM', index, base)
+        elseif t < to then
+            local cut = t - ((t - origin) % width)
+            if cut <= from then
+                redis.call('DEL', base, meta)
+                redis.call('SREM', index, base)
+            else
+                redis.call('ZREMRANGEBYSCORE', base, cut, '+inf')
+                redis.call('HSET', meta, 'to', cut)
+            end
+        end
+    end
+end
+return 0
+"""
+
+# KEYS[1] buckets, KEYS[2] meta, KEYS[3] equipment index, KEYS[4] equipment generation
+# ARGV: generation read before the query, computed from/to, width, ttl,
+#       then score/member pairs
+# Returns 0 when the equipment received readings meanwhile
+STORE_SCRIPT = """
+if (redis.call('GET', KEYS[4]) or '') ~= ARGV[1] then
+    return 0
+end
+local state = redis.call('HMGET', KEYS[2], 'from', 'to')
+local from, to = tonumber(ARGV[2]), tonumber(ARGV[3])
+local current_from, current_to = tonumber(state[1]), tonumber(state[2])
+if current_to and current_from <= to and current_to >= from then
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], from, '(' .. to)
+    from, to = math.min(from, current_from), math.max(to, current_to)
+else
+    redis.call('DEL', KEYS[1])
+end
+for i = 6, #ARGV, 2 do
+    redis.call('ZADD', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+redis.call('HSET', KEYS[2], 'from', from, 'to', to, 'width', ARGV[4])
+redis.call('SADD', KEYS[3], KEYS[1])
+for i = 1, 3 do
+    redis.call('EXPIRE', KEYS[i], ARGV[5])
+end
+return 1
+"""
+
+
+def _epoch(value):
+    """Epoch seconds of a datetime (naive datetimes are UTC)"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def _floor(seconds, step):
+    """Start of the bucket containing `seconds`, aligned like time_bucket()"""
+    return int(seconds - (seconds - BUCKET_ORIGIN) % step)
+
+
+class AggregateCache:
+    """
+    Bucket cache shared by every worker (PRD 11.11)
+
+    Disabled unless TELEMETRY_AGGREGATE_CACHE_ENABLED; buckets are cached
+    once they ended TELEMETRY_AGGREGATE_CACHE_GRACE seconds ago and expire
+    after TELEMETRY_AGGREGATE_CACHE_TTL seconds without writes.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.ttl = 86400
+        self.grace = 60
+        self._redis = None
+
+    def init_app(self, app):
+        self.enabled = app.config['TELEMETRY_AGGREGATE_CACHE_ENABLED']
+        self.ttl = app.config['TELEMETRY_AGGREGATE_CACHE_TTL']
+        self.grace = app.config['TELEMETRY_AGGREGATE_CACHE_GRACE']
+        self._redis = None
+        if self.enabled:
+            import redis
+
+            self._redis = redis.Redis.from_url(app.config['REDIS_URL'])
+            self._store = self._redis.register_script(STORE_SCRIPT)
+            self._invalidate = self._redis.register_script(INVALIDATE_SCRIPT)
+
+    def buckets(self, equipment_id, width, columns, start, end, compute, offset, count):
+        """
+        Page of buckets of [start, end], newest first
+
+        Args:
+            width: bucket width (timedelta)
+            columns: aggregate column names, part of the cache key
+            start, end: range of the query; end None means up to now
+            compute: function(start) returning the buckets from `start` to
+                     `end` newest first, as objects with `bucket` and the
+                     columns as JSON-ready attributes
+            offset, count: page of buckets to return
+
+        Returns:
+            list of bucket objects
+        """
+        step = int(width.total_seconds())
+        now = time.time()
+        first = _floor(_epoch(start), step)
+        last = _floor(_epoch(end) if end is not None else now, step)
+        # Buckets before closed_until are complete within the range and no longer receive live readings
+        closed_until = min(last, _floor(now - self.grace, step))
+
+        index = f'{KEY_PREFIX}{equipment_id}'
+        base = f'{index}:{step}:{",".join(columns)}'
+        pipeline = self._redis.pipeline()
+        pipeline.get(f'{index}:generation')
+        pipeline.hmget(f'{base}:meta', 'from', 'to')
+        generation, (meta_from, meta_to) = pipeline.execute()
+        covered_to = first
+        if meta_to is not None and int(meta_from) <= first < int(meta_to):
+            covered_to = max(first, min(int(meta_to), closed_until))
+
+        fresh = compute(datetime.fromtimestamp(covered_to, timezone.utc))
+
+        if closed_until > covered_to:
+            closed = [point for point in fresh if _epoch(point.bucket) < closed_until]
+            members = []
+            for point in closed:
+                score = int(_epoch(point.bucket))
+                members += [score, json.dumps([score, *(getattr(point, name) for name in columns)])]
+            self._store(
+                keys=[base, f'{base}:meta', index, f'{index}:generation'],
+                args=[generation or '', covered_to, closed_until, step, self.ttl, *members]
+            )
+
+        page = fresh[offset:offset + count]
+        if len(page) < count and covered_to > first:
+            cached = self._redis.zrevrangebyscore(
+                base, f'({covered_to}', first, start=max(0, offset - len(fresh)), num=count - len(page)
+            )
+            page += [self._decode(member, columns) for member in cached]
+        return page
+
+    @staticmethod
+    def _decode(member, columns):
+        score, *values = json.loads(member)
+        return SimpleNamespace(bucket=datetime.fromtimestamp(score, timezone.utc), **dict(zip(columns, values)))
+
+    def invalidate(self, rows):
+        """
+        Drop cached buckets that new rows fall into
+
+        Args:
+            rows: telemetry row dicts just written (time, equipment_id, ...)
+        """
+        if not self.enabled or not rows:
+            return
+        earliest = {}
+        for row in rows:
+            key = str(row['equipment_id'])
+            if key not in earliest or row['time'] < earliest[key]:
+                earliest[key] = row['time']
+        self._invalidate(
+            keys=[f'{KEY_PREFIX}{equipment_id}' for equipment_id in earliest],
+            args=[BUCKET_ORIGIN, self.ttl] + [math.floor(_epoch(value)) for value in earliest.values()]
+        )
+
+
+aggregate_cache = AggregateCache()
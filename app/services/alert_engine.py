@@ -0,0 +1,194 @@
+"""
+Alert Evaluation Engine
+Streaming evaluation of alert rules on ingested readings (PRD 4.9 step 6)
+
+Every (equipment, rule) pair keeps a small state: since when the rule's
+condition has held, the last value and the time of the last evaluated
+reading. A reading only touches the states of its equipment's effective
+rules, compiled by rule_index, so evaluation costs O(rules for the
+equipment) per reading without database lookups. Every reading once the
+condition has held for the rule's duration_seconds is a match, recorded by
+open_alerts: the first opens an alert, the following ones only move its
+last_matched_at.
+"""
+from collections import defaultdict
+from datetime import datetime, timezone
+from operator import itemgetter
+import json
+import logging
+import threading
+
+from app import db
+from app.services.open_alerts import open_alert_index
+from app.services.rule_index import rule_index
+
+logger = logging.getLogger(__name__)
+
+
+class RuleState:
+    """Condition state of one (equipment, rule) pair"""
+    __slots__ = ('since', 'last_value', 'last_time')
+
+    def __init__(self, since=None, last_value=None, last_time=None):
+        self.since = since
+        self.last_value = last_value
+        self.last_time = last_time
+
+
+def _to_epoch(value):
+    return value.timestamp() if value is not None else None
+
+
+def _from_epoch(value):
+    return datetime.fromtimestamp(value, timezone.utc) if value is not None else None
+
+
+class MemoryBackend:
+    """States local to this worker"""
+
+    def __init__(self):
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def load(self, equipment_id):
+        with self._lock:
+            return dict(self._states.get(str(equipment_id), {}))
+
+    def save(self, equipment_id, states):
+        with self._lock:
+            self._states[str(equipment_id)] = states
+
+    def clear(self):
+        with self._lock:
+            self._states.clear()
+
+
+class RedisBackend:
+    """States shared by every worker, one hash per equipment"""
+
+    def __init__(self, redis_url, prefix='alert:state:'):
+        import redis
+
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(redis_url)
+
+    def load(self, equipment_id):
+        states = {}
+        for rule_id, value in self._redis.hgetall(self.prefix + str(equipment_id)).items():
+            since, last_value, last_time = json.loads(value)
+            states[rule_id.decode()] = RuleState(_from_epoch(since), last_value, _from_epoch(last_time))
+        return states
+
+    def save(self, equipment_id, states):
+        if not states:
+            return
+        self._redis.hset(self.prefix + str(equipment_id), mapping={
+            rule_id: json.dumps([_to_epoch(state.since), state.last_value, _to_epoch(state.last_time)])
+            for rule_id, state in states.items()
+        })
+
+    def clear(self):
+        for key in self._redis.scan_iter(match=self.prefix + '*'):
+            self._redis.delete(key)
+
+
+class AlertEngine:
+    """
+    Evaluates readings as they are ingested
+
+    Enabled with ALERT_EVALUATION_ENABLED. States live in this worker
+    (ALERT_STATE_BACKEND=memory) or in Redis (redis) so that readings of one
+    equipment handled by different workers share them.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.backend = MemoryBackend()
+
+    def init_app(self, app):
+        self.enabled = app.config['ALERT_EVALUATION_ENABLED']
+        if app.config['ALERT_STATE_BACKEND'] == 'redis':
+            self.backend = RedisBackend(app.config['REDIS_URL'])
+        else:
+            self.backend = MemoryBackend()
+
+    def clear(self):
+        """Forget every rule state"""
+        self.backend.clear()
+
+    def evaluate(self, rows):
+        """
+        Advance the rule states with new readings
+
+        Readings older than the last one evaluated for a rule (replays) are
+        ignored.
+
+        Args:
+            rows: telemetry row dicts (time, equipment_id, sensor fields)
+
+        Returns:
+            list of (equipment_id, rule, message values, reading time) matches
+            for open_alert_index.record()
+        """
+        readings = defaultdict(list)
+        for row in rows:
+            readings[row['equipment_id']].append(row)
+
+        matches = []
+        for equipment_id, equipment_rows in readings.items():
+            rules = [rule for rule in rule_index.effective(equipment_id) if rule.matches is not None]
+            if not rules:
+                continue
+            states = self.backend.load(equipment_id)
+            equipment_rows.sort(key=itemgetter('time'))
+            for row in equipment_rows:
+                for rule in rules:
+                    match = self._step(equipment_id, rule, states, row)
+                    if match is not None:
+                        matches.append(match)
+            self.backend.save(equipment_id, states)
+        return matches
+
+    @staticmethod
+    def _step(equipment_id, rule, states, row):
+        value = row.get(rule.field)
+        if value is None:
+            return None
+        key = str(rule.id)
+        state = states.get(key)
+        if state is None:
+            state = states[key] = RuleState()
+        elif state.last_time is not None and row['time'] <= state.last_time:
+            return None
+        state.last_time = row['time']
+        state.last_value = value
+
+        if not rule.matches(value):
+            state.since = None
+            return None
+        if state.since is None:
+            state.since = row['time']
+        if (row['time'] - state.since).total_seconds() < rule.duration:
+            return None
+        return equipment_id, rule, {'threshold': rule.threshold, 'value': value}, row['time']
+
+    def process(self, rows):
+        """
+        Evaluate ingested rows and record their matches
+
+        Failures are logged and never fail the ingest request.
+
+        Returns:
+            number of alerts created
+        """
+        if not self.enabled or not rows:
+            return 0
+        try:
+            return open_alert_index.record(self.evaluate(rows))
+        except Exception:
+            db.session.rollback()
+            logger.exception('Alert evaluation failed for %d readings', len(rows))
+            return 0
+
+
+alert_engine = AlertEngine()
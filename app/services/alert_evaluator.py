@@ -0,0 +1,184 @@
+"""
+Periodic Alert Evaluator
+Set-based evaluation of alert rules over the recent telemetry window
+
+Fallback for the inline alert_engine: it sees readings the inline path does
+not evaluate (backlog replays, the async gateway) and conditions whose
+inline state was lost with a worker restart. Each rule type with active
+rules is evaluated for every equipment by one INSERT ... SELECT: the
+effective rules are resolved in SQL (equipment > company > global), the
+readings of each rule's duration window are reduced with bool_and per
+time_bucket. Where the condition held for every reading of the window and
+for the last reading before it (found within one more duration), an alert
+is inserted, or the open alert of the rule only gets a new last_matched_at.
+Rules with no duration match on the latest reading of the last evaluation
+interval.
+"""
+from datetime import datetime, timedelta, timezone
+from operator import eq, ge, gt, le, lt
+
+from flask import current_app
+from sqlalchemy import (
+    DateTime, Interval, Numeric, Text, and_, case, cast, func, literal, literal_column, or_, select
+)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app import db
+from app.models import (
+    Alert, AlertRule, AlertRuleScope, ComparisonOperator, Equipment, Telemetry
+)
+from app.services.open_alerts import open_alert_index, upsert_on_open_alert
+from app.services.rule_index import DEFAULT_THRESHOLDS, RULE_FIELDS
+
+SQL_OPERATORS = {
+    ComparisonOperator.GT: gt,
+    ComparisonOperator.LT: lt,
+    ComparisonOperator.EQ: eq,
+    ComparisonOperator.GTE: ge,
+    ComparisonOperator.LTE: le,
+}
+
+SCOPE_PRIORITY = case(
+    (AlertRule.scope == AlertRuleScope.EQUIPMENT, 3),
+    (AlertRule.scope == AlertRuleScope.COMPANY, 2),
+    else_=1
+)
+
+ALERT_COLUMNS = ('id', 'equipment_id', 'alert_rule_id', 'type', 'severity', 'message', 'last_matched_at')
+
+SECOND = literal_column("INTERVAL '1 second'", Interval)
+
+
+def _threshold(rule_type):
+    if rule_type in DEFAULT_THRESHOLDS:
+        return func.coalesce(AlertRule.threshold_value, DEFAULT_THRESHOLDS[rule_type])
+    return AlertRule.threshold_value
+
+
+def _effective_rules(rule_type):
+    """Subquery of (equipment_id, rule_id, operator, threshold, duration) of the winning scope"""
+    ranked = select(
+        Equipment.id.label('equipment_id'),
+        AlertRule.id.label('rule_id'),
+        AlertRule.comparison_operator.label('operator'),
+        _threshold(rule_type).label('threshold'),
+        AlertRule.duration_seconds.label('duration'),
+        func.rank().over(partition_by=Equipment.id, order_by=SCOPE_PRIORITY.desc()).label('rank'),
+    ).join(AlertRule, and_(
+        AlertRule.is_active.is_(True),
+        AlertRule.rule_type == rule_type,
+        or_(
+            AlertRule.scope == AlertRuleScope.GLOBAL,
+            and_(AlertRule.scope == AlertRuleScope.COMPANY, AlertRule.scope_id == Equipment.company_id),
+            and_(AlertRule.scope == AlertRuleScope.EQUIPMENT, AlertRule.scope_id == Equipment.id),
+        )
+    )).subquery('ranked')
+    return select(ranked).where(ranked.c.rank == 1, ranked.c.threshold.isnot(None)).subquery('effective')
+
+
+def _matches(operator, value, threshold):
+    return case(*((operator == key, compare(value, threshold)) for key, compare in SQL_OPERATORS.items()))
+
+
+def _as_text(value):
+    return cast(func.trim_scale(cast(value, Numeric)), Text)
+
+
+def _render(template, values):
+    """Replace {{name}} placeholders in SQL, formatting numbers like the inline engine"""
+    for name, value in values.items():
+        template = func.regexp_replace(template, r'\{\{\s*' + name + r'\s*\}\}', _as_text(value), 'g')
+    return template
+
+
+def alerts_query(rule_type, field, now, width, lookback):
+    """
+    SELECT of the alerts to insert for one rule type
+
+    Args:
+        field: telemetry column the rule type watches
+        now: end of the evaluated windows
+        width: time_bucket width
+        lookback: twice the longest duration of the type (at least width),
+                  the constant lower time bound of the hypertable scan
+    """
+    effective = _effective_rules(rule_type)
+    value = getattr(Telemetry, field)
+    now = literal(now, DateTime(timezone=True))
+    # Instant rules look at the readings of the last evaluation interval, and nothing before it
+    instant = effective.c.duration == 0
+    window_start = case((instant, now - literal(width, Interval)), else_=now - effective.c.duration * SECOND)
+    matches = _matches(effective.c.operator, value, effective.c.threshold)
+    in_window = Telemetry.time > window_start
+
+    # One row per (equipment, rule, bucket) of the window and of the duration before it
+    buckets = select(
+        Telemetry.equipment_id,
+        effective.c.rule_id,
+        instant.label('instant'),
+        func.bool_and(matches).filter(in_window).label('held'),
+        func.last(matches, Telemetry.time).filter(in_window).label('held_last'),
+        func.last(matches, Telemetry.time).filter(~in_window).label('held_before'),
+        func.max(Telemetry.time).filter(~in_window).label('before'),
+        func.last(value, Telemetry.time).label('value'),
+        func.max(Telemetry.time).label('until'),
+    ).join(effective, effective.c.equipment_id == Telemetry.equipment_id).where(
+        value.isnot(None),
+        Telemetry.time > now - lookback,
+        Telemetry.time > window_start - effective.c.duration * SECOND,
+        Telemetry.time <= now,
+    ).group_by(
+        Telemetry.equipment_id, effective.c.rule_id, effective.c.duration, func.time_bucket(width, Telemetry.time)
+    ).subquery('buckets')
+
+    windows = select(
+        buckets.c.equipment_id,
+        buckets.c.rule_id,
+        case(
+            (buckets.c.instant, func.last(buckets.c.held_last, buckets.c.until)),
+            else_=func.bool_and(buckets.c.held)
+        ).label('held'),
+        case(
+            (buckets.c.instant, True),
+            else_=func.last(buckets.c.held_before, buckets.c.before).filter(buckets.c.before.isnot(None))
+        ).label('held_before'),
+        func.last(buckets.c.value, buckets.c.until).label('value'),
+    ).group_by(buckets.c.equipment_id, buckets.c.rule_id, buckets.c.instant).subquery('windows')
+
+    message = _render(AlertRule.message_template, {'threshold': _threshold(rule_type), 'value': windows.c.value})
+    return select(
+        func.gen_random_uuid(), windows.c.equipment_id, AlertRule.id, AlertRule.rule_type, AlertRule.severity,
+        message, now
+    ).join(AlertRule, AlertRule.id == windows.c.rule_id).where(
+        # NULL (no reading in the window) does not pass
+        windows.c.held,
+        windows.c.held_before,
+    )
+
+
+def evaluate_rules(now=None):
+    """
+    Match the rules of every active rule type, one statement per type
+
+    Args:
+        now: end of the evaluated windows (default: current time)
+
+    Returns:
+        number of alerts created
+    """
+    now = now or datetime.now(timezone.utc)
+    width = timedelta(seconds=current_app.config['ALERT_EVALUATION_INTERVAL'])
+    durations = db.session.query(AlertRule.rule_type, func.max(AlertRule.duration_seconds))\
+        .filter(AlertRule.is_active.is_(True))\
+        .group_by(AlertRule.rule_type).all()
+
+    returned = []
+    for rule_type, duration in durations:
+        field = RULE_FIELDS.get(rule_type)
+        if field is None:
+            continue
+        lookback = max(timedelta(seconds=2 * duration), width)
+        statement = pg_insert(Alert).from_select(ALERT_COLUMNS, alerts_query(rule_type, field, now, width, lookback))
+        returned.extend(db.session.execute(upsert_on_open_alert(statement)).all())
+    db.session.commit()
+    return open_alert_index.opened(returned)
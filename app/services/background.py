@@ -0,0 +1,55 @@
+"""
+Background Workers
+Periodic daemon threads used by the in-process services
+"""
+import atexit
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicWorker:
+    """
+    Runs `target` every `interval` seconds (or sooner when woken up)
+
+    On stop, and at interpreter exit, the loop is ended and `target` runs
+    one final time so pending work is drained.
+    """
+
+    def __init__(self, name, interval, target):
+        self.name = name
+        self.interval = interval
+        self.target = target
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def wake(self):
+        self._wakeup.set()
+
+    def _tick(self):
+        try:
+            self.target()
+        except Exception:
+            logger.exception('%s tick failed', self.name)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            if not self._stopping.is_set():
+                self._tick()
+
+    def stop(self):
+        if self._thread is None or self._stopping.is_set():
+            return
+        self._stopping.set()
+        self._wakeup.set()
+        self._thread.join(timeout=self.interval * 2)
+        self._tick()
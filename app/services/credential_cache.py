@@ -0,0 +1,219 @@
+"""
+Equipment Credential Cache
+Per-worker TTL/LRU cache of equipment API-key credentials for the ingest path
+"""
+from collections import OrderedDict, namedtuple
+import hashlib
+import hmac
+import json
+import logging
+import threading
+import time
+import uuid
+
+from app import db
+from app.models import Equipment, Company, CompanyStatus
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'equipment:credentials'
+
+EquipmentCredential = namedtuple(
+    'EquipmentCredential',
+    ['equipment_id', 'company_id', 'company_status', 'key_hash']
+)
+
+
+def hash_api_key(api_key):
+    """SHA-256 digest of an API key; plaintext keys are never cached"""
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+
+
+class CredentialCache:
+    """
+    Maps serial -> EquipmentCredential (or None for unknown serials)
+
+    Entries expire after CREDENTIAL_CACHE_TTL seconds, unknown serials after
+    CREDENTIAL_CACHE_NEGATIVE_TTL seconds, and the least recently used entry
+    is evicted beyond CREDENTIAL_CACHE_MAX_ENTRIES. Equipment and company
+    routes invalidate entries in the worker that handled the change; with
+    CREDENTIAL_CACHE_BACKEND=redis the invalidation is also published so
+    that every worker (and the ingestion gateway) drops the entry, otherwise
+    other workers pick the change up when their entry expires.
+    """
+
+    def __init__(self, ttl=300, negative_ttl=30, max_entries=10000):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._origin = uuid.uuid4().hex
+        self._redis = None
+        self._listener = None
+
+    def init_app(self, app):
+        self.ttl = app.config['CREDENTIAL_CACHE_TTL']
+        self.negative_ttl = app.config['CREDENTIAL_CACHE_NEGATIVE_TTL']
+        self.max_entries = app.config['CREDENTIAL_CACHE_MAX_ENTRIES']
+        self.clear()
+        self._redis = None
+        if app.config['CREDENTIAL_CACHE_BACKEND'] == 'redis':
+            import redis
+
+            self._redis = redis.Redis.from_url(app.config['REDIS_URL'])
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name='credential-cache', daemon=True)
+                self._listener.start()
+
+    def _get(self, serial, now):
+        """Return (hit, credential) for a serial"""
+        with self._lock:
+            entry = self._entries.get(serial)
+            if entry is None:
+                return False, None
+            expires_at, credential = entry
+            if expires_at <= now:
+                del self._entries[serial]
+                return False, None
+            self._entries.move_to_end(serial)
+            return True, credential
+
+    def _put(self, serial, credential, now):
+        ttl = self.ttl if credential is not None else self.negative_ttl
+        with self._lock:
+            self._entries[serial] = (now + ttl, credential)
+            self._entries.move_to_end(serial)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _load(self, serials, now):
+        """Load credentials for the given serials with one query"""
+        rows = db.session.query(
+            Equipment.serial, Equipment.id, Equipment.company_id,
+            Company.status, Equipment.api_key
+        ).join(Company, Equipment.company_id == Company.id)\
+            .filter(Equipment.serial.in_(list(serials))).all()
+        return self._store_loaded(rows, serials, now)
+
+    def _lookup(self, serials, now):
+        """Split serials into cached credentials and misses"""
+        result = {}
+        misses = []
+        for serial in set(serials):
+            hit, credential = self._get(serial, now)
+            if hit:
+                result[serial] = credential
+            else:
+                misses.append(serial)
+        return result, misses
+
+    def _store_loaded(self, rows, serials, now):
+        """Cache (serial, id, company_id, company status, api_key) rows and negative entries"""
+        loaded = {
+            serial: EquipmentCredential(equipment_id, company_id, status, hash_api_key(api_key))
+            for serial, equipment_id, company_id, status, api_key in rows
+        }
+        for serial in serials:
+            self._put(serial, loaded.get(serial), now)
+        return loaded
+
+    def get_many(self, serials):
+        """Return a dict serial -> credential (None when the serial is unknown)"""
+        now = time.monotonic()
+        result, misses = self._lookup(serials, now)
+        if misses:
+            loaded = self._load(misses, now)
+            for serial in misses:
+                result[serial] = loaded.get(serial)
+        return result
+
+    def authenticate(self, serial, api_key):
+        """Return the credential if the serial exists and the key matches, else None"""
+        return self.authenticate_many({serial: api_key}).get(serial)
+
+    def authenticate_many(self, credentials):
+        """
+        Authenticate several serials at once
+
+        Args:
+            credentials: dict mapping serial -> api_key
+
+        Returns:
+            dict mapping serial -> EquipmentCredential for every serial whose
+            key matched; failed serials are absent
+        """
+        return self.match_keys(self.get_many(credentials), credentials)
+
+    @staticmethod
+    def match_keys(cached, credentials):
+        """Keep the cached credentials whose key hash matches the presented key"""
+        return {
+            serial: credential
+            for serial, credential in cached.items()
+            if credential is not None
+            and hmac.compare_digest(credential.key_hash, hash_api_key(credentials[serial]))
+        }
+
+    def invalidate(self, serial):
+        """Drop a serial's entry (call after commit)"""
+        self._notify('serial', serial)
+
+    def invalidate_company(self, company_id):
+        """Drop every cached credential belonging to a company"""
+        self._notify('company', str(company_id))
+
+    def invalidate_equipment(self, equipment_ids):
+        """Drop the credentials of equipment ids, e.g. equipment found deleted on write"""
+        for equipment_id in equipment_ids:
+            self._notify('equipment', str(equipment_id))
+
+    def _notify(self, kind, key):
+        self._apply(kind, key)
+        if self._redis is not None:
+            try:
+                self._redis.publish(CHANNEL, json.dumps([self._origin, kind, key]))
+            except Exception:
+                logger.exception('Could not publish credential invalidation %s %s', kind, key)
+
+    def _apply(self, kind, key):
+        with self._lock:
+            if kind == 'serial':
+                self._entries.pop(key, None)
+                return
+            attribute = 'company_id' if kind == 'company' else 'equipment_id'
+            stale = [
+                serial for serial, (_, credential) in self._entries.items()
+                if credential is not None and str(getattr(credential, attribute)) == key
+            ]
+            for serial in stale:
+                del self._entries[serial]
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(CHANNEL)
+                # Invalidations published while unsubscribed were missed
+                self.clear()
+                for message in pubsub.listen():
+                    origin, kind, key = json.loads(message['data'])
+                    if origin != self._origin:
+                        self._apply(kind, key)
+            except Exception:
+                logger.exception('Credential cache subscription lost')
+                time.sleep(1)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+credential_cache = CredentialCache()
+
+
+def is_company_active(credential):
+    return credential.company_status == CompanyStatus.ACTIVE
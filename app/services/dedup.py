@@ -0,0 +1,109 @@
+"""
+Reading Deduplication
+Per-equipment sliding windows over device sequence numbers
+"""
+from collections import OrderedDict
+import threading
+
+
+class SequenceWindow:
+    """
+    Anti-replay window over the last `size` sequence numbers of one device
+
+    Bit i of `mask` records whether `highest - i` has been seen, so checking
+    and recording a sequence number is O(1). A device that resets its
+    counter when it restarts sends a higher `boot` with it, which starts a
+    new window; without one, a counter restart is recognised once seq jumps
+    back a full window or more (retries never lag that far).
+    """
+
+    __slots__ = ('highest', 'mask', 'size', 'boot')
+
+    def __init__(self, size):
+        self.highest = None
+        self.mask = 0
+        self.size = size
+        self.boot = None
+
+    def accept(self, seq, boot=None):
+        """Record seq; returns False when it was already seen"""
+        if boot is not None and boot != self.boot:
+            if self.boot is not None and boot < self.boot:
+                # Sent before the device's last restart: a stale retry
+                return False
+            self.boot = boot
+            self.highest = None
+            self.mask = 0
+
+        if self.highest is None or seq > self.highest:
+            shift = seq - self.highest if self.highest is not None else self.size
+            self.mask = ((self.mask << shift) | 1) & ((1 << self.size) - 1) if shift < self.size else 1
+            self.highest = seq
+            return True
+
+        offset = self.highest - seq
+        if offset >= self.size:
+            # Jumped back past the whole window: the counter restarted
+            self.highest = seq
+            self.mask = 1
+            return True
+
+        bit = 1 << offset
+        if self.mask & bit:
+            return False
+        self.mask |= bit
+        return True
+
+    def forget(self, seq, boot=None):
+        """Un-record seq after a failed write so the device's retry is accepted"""
+        if boot is not None and boot != self.boot:
+            return
+        if self.highest is not None and 0 <= self.highest - seq < self.size:
+            self.mask &= ~(1 << (self.highest - seq))
+
+
+class SequenceDeduplicator:
+    """
+    Windows for every equipment seen by this worker, evicted LRU-first
+
+    Retries that reach another worker are caught by the INSERT's
+    ON CONFLICT DO NOTHING when the device supplied its own timestamp.
+    """
+
+    def __init__(self, window_size=1024, max_equipments=50000):
+        self.window_size = window_size
+        self.max_equipments = max_equipments
+        self._windows = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.window_size = app.config['TELEMETRY_DEDUP_WINDOW']
+        self.max_equipments = app.config['TELEMETRY_DEDUP_MAX_EQUIPMENTS']
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._windows.clear()
+
+    def _window(self, equipment_id):
+        window = self._windows.get(equipment_id)
+        if window is None:
+            window = self._windows[equipment_id] = SequenceWindow(self.window_size)
+            while len(self._windows) > self.max_equipments:
+                self._windows.popitem(last=False)
+        else:
+            self._windows.move_to_end(equipment_id)
+        return window
+
+    def accept(self, equipment_id, seq, boot=None):
+        with self._lock:
+            return self._window(equipment_id).accept(seq, boot)
+
+    def forget(self, equipment_id, seq, boot=None):
+        with self._lock:
+            window = self._windows.get(equipment_id)
+            if window is not None:
+                window.forget(seq, boot)
+
+
+sequence_deduplicator = SequenceDeduplicator()
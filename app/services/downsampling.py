@@ -0,0 +1,52 @@
+"""
+Downsampling
+Largest-Triangle-Three-Buckets over NumPy arrays
+"""
+import numpy as np
+
+
+def lttb(x, y, threshold):
+    """
+    Indices of the points LTTB keeps out of (x, y)
+
+    The first and last points are always kept; every other bucket keeps the
+    point forming the largest triangle with the previously kept point and
+    the average of the next bucket, which preserves peaks and excursions.
+
+    Args:
+        x: increasing float array (e.g. epoch seconds)
+        y: float array of the same length, without NaN
+        threshold: number of points to keep (at least 3)
+
+    Returns:
+        sorted int array of indices into x and y
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    buckets = threshold - 2
+
+    def edge(i):
+        # Bucket i covers points [edge(i), edge(i + 1)); integer division
+        # keeps the last edge exactly at n - 1
+        return i * (n - 2) // buckets + 1
+
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+
+    a = 0
+    for i in range(buckets):
+        start, end = edge(i), edge(i + 1)
+        next_end = min(edge(i + 2), n)
+
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        areas = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(np.argmax(areas))
+        indices[i + 1] = a
+    return indices
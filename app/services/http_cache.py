@@ -0,0 +1,79 @@
+"""
+HTTP Caching
+ETag / Cache-Control for telemetry reads
+
+A range that ends before the ingestion horizon (TELEMETRY_CACHE_HORIZON
+seconds) only changes when readings are written behind the horizon
+(replayed backlogs, late batches), which stamps the equipment's
+history_changed_at. Its ETag is derived from the request and that stamp,
+so a matching If-None-Match is answered with 304 after one lookup instead
+of the telemetry query. Such responses must be revalidated (no-cache);
+ranges that reach past the horizon (or have no end) get a short max-age
+instead.
+"""
+from datetime import datetime, timedelta, timezone
+import hashlib
+import hmac
+import json
+
+from flask import current_app, request
+
+
+def is_closed_range(end, now=None):
+    """True when `end` lies before the ingestion horizon (naive datetimes are UTC)"""
+    if end is None:
+        return False
+    if end.tzinfo is None:
+        end = end.replace(tzinfo=timezone.utc)
+    now = now or datetime.now(timezone.utc)
+    return end < now - timedelta(seconds=current_app.config['TELEMETRY_CACHE_HORIZON'])
+
+
+def request_etag(identity=None, version=None):
+    """
+    ETag of the current request: path, query arguments, caller identity and
+    data version
+
+    Keyed with SECRET_KEY so tags cannot be forged for requests that were
+    never answered.
+    """
+    message = json.dumps(
+        [request.path, sorted(request.args.items(multi=True)), identity, version],
+        default=str, separators=(',', ':')
+    )
+    key = current_app.config['SECRET_KEY'].encode()
+    return hmac.new(key, message.encode(), hashlib.sha256).hexdigest()[:32]
+
+
+def range_etag(end, identity=None, version=None):
+    """
+    ETag for a telemetry range, or None when the range may still change
+
+    Args:
+        version: callable returning the data version of the range, only
+            called for closed ranges
+
+    Returns:
+        (etag, not_modified) where not_modified is True when the client
+        already holds this response
+    """
+    if not is_closed_range(end):
+        return None, False
+    etag = request_etag(identity, version() if version is not None else None)
+    return etag, etag in request.if_none_match
+
+
+def not_modified(etag):
+    """Empty 304 response carrying the cache headers of the original"""
+    return cache_headers(current_app.response_class(status=304), etag)
+
+
+def cache_headers(response, etag):
+    """Revalidation against etag when set, otherwise a short max-age"""
+    response.cache_control.private = True
+    if etag is None:
+        response.cache_control.max_age = current_app.config['TELEMETRY_CACHE_MAX_AGE']
+        return response
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
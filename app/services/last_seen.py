@@ -0,0 +1,208 @@
+"""
+Last-Seen Tracker
+Coalesces equipment last-seen timestamps and flushes them with one UPDATE
+"""
+from datetime import datetime, timezone
+import threading
+import uuid
+
+from sqlalchemy import DateTime, column, update, values
+from sqlalchemy.dialects.postgresql import UUID
+
+from app import db
+from app.models import Equipment
+from app.services.background import PeriodicWorker
+
+# KEYS: hashes to update; ARGV: equipment id / timestamp pairs
+# Timestamps are fixed-width UTC ISO strings, so they compare as text
+MAX_MERGE_SCRIPT = """
+for i = 1, #ARGV, 2 do
+    for _, key in ipairs(KEYS) do
+        local current = redis.call('HGET', key, ARGV[i])
+        if not current or current < ARGV[i + 1] then
+            redis.call('HSET', key, ARGV[i], ARGV[i + 1])
+        end
+    end
+end
+return 0
+"""
+
+
+def _encode(seen_at):
+    return seen_at.astimezone(timezone.utc).isoformat(timespec='microseconds')
+
+
+class MemoryBackend:
+    """Per-worker dicts of the freshest and the not-yet-flushed timestamps"""
+
+    def __init__(self):
+        self._latest = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def touch(self, equipment_ids, seen_at):
+        with self._lock:
+            for equipment_id in equipment_ids:
+                key = str(equipment_id)
+                current = self._latest.get(key)
+                if current is None or current < seen_at:
+                    self._latest[key] = seen_at
+                    self._pending[key] = seen_at
+
+    def get_many(self, equipment_ids):
+        return {key: self._latest[key] for key in map(str, equipment_ids) if key in self._latest}
+
+    def drain(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return pending
+
+    def restore(self, pending):
+        with self._lock:
+            for key, seen_at in pending.items():
+                current = self._pending.get(key)
+                if current is None or current < seen_at:
+                    self._pending[key] = seen_at
+
+    def clear(self):
+        with self._lock:
+            self._latest.clear()
+            self._pending.clear()
+
+
+class RedisBackend:
+    """Redis hashes shared by every worker"""
+
+    def __init__(self, redis_url, key='equipment:last_seen'):
+        import redis
+
+        self.key = key
+        self.pending_key = f'{key}:pending'
+        self._redis = redis.Redis.from_url(redis_url)
+        self._max_merge = self._redis.register_script(MAX_MERGE_SCRIPT)
+
+    def touch(self, equipment_ids, seen_at):
+        value = _encode(seen_at)
+        args = [item for equipment_id in equipment_ids for item in (str(equipment_id), value)]
+        if args:
+            # Never moves a timestamp back, whichever worker writes last
+            self._max_merge(keys=[self.key, self.pending_key], args=args)
+
+    def get_many(self, equipment_ids):
+        keys = [str(equipment_id) for equipment_id in equipment_ids]
+        if not keys:
+            return {}
+        return {
+            key: datetime.fromisoformat(value.decode())
+            for key, value in zip(keys, self._redis.hmget(self.key, keys)) if value
+        }
+
+    def drain(self):
+        # Move the pending hash aside atomically so concurrent touches are kept
+        draining_key = f'{self.pending_key}:{uuid.uuid4().hex}'
+        if not self._redis.exists(self.pending_key):
+            return {}
+        try:
+            self._redis.rename(self.pending_key, draining_key)
+        except Exception:
+            return {}
+        raw = self._redis.hgetall(draining_key)
+        self._redis.delete(draining_key)
+        return {k.decode(): datetime.fromisoformat(v.decode()) for k, v in raw.items()}
+
+    def restore(self, pending):
+        # Touches since the drain may hold newer timestamps; keep those
+        args = [item for key, seen_at in pending.items() for item in (key, _encode(seen_at))]
+        if args:
+            self._max_merge(keys=[self.pending_key], args=args)
+
+    def clear(self):
+        self._redis.delete(self.key, self.pending_key)
+
+
+class LastSeenTracker:
+    """
+    Keeps equipment last-seen timestamps off the ingest path
+
+    Readings only record the time in memory (or Redis); every
+    LAST_SEEN_FLUSH_INTERVAL seconds all changed equipments are written with
+    a single UPDATE ... FROM (VALUES ...), so the equipments row and its
+    updated_at trigger are touched once per interval instead of per reading.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.backend = MemoryBackend()
+        self._worker = None
+
+    def init_app(self, app):
+        # A previous init_app's worker drains into its old backend before being replaced
+        if self._worker is not None:
+            self._worker.stop()
+            self._worker = None
+        self.app = app
+        if app.config['LAST_SEEN_BACKEND'] == 'redis':
+            self.backend = RedisBackend(app.config['REDIS_URL'])
+        else:
+            self.backend = MemoryBackend()
+        self._worker = PeriodicWorker('last-seen-flusher', app.config['LAST_SEEN_FLUSH_INTERVAL'], self.flush)
+        if app.config['BACKGROUND_WORKERS_ENABLED']:
+            self._worker.start()
+
+    def touch(self, equipment_ids, seen_at):
+        self.backend.touch(equipment_ids, seen_at)
+
+    def clear(self):
+        """Forget every tracked and pending timestamp"""
+        self.backend.clear()
+
+    def get_many(self, equipment_ids):
+        """Tracked timestamps of several equipments with one lookup (str id -> datetime)"""
+        return self.backend.get_many(equipment_ids)
+
+    def merge(self, equipment_id, stored, tracked=None):
+        """
+        Return the fresher of the stored and the tracked timestamp
+
+        Args:
+            tracked: optional get_many() result covering the equipment, so
+                     that a page of rows costs a single lookup
+        """
+        if tracked is None:
+            tracked = self.backend.get_many([equipment_id])
+        tracked = tracked.get(str(equipment_id))
+        if tracked is None:
+            return stored
+        if stored is None or stored < tracked:
+            return tracked
+        return stored
+
+    def flush(self):
+        """Write all pending timestamps with one set-based UPDATE"""
+        pending = self.backend.drain()
+        if not pending:
+            return 0
+
+        seen = values(
+            column('id', UUID(as_uuid=True)),
+            column('last_seen_at', DateTime(timezone=True)),
+            name='seen'
+        ).data([(uuid.UUID(key), seen_at) for key, seen_at in pending.items()])
+
+        statement = update(Equipment)\
+            .where(Equipment.id == seen.c.id)\
+            .where(db.or_(Equipment.last_seen_at.is_(None), Equipment.last_seen_at < seen.c.last_seen_at))\
+            .values(last_seen_at=seen.c.last_seen_at)\
+            .execution_options(synchronize_session=False)
+
+        try:
+            with self.app.app_context():
+                db.session.execute(statement)
+                db.session.commit()
+        except Exception:
+            self.backend.restore(pending)
+            raise
+        return len(pending)
+
+
+last_seen_tracker = LastSeenTracker()
@@ -0,0 +1,381 @@
+"""
+Offline Detector
+Declares equipment offline when no reading arrived in twice its expected interval (PRD 6.2)
+
+Every reading moves the deadline of its equipment to the arrival time plus
+OFFLINE_INTERVAL_FACTOR times the equipment's expected interval, a moving
+average of the gaps between its arrivals (OFFLINE_DEFAULT_INTERVAL until the
+second one, capped at OFFLINE_MAX_INTERVAL). Deadlines are kept in a
+min-heap (memory) or a Redis sorted set (redis), so a tick only pops the
+equipment whose deadline passed instead of scanning the fleet: they are set
+to OFFLINE and match their effective equipment_offline rules, and equipment
+that reported again after being declared offline is set back to OPERATIONAL
+with its equipment_offline alerts resolved.
+"""
+from datetime import datetime, timedelta, timezone
+import heapq
+import logging
+import threading
+import uuid
+
+from sqlalchemy import DateTime, column, func, update, values
+from sqlalchemy.dialects.postgresql import UUID
+
+from app import db
+from app.models import Alert, AlertRuleType, AlertStatus, Equipment, EquipmentStatus
+from app.services.background import PeriodicWorker
+from app.services.last_seen import last_seen_tracker
+from app.services.open_alerts import OPEN_STATUSES, open_alert_index
+from app.services.rule_index import rule_index
+
+logger = logging.getLogger(__name__)
+
+# Weight of the newest gap in the expected interval
+SMOOTHING = 0.2
+MIN_INTERVAL = 5  # seconds
+
+# Equipment popped and updated per statement
+EXPIRE_BATCH = 1000
+
+# A database last_seen_at up to this much newer than the popped one is the same reading
+SEEN_TOLERANCE = timedelta(seconds=1)
+
+# KEYS: deadlines, seen, recovered
+# ARGV: now, factor, default, min, max, smoothing, then equipment ids
+TOUCH_SCRIPT = """
+local now, factor, default = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local low, high, smoothing = tonumber(ARGV[4]), tonumber(ARGV[5]), tonumber(ARGV[6])
+for i = 7, #ARGV do
+    local key = ARGV[i]
+    local interval = default
+    local state = redis.call('HGET', KEYS[2], key)
+    if state then
+        local last, previous = string.match(state, '(%S+) (%S+)')
+        interval = tonumber(previous)
+        if redis.call('ZSCORE', KEYS[1], key) then
+            interval = math.min(high, math.max(low, interval + smoothing * (now - tonumber(last) - interval)))
+        else
+            redis.call('SADD', KEYS[3], key)
+        end
+    else
+        redis.call('SADD', KEYS[3], key)
+    end
+    redis.call('HSET', KEYS[2], key, string.format('%.3f %.3f', now, interval))
+    redis.call('ZADD', KEYS[1], now + factor * interval, key)
+end
+return 0
+"""
+
+# KEYS: deadlines, seen; ARGV: now, limit
+# Returns equipment id / last arrival pairs of the popped deadlines
+EXPIRE_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+local result = {}
+for _, key in ipairs(expired) do
+    redis.call('ZREM', KEYS[1], key)
+    local state = redis.call('HGET', KEYS[2], key)
+    table.insert(result, key)
+    table.insert(result, state and string.match(state, '(%S+)') or '0')
+end
+return result
+"""
+
+
+def next_interval(interval, gap, max_interval):
+    return min(max_interval, max(MIN_INTERVAL, interval + SMOOTHING * (gap - interval)))
+
+
+class MemoryBackend:
+    """Deadlines of the equipment seen by this worker"""
+
+    def __init__(self, factor=2, default_interval=60, max_interval=3600):
+        self.factor = factor
+        self.default_interval = default_interval
+        self.max_interval = max_interval
+        self._heap = []
+        # equipment id -> [deadline (None once offline), last arrival, interval]
+        self._entries = {}
+        self._recovered = set()
+        self._lock = threading.Lock()
+
+    def touch(self, equipment_ids, seen_at):
+        now = seen_at.timestamp()
+        with self._lock:
+            for equipment_id in equipment_ids:
+                key = str(equipment_id)
+                entry = self._entries.get(key)
+                if entry is None:
+                    interval = self.default_interval
+                    self._recovered.add(key)
+                elif entry[0] is None:
+                    interval = entry[2]
+                    self._recovered.add(key)
+                else:
+                    interval = next_interval(entry[2], now - entry[1], self.max_interval)
+                deadline = now + self.factor * interval
+                self._entries[key] = [deadline, now, interval]
+                heapq.heappush(self._heap, (deadline, key))
+            # Superseded deadlines stay in the heap until popped; rebuild when they dominate
+            if len(self._heap) > 2 * len(self._entries) + 1024:
+                self._heap = [(entry[0], key) for key, entry in self._entries.items() if entry[0] is not None]
+                heapq.heapify(self._heap)
+
+    def seed(self, seen):
+        """Track equipment by their stored last-seen time (key -> epoch seconds) unless tracked"""
+        with self._lock:
+            for key, last in seen.items():
+                entry = self._entries.get(key)
+                if entry is None or entry[0] is None:
+                    deadline = last + self.factor * self.default_interval
+                    self._entries[key] = [deadline, last, self.default_interval]
+                    heapq.heappush(self._heap, (deadline, key))
+
+    def expire(self, now, limit):
+        """Pop up to `limit` passed deadlines; returns {key: last arrival (epoch seconds)}"""
+        expired = {}
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now and len(expired) < limit:
+                deadline, key = heapq.heappop(self._heap)
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] == deadline:
+                    entry[0] = None
+                    expired[key] = entry[1]
+        return expired
+
+    def recovered(self):
+        """Drain the equipment that reported after being declared offline (or first seen)"""
+        with self._lock:
+            recovered, self._recovered = self._recovered, set()
+        return recovered
+
+    def clear(self):
+        with self._lock:
+            self._heap.clear()
+            self._entries.clear()
+            self._recovered.clear()
+
+
+class RedisBackend:
+    """Deadlines shared by every worker and the ingestion gateway"""
+
+    def __init__(self, redis_url, factor=2, default_interval=60, max_interval=3600, prefix='equipment:offline'):
+        import redis
+
+        self.factor = factor
+        self.default_interval = default_interval
+        self.max_interval = max_interval
+        self.deadlines_key = f'{prefix}:deadlines'
+        self.seen_key = f'{prefix}:seen'
+        self.recovered_key = f'{prefix}:recovered'
+        self._redis = redis.Redis.from_url(redis_url)
+        self._touch = self._redis.register_script(TOUCH_SCRIPT)
+        self._expire = self._redis.register_script(EXPIRE_SCRIPT)
+
+    def touch(self, equipment_ids, seen_at):
+        if not equipment_ids:
+            return
+        self._touch(
+            keys=[self.deadlines_key, self.seen_key, self.recovered_key],
+            args=[
+                seen_at.timestamp(), self.factor, self.default_interval, MIN_INTERVAL, self.max_interval, SMOOTHING,
+                *(str(equipment_id) for equipment_id in equipment_ids)
+            ]
+        )
+
+    def seed(self, seen):
+        if not seen:
+            return
+        pipe = self._redis.pipeline(transaction=False)
+        for key, last in seen.items():
+            pipe.hsetnx(self.seen_key, key, f'{last:.3f} {self.default_interval:.3f}')
+        pipe.zadd(self.deadlines_key, {
+            key: last + self.factor * self.default_interval for key, last in seen.items()
+        }, nx=True)
+        pipe.execute()
+
+    def expire(self, now, limit):
+        flat = self._expire(keys=[self.deadlines_key, self.seen_key], args=[now, limit])
+        return {flat[i].decode(): float(flat[i + 1]) for i in range(0, len(flat), 2)}
+
+    def recovered(self):
+        pipe = self._redis.pipeline()
+        pipe.smembers(self.recovered_key)
+        pipe.delete(self.recovered_key)
+        members, _ = pipe.execute()
+        return {member.decode() for member in members}
+
+    def clear(self):
+        self._redis.delete(self.deadlines_key, self.seen_key, self.recovered_key)
+
+
+def make_backend(config):
+    """Deadline backend selected by OFFLINE_DETECTOR_BACKEND"""
+    options = {
+        'factor': config['OFFLINE_INTERVAL_FACTOR'],
+        'default_interval': config['OFFLINE_DEFAULT_INTERVAL'],
+        'max_interval': config['OFFLINE_MAX_INTERVAL'],
+    }
+    if config['OFFLINE_DETECTOR_BACKEND'] == 'redis':
+        return RedisBackend(config['REDIS_URL'], **options)
+    return MemoryBackend(**options)
+
+
+def _epoch_to_datetime(value):
+    return datetime.fromtimestamp(value, timezone.utc)
+
+
+class OfflineDetector:
+    """
+    Runs the deadline checks every OFFLINE_CHECK_INTERVAL seconds
+
+    The memory backend only knows the equipment that reported to this worker;
+    use redis with several workers or the ingestion gateway. Equipment not
+    offline in the database are tracked from their stored last_seen_at on
+    the first tick (and after a failed tick), so equipment that stopped
+    reporting during a restart are still detected.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.enabled = False
+        self.backend = MemoryBackend()
+        self._worker = None
+        self._seeded = False
+
+    def init_app(self, app):
+        # A previous init_app's worker drains into its old backend before being replaced
+        if self._worker is not None:
+            self._worker.stop()
+            self._worker = None
+        self.app = app
+        self.enabled = app.config['OFFLINE_DETECTION_ENABLED']
+        self.backend = make_backend(app.config)
+        self._seeded = False
+        if self.enabled and app.config['BACKGROUND_WORKERS_ENABLED']:
+            self._worker = PeriodicWorker('offline-detector', app.config['OFFLINE_CHECK_INTERVAL'], self.tick)
+            self._worker.start()
+
+    def clear(self):
+        """Forget every deadline; tracking restarts from the database on the next tick"""
+        self.backend.clear()
+        self._seeded = False
+
+    def touch(self, equipment_ids, seen_at):
+        """Record arrivals (call with the time the readings were received)"""
+        if self.enabled:
+            self.backend.touch(equipment_ids, seen_at)
+
+    def tick(self, now=None):
+        """
+        Apply recoveries and expired deadlines
+
+        Args:
+            now: check time (default: current time)
+
+        Returns:
+            number of alerts created
+        """
+        now = now or datetime.now(timezone.utc)
+        with self.app.app_context():
+            if not self._seeded:
+                self._seed()
+            self._mark_online(self.backend.recovered())
+            created = 0
+            while True:
+                expired = self.backend.expire(now.timestamp(), EXPIRE_BATCH)
+                if not expired:
+                    break
+                created += self._mark_offline(expired, now)
+            return created
+
+    def _seed(self):
+        rows = db.session.query(Equipment.id, Equipment.last_seen_at).filter(
+            Equipment.status != EquipmentStatus.OFFLINE,
+            Equipment.last_seen_at.isnot(None)
+        ).all()
+        self.backend.seed({str(equipment_id): seen_at.timestamp() for equipment_id, seen_at in rows})
+        self._seeded = True
+
+    @staticmethod
+    def _mark_online(keys):
+        """Set recovered equipment back to OPERATIONAL and resolve their equipment_offline alerts"""
+        if not keys:
+            return
+        online = db.session.execute(
+            update(Equipment)
+            .where(Equipment.id.in_([uuid.UUID(key) for key in keys]))
+            .where(Equipment.status == EquipmentStatus.OFFLINE)
+            .values(status=EquipmentStatus.OPERATIONAL)
+            .returning(Equipment.id)
+            .execution_options(synchronize_session=False)
+        ).scalars().all()
+        resolved = []
+        if online:
+            resolved = db.session.execute(
+                update(Alert)
+                .where(Alert.equipment_id.in_(online))
+                .where(Alert.type == AlertRuleType.EQUIPMENT_OFFLINE)
+                .where(Alert.status.in_(OPEN_STATUSES))
+                .values(status=AlertStatus.RESOLVED, resolved_at=func.now())
+                .returning(Alert.equipment_id, Alert.alert_rule_id)
+                .execution_options(synchronize_session=False)
+            ).all()
+        db.session.commit()
+        for alert in resolved:
+            open_alert_index.closed(alert)
+
+    def _mark_offline(self, expired, now):
+        """Set expired equipment OFFLINE and raise their equipment_offline alerts"""
+        # Arrivals reach the database only every LAST_SEEN_FLUSH_INTERVAL; skip equipment the tracker saw since
+        tracked = last_seen_tracker.get_many(expired)
+        expired = {
+            key: last for key, last in expired.items()
+            if key not in tracked or tracked[key] < _epoch_to_datetime(last) + SEEN_TOLERANCE
+        }
+        if not expired:
+            return 0
+        seen = values(
+            column('id', UUID(as_uuid=True)),
+            column('seen_before', DateTime(timezone=True)),
+            name='expired'
+        ).data([
+            (uuid.UUID(key), _epoch_to_datetime(last) + SEEN_TOLERANCE) for key, last in expired.items()
+        ])
+
+        # Skip equipment that meanwhile reported to another worker, or already offline
+        statement = update(Equipment)\
+            .where(Equipment.id == seen.c.id)\
+            .where(Equipment.status != EquipmentStatus.OFFLINE)\
+            .where(db.or_(Equipment.last_seen_at.is_(None), Equipment.last_seen_at < seen.c.seen_before))\
+            .values(status=EquipmentStatus.OFFLINE)\
+            .returning(Equipment.id)\
+            .execution_options(synchronize_session=False)
+
+        try:
+            offline = db.session.execute(statement).scalars().all()
+            db.session.commit()
+            matches = []
+            for equipment_id in offline:
+                last_seen = _epoch_to_datetime(expired[str(equipment_id)])
+                for rule in rule_index.effective(equipment_id):
+                    if rule.rule_type != AlertRuleType.EQUIPMENT_OFFLINE:
+                        continue
+                    message_values = {
+                        'last_seen': last_seen.isoformat(),
+                        'value': int((now - last_seen).total_seconds()),
+                    }
+                    if rule.threshold is not None:
+                        message_values['threshold'] = rule.threshold
+                    matches.append((equipment_id, rule, message_values, now))
+            created = open_alert_index.record(matches)
+        except Exception:
+            db.session.rollback()
+            logger.exception('Marking %d equipments offline failed', len(expired))
+            # Their deadlines were popped; track them again from the database
+            self._seeded = False
+            return 0
+        logger.info('%d equipments went offline', len(offline))
+        return created
+
+
+offline_detector = OfflineDetector()
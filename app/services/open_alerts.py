@@ -0,0 +1,361 @@
+"""
+Open Alert Index
+One open alert per (equipment, rule): repeated matches update it instead of inserting
+
+A rule that keeps matching (a cabinet sitting at 9°C for an hour) raises a
+single alert; later matches only move its last_matched_at. The index maps
+(equipment_id, alert_rule_id) to the id of the open (active or
+acknowledged) alert, per worker (memory) or shared in Redis (redis), so a
+repeated match costs no query: match times are coalesced and written with
+one UPDATE every ALERT_LAST_MATCHED_FLUSH_INTERVAL seconds. New alerts are
+inserted with ON CONFLICT on the partial unique index alerts_open_rule_unique,
+so a cold or stale index never creates duplicates, and entries of alerts
+closed elsewhere are dropped on the next flush. Matches of rules that no
+longer exist are skipped by the INSERT and reported to rule_index.
+"""
+from datetime import datetime, timezone
+import threading
+import uuid
+
+from sqlalchemy import DateTime, Text, column, func, literal_column, select, update, values
+from sqlalchemy.dialects.postgresql import UUID, insert as pg_insert
+
+from app import db
+from app.models import Alert, AlertRule, AlertStatus
+from app.services.background import PeriodicWorker
+from app.services.last_seen import MAX_MERGE_SCRIPT
+from app.services.rule_index import rule_index
+
+OPEN_STATUSES = (AlertStatus.ACTIVE, AlertStatus.ACKNOWLEDGED)
+
+# KEYS[1] index (key -> alert id), KEYS[2] reverse map (alert id -> key); ARGV: keys
+REMOVE_SCRIPT = """
+for _, key in ipairs(ARGV) do
+    local alert_id = redis.call('HGET', KEYS[1], key)
+    if alert_id then
+        redis.call('HDEL', KEYS[1], key)
+        redis.call('HDEL', KEYS[2], alert_id)
+    end
+end
+return 0
+"""
+
+# Same KEYS; ARGV: alert ids. A key is only dropped while it still maps to the alert
+REMOVE_ALERTS_SCRIPT = """
+for _, alert_id in ipairs(ARGV) do
+    local key = redis.call('HGET', KEYS[2], alert_id)
+    if key then
+        if redis.call('HGET', KEYS[1], key) == alert_id then
+            redis.call('HDEL', KEYS[1], key)
+        end
+        redis.call('HDEL', KEYS[2], alert_id)
+    end
+end
+return 0
+"""
+
+
+def alert_key(equipment_id, alert_rule_id):
+    return f'{equipment_id}:{alert_rule_id}'
+
+
+def _encode(matched_at):
+    """Fixed-width UTC timestamp, so that Redis compares them as strings"""
+    return matched_at.astimezone(timezone.utc).isoformat(timespec='microseconds')
+
+
+def upsert_on_open_alert(statement):
+    """
+    Turn an INSERT into alerts into an upsert on the open alert of the same (equipment, rule)
+
+    Conflicting rows only move last_matched_at forward. RETURNING yields
+    (id, equipment_id, alert_rule_id, inserted).
+    """
+    return statement.on_conflict_do_update(
+        index_elements=[Alert.equipment_id, Alert.alert_rule_id],
+        index_where=Alert.status.in_(OPEN_STATUSES),
+        set_={'last_matched_at': func.greatest(Alert.last_matched_at, statement.excluded.last_matched_at)}
+    ).returning(Alert.id, Alert.equipment_id, Alert.alert_rule_id, literal_column('xmax = 0').label('inserted'))
+
+
+class MemoryBackend:
+    """Open alerts and pending match times of this worker"""
+
+    def __init__(self):
+        self._open = {}
+        self._keys = {}
+        self._pending = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def is_loaded(self):
+        return self._loaded
+
+    def load(self, open_alerts):
+        with self._lock:
+            for key, alert_id in open_alerts.items():
+                if key not in self._open:
+                    self._open[key] = alert_id
+                    self._keys[alert_id] = key
+            self._loaded = True
+
+    def get_many(self, keys):
+        with self._lock:
+            return {key: self._open.get(key) for key in keys}
+
+    def add(self, open_alerts):
+        with self._lock:
+            for key, alert_id in open_alerts.items():
+                previous = self._open.get(key)
+                if previous is not None and previous != alert_id:
+                    self._keys.pop(previous, None)
+                self._open[key] = alert_id
+                self._keys[alert_id] = key
+
+    def remove(self, keys):
+        with self._lock:
+            for key in keys:
+                alert_id = self._open.pop(key, None)
+                if alert_id is not None:
+                    self._keys.pop(alert_id, None)
+
+    def remove_alerts(self, alert_ids):
+        with self._lock:
+            for alert_id in alert_ids:
+                key = self._keys.pop(alert_id, None)
+                if key is not None and self._open.get(key) == alert_id:
+                    del self._open[key]
+
+    def match(self, matched):
+        with self._lock:
+            for alert_id, matched_at in matched.items():
+                current = self._pending.get(alert_id)
+                if current is None or current < matched_at:
+                    self._pending[alert_id] = matched_at
+
+    def drain(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return pending
+
+    def restore(self, pending):
+        self.match(pending)
+
+    def clear(self):
+        with self._lock:
+            self._open.clear()
+            self._keys.clear()
+            self._pending.clear()
+            self._loaded = False
+
+
+class RedisBackend:
+    """Open alerts and pending match times shared by every worker"""
+
+    def __init__(self, redis_url, key='alerts:open'):
+        import redis
+
+        self.key = key
+        self.ids_key = f'{key}:ids'
+        self.loaded_key = f'{key}:loaded'
+        self.pending_key = f'{key}:matched'
+        self._redis = redis.Redis.from_url(redis_url)
+        self._remove = self._redis.register_script(REMOVE_SCRIPT)
+        self._remove_alerts = self._redis.register_script(REMOVE_ALERTS_SCRIPT)
+        self._max_merge = self._redis.register_script(MAX_MERGE_SCRIPT)
+
+    def is_loaded(self):
+        return bool(self._redis.exists(self.loaded_key))
+
+    def load(self, open_alerts):
+        pipe = self._redis.pipeline(transaction=False)
+        for key, alert_id in open_alerts.items():
+            pipe.hsetnx(self.key, key, alert_id)
+            pipe.hset(self.ids_key, alert_id, key)
+        pipe.set(self.loaded_key, 1)
+        pipe.execute()
+
+    def get_many(self, keys):
+        return {key: value.decode() if value else None for key, value in zip(keys, self._redis.hmget(self.key, keys))}
+
+    def add(self, open_alerts):
+        if open_alerts:
+            pipe = self._redis.pipeline()
+            pipe.hset(self.key, mapping=open_alerts)
+            pipe.hset(self.ids_key, mapping={alert_id: key for key, alert_id in open_alerts.items()})
+            pipe.execute()
+
+    def remove(self, keys):
+        if keys:
+            self._remove(keys=[self.key, self.ids_key], args=list(keys))
+
+    def remove_alerts(self, alert_ids):
+        if alert_ids:
+            self._remove_alerts(keys=[self.key, self.ids_key], args=list(alert_ids))
+
+    def match(self, matched):
+        args = [item for alert_id, matched_at in matched.items() for item in (alert_id, _encode(matched_at))]
+        if args:
+            # Never moves a pending time back, whichever worker writes last
+            self._max_merge(keys=[self.pending_key], args=args)
+
+    def drain(self):
+        # Move the pending hash aside atomically so concurrent matches are kept
+        draining_key = f'{self.pending_key}:{uuid.uuid4().hex}'
+        if not self._redis.exists(self.pending_key):
+            return {}
+        try:
+            self._redis.rename(self.pending_key, draining_key)
+        except Exception:
+            return {}
+        raw = self._redis.hgetall(draining_key)
+        self._redis.delete(draining_key)
+        return {k.decode(): datetime.fromisoformat(v.decode()) for k, v in raw.items()}
+
+    def restore(self, pending):
+        self.match(pending)
+
+    def clear(self):
+        self._redis.delete(self.key, self.ids_key, self.loaded_key, self.pending_key)
+
+
+class OpenAlertIndex:
+    """
+    Records rule matches, inserting an alert only when none is open
+
+    The index is filled from the open alerts in the database on first use.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.backend = MemoryBackend()
+        self._worker = None
+
+    def init_app(self, app):
+        # A previous init_app's worker drains into its old backend before being replaced
+        if self._worker is not None:
+            self._worker.stop()
+            self._worker = None
+        self.app = app
+        if app.config['ALERT_OPEN_INDEX_BACKEND'] == 'redis':
+            self.backend = RedisBackend(app.config['REDIS_URL'])
+        else:
+            self.backend = MemoryBackend()
+        self._worker = PeriodicWorker(
+            'alert-last-matched', app.config['ALERT_LAST_MATCHED_FLUSH_INTERVAL'], self.flush
+        )
+        if app.config['BACKGROUND_WORKERS_ENABLED']:
+            self._worker.start()
+
+    def clear(self):
+        """Forget the indexed alerts and pending match times; reloaded on next use"""
+        self.backend.clear()
+
+    def _ensure_loaded(self):
+        if self.backend.is_loaded():
+            return
+        rows = db.session.query(Alert.equipment_id, Alert.alert_rule_id, Alert.id).filter(
+            Alert.status.in_(OPEN_STATUSES),
+            Alert.alert_rule_id.isnot(None)
+        ).all()
+        self.backend.load({alert_key(equipment_id, rule_id): str(alert_id) for equipment_id, rule_id, alert_id in rows})
+
+    def record(self, matches):
+        """
+        Record rule matches and commit the alerts they open
+
+        Args:
+            matches: iterable of (equipment_id, compiled rule, message values,
+                     matched_at); the first match of a key provides the message
+
+        Returns:
+            number of alerts created
+        """
+        first, latest = {}, {}
+        for match in matches:
+            key = alert_key(match[0], match[1].id)
+            first.setdefault(key, match)
+            if key not in latest or latest[key] < match[3]:
+                latest[key] = match[3]
+        if not first:
+            return 0
+
+        self._ensure_loaded()
+        open_ids = self.backend.get_many(list(first))
+        self.backend.match({open_ids[key]: latest[key] for key in first if open_ids[key]})
+
+        rows = [
+            (uuid.uuid4(), equipment_id, rule.id, rule.message.render(message_values), latest[key])
+            for key, (equipment_id, rule, message_values, _) in first.items() if not open_ids[key]
+        ]
+        if not rows:
+            return 0
+
+        # Rows of rules deleted or deactivated since they were indexed are dropped by the join
+        opened = values(
+            column('id', UUID(as_uuid=True)),
+            column('equipment_id', UUID(as_uuid=True)),
+            column('alert_rule_id', UUID(as_uuid=True)),
+            column('message', Text),
+            column('last_matched_at', DateTime(timezone=True)),
+            name='opened'
+        ).data(rows)
+        statement = pg_insert(Alert).from_select(
+            ('id', 'equipment_id', 'alert_rule_id', 'type', 'severity', 'message', 'last_matched_at'),
+            select(
+                opened.c.id, opened.c.equipment_id, opened.c.alert_rule_id, AlertRule.rule_type, AlertRule.severity,
+                opened.c.message, opened.c.last_matched_at
+            ).join(AlertRule, AlertRule.id == opened.c.alert_rule_id).where(AlertRule.is_active.is_(True))
+        )
+        result = db.session.execute(upsert_on_open_alert(statement)).all()
+        db.session.commit()
+
+        returned = {alert_key(equipment_id, rule_id) for _, equipment_id, rule_id, _ in result}
+        missing = {rule_id for _, equipment_id, rule_id, _, _ in rows if alert_key(equipment_id, rule_id) not in returned}
+        if missing:
+            rule_index.rules_missing(missing)
+        return self.opened(result)
+
+    def opened(self, returned):
+        """Index the rows returned by upsert_on_open_alert; returns how many were inserted"""
+        self.backend.add({
+            alert_key(equipment_id, rule_id): str(alert_id) for alert_id, equipment_id, rule_id, _ in returned
+        })
+        return sum(1 for row in returned if row[3])
+
+    def closed(self, alert):
+        """Drop a resolved alert from the index (call after commit)"""
+        if alert.alert_rule_id is not None:
+            self.backend.remove([alert_key(alert.equipment_id, alert.alert_rule_id)])
+
+    def flush(self):
+        """Write pending last_matched_at times with one UPDATE; drop entries of closed alerts"""
+        pending = self.backend.drain()
+        if not pending:
+            return 0
+
+        matched = values(
+            column('id', UUID(as_uuid=True)),
+            column('last_matched_at', DateTime(timezone=True)),
+            name='matched'
+        ).data([(uuid.UUID(alert_id), matched_at) for alert_id, matched_at in pending.items()])
+
+        statement = update(Alert)\
+            .where(Alert.id == matched.c.id)\
+            .where(Alert.status.in_(OPEN_STATUSES))\
+            .values(last_matched_at=func.greatest(Alert.last_matched_at, matched.c.last_matched_at))\
+            .returning(Alert.id)\
+            .execution_options(synchronize_session=False)
+
+        try:
+            with self.app.app_context():
+                updated = {str(alert_id) for alert_id in db.session.execute(statement).scalars()}
+                db.session.commit()
+        except Exception:
+            self.backend.restore(pending)
+            raise
+        self.backend.remove_alerts(set(pending) - updated)
+        return len(updated)
+
+
+open_alert_index = OpenAlertIndex()
@@ -0,0 +1,221 @@
+"""
+Device Payload Decoding
+Content-negotiated decoding of telemetry request bodies
+
+Supported content types:
+- application/json
+- application/x-www-form-urlencoded (PRD 4.9)
+- application/msgpack (same structure as JSON)
+- application/vnd.polosanca.reading: fixed-layout packed records, see
+  READING_RECORD below; a batch body is a concatenation of records
+
+Backlog uploads are decoded line by line while the body streams in:
+- application/x-ndjson: one JSON object per line
+- text/csv: a header line naming the columns, then one reading per line
+"""
+from urllib.parse import parse_qsl
+import csv
+import json
+import math
+import struct
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional dependency
+    msgpack = None
+
+from app.services.telemetry_ingest import IngestError
+
+JSON = 'application/json'
+FORM = 'application/x-www-form-urlencoded'
+MSGPACK = ('application/msgpack', 'application/x-msgpack')
+PACKED = 'application/vnd.polosanca.reading'
+NDJSON = ('application/x-ndjson', 'application/jsonl')
+CSV = 'text/csv'
+
+# Longest backlog line accepted; guards against bodies without newlines
+MAX_LINE_LENGTH = 64 * 1024
+
+# serial (32 bytes, NUL padded ASCII), temperature and pressure (float32,
+# NaN = not measured), component bits (bit 0 door, 1 heater, 2 compressor, 3 fan)
+READING_RECORD = struct.Struct('!32sffB')
+SERIAL_SIZE = 32
+
+
+def encode_packed_reading(serial, temperature=None, pressure=None, door=0, heater=0, compressor=0, fan=0):
+    """Pack one reading into the fixed binary layout (used by device firmware and tests)"""
+    encoded = serial.encode('ascii')
+    if len(encoded) > SERIAL_SIZE:
+        raise ValueError(f'Serial longer than {SERIAL_SIZE} bytes: {serial}')
+    bits = door | (heater << 1) | (compressor << 2) | (fan << 3)
+    return READING_RECORD.pack(
+        encoded,
+        math.nan if temperature is None else temperature,
+        math.nan if pressure is None else pressure,
+        bits
+    )
+
+
+def _packed_reading(serial, temperature, pressure, bits):
+    return {
+        'serial': serial.rstrip(b'\0').decode('ascii'),
+        'temperature': None if temperature != temperature else temperature,
+        'pressure': None if pressure != pressure else pressure,
+        'door': bits & 1,
+        'heater': (bits >> 1) & 1,
+        'compressor': (bits >> 2) & 1,
+        'fan': (bits >> 3) & 1,
+    }
+
+
+def decode_packed(body):
+    """Decode a concatenation of packed records without any generic parser"""
+    if not body or len(body) % READING_RECORD.size:
+        raise IngestError(f'Packed body must be a multiple of {READING_RECORD.size} bytes')
+    try:
+        return [_packed_reading(*fields) for fields in READING_RECORD.iter_unpack(body)]
+    except UnicodeDecodeError:
+        raise IngestError('Packed serial must be ASCII')
+
+
+def decode_form(body):
+    try:
+        return dict(parse_qsl(body.decode('utf-8'), keep_blank_values=True))
+    except UnicodeDecodeError:
+        raise IngestError('Form body is not valid UTF-8')
+
+
+def decode_msgpack(body):
+    if msgpack is None:
+        raise IngestError('MessagePack payloads are not supported by this server', 415)
+    try:
+        return msgpack.unpackb(body, raw=False)
+    except (ValueError, msgpack.ExtraData, msgpack.FormatError, msgpack.StackError):
+        raise IngestError('Malformed MessagePack body')
+
+
+def decode_json(body):
+    try:
+        return json.loads(body)
+    except ValueError:
+        raise IngestError('Malformed JSON body')
+
+
+def decode_reading(mimetype, body):
+    """Decode a single-reading body into a dict"""
+    if mimetype == PACKED:
+        readings = decode_packed(body)
+        if len(readings) != 1:
+            raise IngestError('Expected exactly one packed reading')
+        return readings[0]
+    if mimetype == FORM:
+        return decode_form(body)
+    if mimetype in MSGPACK:
+        data = decode_msgpack(body)
+    elif mimetype == JSON or not mimetype:
+        data = decode_json(body)
+    else:
+        raise IngestError(f'Unsupported content type: {mimetype}', 415)
+    if not isinstance(data, dict):
+        raise IngestError('Expected an object')
+    return data
+
+
+def decode_batch(mimetype, body):
+    """
+    Decode a batch body
+
+    Returns:
+        dict with `readings` (and optionally `api_keys`); packed bodies carry
+        no API keys, so the X-API-Key header applies to every record
+    """
+    if mimetype == PACKED:
+        return {'readings': decode_packed(body)}
+    if mimetype in MSGPACK:
+        data = decode_msgpack(body)
+    elif mimetype == JSON or not mimetype:
+        data = decode_json(body)
+    else:
+        raise IngestError(f'Unsupported content type for batches: {mimetype}', 415)
+    if not isinstance(data, dict):
+        raise IngestError('Expected an object')
+    return data
+
+
+def iter_lines(stream, chunk_size):
+    """
+    Yield (line number, line) from a binary stream read in fixed-size chunks
+
+    Only the current chunk and one partial line are held in memory.
+    """
+    number = 0
+    pending = b''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        if len(pending) > MAX_LINE_LENGTH:
+            raise IngestError(f'Line {number + len(lines) + 1}: longer than {MAX_LINE_LENGTH} bytes')
+        for line in lines:
+            number += 1
+            yield number, line
+    if pending:
+        yield number + 1, pending
+
+
+def _decode_line(number, line):
+    try:
+        return line.decode('utf-8').rstrip('\r')
+    except UnicodeDecodeError:
+        raise IngestError(f'Line {number}: not valid UTF-8')
+
+
+def decode_ndjson_lines(lines):
+    for number, line in lines:
+        text = _decode_line(number, line)
+        if not text.strip():
+            continue
+        try:
+            reading = json.loads(text)
+        except ValueError:
+            raise IngestError(f'Line {number}: malformed JSON')
+        if not isinstance(reading, dict):
+            raise IngestError(f'Line {number}: expected an object')
+        yield number, reading
+
+
+def decode_csv_lines(lines):
+    header = None
+    for number, line in lines:
+        text = _decode_line(number, line)
+        if not text.strip():
+            continue
+        try:
+            values = next(csv.reader([text]))
+        except csv.Error:
+            raise IngestError(f'Line {number}: malformed CSV')
+        if header is None:
+            header = [name.strip() for name in values]
+            if 'time' not in header:
+                raise IngestError('CSV header must include a time column')
+            continue
+        if len(values) != len(header):
+            raise IngestError(f'Line {number}: expected {len(header)} columns, got {len(values)}')
+        yield number, dict(zip(header, values))
+
+
+def decode_stream(mimetype, stream, chunk_size):
+    """
+    Decode a streamed backlog body lazily
+
+    Returns:
+        iterator of (line number, reading dict); decoding errors are raised
+        as IngestError while iterating
+    """
+    if mimetype in NDJSON:
+        return decode_ndjson_lines(iter_lines(stream, chunk_size))
+    if mimetype == CSV:
+        return decode_csv_lines(iter_lines(stream, chunk_size))
+    raise IngestError(f'Unsupported content type for backlogs: {mimetype}', 415)
@@ -0,0 +1,112 @@
+"""
+Field Projection
+`fields=` support for list endpoints (PRD 11.11)
+
+The query selects only the columns behind the requested fields and the
+serializer emits only those fields, instead of loading whole ORM objects
+and serializing every column with to_dict().
+"""
+from datetime import date, datetime
+from decimal import Decimal
+from enum import Enum
+import uuid
+
+from app.models import Alert, Equipment, Telemetry, User
+
+# Fields each model exposes through `fields=`; same names as to_dict()
+PROJECTABLE_FIELDS = {
+    Telemetry: ('time', 'equipment_id', 'temperature', 'pressure', 'door', 'heater', 'compressor', 'fan'),
+    Equipment: (
+        'id', 'serial', 'type', 'branch_id', 'company_id', 'manufacturer', 'model',
+        'status', 'last_seen_at', 'installed_at', 'created_at'
+    ),
+    Alert: (
+        'id', 'equipment_id', 'alert_rule_id', 'type', 'severity', 'message', 'status',
+        'acknowledged_at', 'acknowledged_by', 'acknowledgment_notes', 'resolved_at', 'created_at',
+        'last_matched_at'
+    ),
+    User: (
+        'id', 'email', 'name', 'role', 'company_id', 'status', 'branch_access_type',
+        'last_login_at', 'created_at'
+    ),
+}
+
+
+class ProjectionError(Exception):
+    """Raised for unknown field names"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def parse_fields(value, model):
+    """
+    Parse a comma-separated `fields` parameter
+
+    Returns:
+        tuple of field names in request order, or None to serialize everything
+    """
+    if not value:
+        return None
+    allowed = PROJECTABLE_FIELDS[model]
+    fields = tuple(dict.fromkeys(name.strip() for name in value.split(',') if name.strip()))
+    unknown = [name for name in fields if name not in allowed]
+    if unknown or not fields:
+        raise ProjectionError(
+            f'Unknown fields: {", ".join(unknown) or value}; allowed: {", ".join(allowed)}'
+        )
+    return fields
+
+
+def serialize_value(value):
+    """JSON-ready value, formatted like the models' to_dict()"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def projection_columns(model, fields, computed, required=()):
+    """Columns behind fields and required names, keyed by column key in selection order"""
+    columns = {}
+    for name in (*fields, *required):
+        for column in computed[name][0] if name in computed else (getattr(model, name),):
+            columns.setdefault(column.key, column)
+    return columns
+
+
+def select_fields(query, model, fields, computed=None, required=()):
+    """
+    Restrict a query to the columns behind `fields`
+
+    Args:
+        computed: dict field -> (columns, function) for fields derived from
+                  several columns; function receives the column values
+        required: extra column names the caller needs on each row (e.g. keys
+                  for cursors); they are selected but not serialized
+
+    Returns:
+        (query, serialize) where serialize(row) returns the projected dict
+    """
+    computed = computed or {}
+    columns = projection_columns(model, fields, computed, required)
+
+    def serialize(row):
+        item = {}
+        for name in fields:
+            if name in computed:
+                source, function = computed[name]
+                value = function(*(getattr(row, column.key) for column in source))
+            else:
+                value = getattr(row, name)
+            item[name] = serialize_value(value)
+        return item
+
+    return query.with_entities(*columns.values()), serialize
@@ -0,0 +1,131 @@
+"""
+Telemetry Rate Limiter
+Per-equipment token buckets checked before any credential or database work
+"""
+from collections import OrderedDict
+import math
+import threading
+import time
+
+# KEYS[1] bucket; ARGV rate (tokens/s), capacity, now (s), cost
+# Returns {allowed, retry_after}
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry_after = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(retry_after)}
+"""
+
+
+class MemoryBackend:
+    """Buckets local to this worker, evicted LRU-first beyond max_entries"""
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key, rate, capacity, cost):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * rate)
+            if tokens >= cost:
+                allowed, retry_after = True, 0.0
+                tokens -= cost
+            else:
+                allowed, retry_after = False, (cost - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_entries:
+                self._buckets.popitem(last=False)
+        return allowed, retry_after
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class RedisBackend:
+    """Buckets shared by every worker, updated atomically by a Lua script"""
+
+    def __init__(self, redis_url, prefix='ratelimit:telemetry:'):
+        import redis
+
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(redis_url)
+        self._script = self._redis.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def consume(self, key, rate, capacity, cost):
+        allowed, retry_after = self._script(
+            keys=[self.prefix + key],
+            args=[rate, capacity, time.time(), cost]
+        )
+        return bool(allowed), float(retry_after)
+
+    def clear(self):
+        for key in self._redis.scan_iter(match=self.prefix + '*'):
+            self._redis.delete(key)
+
+
+class TelemetryRateLimiter:
+    """
+    Token bucket per equipment serial (PRD 11.16)
+
+    Each serial refills at TELEMETRY_RATE_LIMIT_PER_MINUTE tokens per minute
+    up to TELEMETRY_RATE_LIMIT_BURST tokens. Every request costs each serial
+    it carries one token, whether it holds one reading (single endpoint),
+    many (a batch) or a whole backlog upload, so any request fits the bucket
+    and Retry-After is never longer than one refill.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.rate = 1 / 60
+        self.capacity = 5
+        self.backend = MemoryBackend()
+
+    def init_app(self, app):
+        self.enabled = app.config['TELEMETRY_RATE_LIMIT_ENABLED']
+        self.rate = app.config['TELEMETRY_RATE_LIMIT_PER_MINUTE'] / 60
+        self.capacity = app.config['TELEMETRY_RATE_LIMIT_BURST']
+        if app.config['TELEMETRY_RATE_LIMIT_BACKEND'] == 'redis':
+            self.backend = RedisBackend(app.config['REDIS_URL'])
+        else:
+            self.backend = MemoryBackend()
+
+    def consume(self, serial, cost=1):
+        """
+        Take `cost` tokens from the serial's bucket
+
+        A cost above the burst size could never be served; it is capped at it.
+
+        Returns:
+            (allowed, retry_after) with retry_after in whole seconds
+        """
+        if not self.enabled:
+            return True, 0
+        allowed, retry_after = self.backend.consume(serial, self.rate, self.capacity, min(cost, self.capacity))
+        return allowed, math.ceil(retry_after)
+
+    def clear(self):
+        """Refill every bucket"""
+        self.backend.clear()
+
+
+telemetry_rate_limiter = TelemetryRateLimiter()
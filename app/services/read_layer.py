@@ -0,0 +1,98 @@
+"""
+Read Layer
+ORM-free reads for the list routes
+
+Queries select plain column tuples (no identity map, no attribute
+instrumentation) that are copied into row classes with __slots__, and
+responses are encoded with orjson when it is installed, which writes these
+rows, datetimes, UUIDs and enums natively. The JSON matches the models'
+to_dict().
+"""
+from dataclasses import fields as dataclass_fields, is_dataclass, make_dataclass
+from decimal import Decimal
+from operator import itemgetter
+import json
+
+from flask import current_app
+
+from app.services.projection import PROJECTABLE_FIELDS, projection_columns, serialize_value
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+_ROW_CLASSES = {}
+
+
+def row_class(model, fields):
+    """Slotted dataclass with the given fields of a model, created once per field set"""
+    key = (model, fields)
+    cls = _ROW_CLASSES.get(key)
+    if cls is None:
+        cls = make_dataclass(f'{model.__name__}Row', fields, slots=True, eq=False)
+        _ROW_CLASSES[key] = cls
+    return cls
+
+
+def select_rows(query, model, fields=None, computed=None, required=()):
+    """
+    Restrict a query to the columns behind `fields` and build row objects
+
+    Args:
+        fields: field names from parse_fields, or None for every to_dict field
+        computed, required: as for projection.select_fields
+
+    Returns:
+        (query, to_row) where to_row(result tuple) returns the row object
+    """
+    fields = fields or PROJECTABLE_FIELDS[model]
+    computed = computed or {}
+    cls = row_class(model, fields)
+    columns = projection_columns(model, fields, computed, required)
+    keys = list(columns)
+
+    if keys[:len(fields)] == list(fields) and not computed:
+        # Selected columns start with the row fields in order
+        count = len(fields)
+
+        def to_row(row):
+            return cls(*row[:count])
+    else:
+        position = {key: index for index, key in enumerate(keys)}
+        getters = []
+        for name in fields:
+            if name in computed:
+                source, function = computed[name]
+                indexes = [position[column.key] for column in source]
+                getters.append(lambda row, indexes=indexes, function=function: function(*(row[i] for i in indexes)))
+            else:
+                getters.append(itemgetter(position[name]))
+
+        def to_row(row):
+            return cls(*(getter(row) for getter in getters))
+
+    return query.with_entities(*columns.values()), to_row
+
+
+def _default(value):
+    if is_dataclass(value):
+        return {field.name: getattr(value, field.name) for field in dataclass_fields(value)}
+    if isinstance(value, Decimal):
+        return float(value)
+    result = serialize_value(value)
+    if result is value:
+        raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+    return result
+
+
+def dumps(payload):
+    """Encode a payload holding row objects (orjson if available)"""
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default)
+    return json.dumps(payload, default=_default, separators=(',', ':'))
+
+
+def json_response(payload):
+    """Response with `payload` encoded by dumps()"""
+    return current_app.response_class(dumps(payload), mimetype='application/json')
@@ -0,0 +1,274 @@
+"""
+Alert Rule Index
+Per-worker index of the effective, compiled alert rules of each equipment
+
+Rules are compiled once when loaded: thresholds are bound into C-level
+comparison callables and message templates are split into literals and
+placeholders, so evaluating a reading neither touches the database nor
+re-parses anything. For every rule type, the rules of the most specific
+scope win (equipment > company > global, PRD 3.5). The alert rule and
+equipment routes report changes, which are applied incrementally and
+published to the other workers through Redis pub/sub.
+"""
+from collections import defaultdict, namedtuple
+from functools import partial
+from operator import eq, ge, gt, le, lt
+import json
+import logging
+import re
+import threading
+import time
+import uuid
+
+from app import db
+from app.models import AlertRule, AlertRuleScope, AlertRuleType, ComparisonOperator, Equipment
+
+logger = logging.getLogger(__name__)
+
+# Reading field watched by each rule type; equipment_offline is detected without readings
+RULE_FIELDS = {
+    AlertRuleType.TEMPERATURE_HIGH: 'temperature',
+    AlertRuleType.TEMPERATURE_LOW: 'temperature',
+    AlertRuleType.PRESSURE_HIGH: 'pressure',
+    AlertRuleType.PRESSURE_LOW: 'pressure',
+    AlertRuleType.DOOR_OPEN: 'door',
+}
+
+# Operators with the threshold as first argument, so it can be bound: value > t == lt(t, value)
+BOUND_OPERATORS = {
+    ComparisonOperator.GT: lt,
+    ComparisonOperator.LT: gt,
+    ComparisonOperator.EQ: eq,
+    ComparisonOperator.GTE: le,
+    ComparisonOperator.LTE: ge,
+}
+
+# door_open rules without a threshold match an open door
+DEFAULT_THRESHOLDS = {AlertRuleType.DOOR_OPEN: 1}
+
+# Most specific last: its rules replace those of the same type from the scopes before it
+SCOPE_PRIORITY = (AlertRuleScope.GLOBAL, AlertRuleScope.COMPANY, AlertRuleScope.EQUIPMENT)
+
+PLACEHOLDER = re.compile(r'\{\{\s*(\w+)\s*\}\}')
+
+CHANNEL = 'alert:rules'
+
+CompiledRule = namedtuple('CompiledRule', [
+    'id', 'rule_type', 'scope', 'scope_id', 'field', 'threshold', 'matches', 'duration', 'severity', 'message'
+])
+
+
+def format_value(value):
+    return f'{value:g}' if isinstance(value, float) else str(value)
+
+
+class MessageTemplate:
+    """A message template split once into literals and {{name}} placeholders"""
+    __slots__ = ('literals', 'placeholders')
+
+    def __init__(self, template):
+        pieces = PLACEHOLDER.split(template)
+        self.literals = pieces[0::2]
+        self.placeholders = [(match.group(1), match.group(0)) for match in PLACEHOLDER.finditer(template)]
+
+    def render(self, values):
+        """Fill the placeholders; unknown names are left as they are"""
+        parts = [self.literals[0]]
+        for (name, text), literal in zip(self.placeholders, self.literals[1:]):
+            parts.append(format_value(values[name]) if name in values else text)
+            parts.append(literal)
+        return ''.join(parts)
+
+
+def compile_rule(rule):
+    """
+    Compile an AlertRule
+
+    Returns:
+        CompiledRule; `matches` is None for rules not evaluated on readings
+        (equipment_offline, or no threshold)
+    """
+    field = RULE_FIELDS.get(rule.rule_type)
+    threshold = rule.threshold_value
+    threshold = float(threshold) if threshold is not None else DEFAULT_THRESHOLDS.get(rule.rule_type)
+    matches = None
+    if field is not None and threshold is not None:
+        matches = partial(BOUND_OPERATORS[rule.comparison_operator], threshold)
+    scope_id = str(rule.scope_id) if rule.scope != AlertRuleScope.GLOBAL and rule.scope_id else None
+    return CompiledRule(
+        rule.id, rule.rule_type, rule.scope, scope_id, field, threshold, matches,
+        rule.duration_seconds, rule.severity, MessageTemplate(rule.message_template)
+    )
+
+
+class RuleIndex:
+    """
+    Maps equipment id -> tuple of its effective CompiledRules
+
+    Active rules are loaded with one query and the effective rules of an
+    equipment are resolved on first use. rule_changed(), rules_missing()
+    and equipment_changed() queue a change that is applied before the next
+    lookup; with ALERT_RULE_INDEX_BACKEND=redis the change is also published
+    so that every worker applies it. The whole index is reloaded every
+    ALERT_RULE_INDEX_RELOAD_INTERVAL seconds and after a lost subscription.
+    """
+
+    def __init__(self):
+        self.reload_interval = 300
+        self._origin = uuid.uuid4().hex
+        self._redis = None
+        self._listener = None
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._rules = {}
+        self._by_scope = defaultdict(dict)
+        self._company_of = {}
+        self._effective = {}
+        self._loaded_at = None
+
+    def init_app(self, app):
+        self.reload_interval = app.config['ALERT_RULE_INDEX_RELOAD_INTERVAL']
+        self.clear()
+        self._redis = None
+        if app.config['ALERT_RULE_INDEX_BACKEND'] == 'redis':
+            import redis
+
+            self._redis = redis.Redis.from_url(app.config['REDIS_URL'])
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name='alert-rule-index', daemon=True)
+                self._listener.start()
+
+    def clear(self):
+        """Drop everything; the index is reloaded on next use"""
+        with self._lock:
+            self._loaded_at = None
+            self._pending.clear()
+            self._rules = {}
+            self._by_scope = defaultdict(dict)
+            self._company_of = {}
+            self._effective = {}
+
+    def effective(self, equipment_id):
+        """Effective compiled rules of an equipment (empty tuple if none)"""
+        if self._pending or self._loaded_at is None or time.monotonic() - self._loaded_at > self.reload_interval:
+            self._refresh()
+        key = str(equipment_id)
+        rules = self._effective.get(key)
+        if rules is None:
+            with self._lock:
+                rules = self._resolve(key)
+        return rules
+
+    def rule_changed(self, rule_id):
+        """Report a created, updated or deleted rule (call after commit)"""
+        self._notify('rule', str(rule_id))
+
+    def rules_missing(self, rule_ids):
+        """
+        Report indexed rules found to no longer exist (e.g. deleted through
+        another worker without the Redis backend); they are re-queried and
+        dropped here and, with the Redis backend, in every worker
+        """
+        for rule_id in rule_ids:
+            self._notify('rule', str(rule_id))
+
+    def equipment_changed(self, equipment_id):
+        """Report an equipment whose company changed or that was deleted"""
+        self._notify('equipment', str(equipment_id))
+
+    def _notify(self, kind, key):
+        with self._lock:
+            self._pending.add((kind, key))
+        if self._redis is not None:
+            try:
+                self._redis.publish(CHANNEL, json.dumps([self._origin, kind, key]))
+            except Exception:
+                logger.exception('Could not publish alert rule change %s %s', kind, key)
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(CHANNEL)
+                # Changes published while unsubscribed were missed
+                self._loaded_at = None
+                for message in pubsub.listen():
+                    origin, kind, key = json.loads(message['data'])
+                    if origin != self._origin:
+                        with self._lock:
+                            self._pending.add((kind, key))
+            except Exception:
+                logger.exception('Alert rule index subscription lost')
+                time.sleep(1)
+
+    def _refresh(self):
+        with self._lock:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at > self.reload_interval:
+                self._pending.clear()
+                self._load()
+                return
+            changes, self._pending = self._pending, set()
+            for kind, key in changes:
+                if kind == 'rule':
+                    self._apply_rule(key)
+                else:
+                    self._company_of.pop(key, None)
+                    self._effective.pop(key, None)
+
+    def _load(self):
+        self._rules = {}
+        self._by_scope = defaultdict(dict)
+        self._company_of = {}
+        self._effective = {}
+        for rule in AlertRule.query.filter(AlertRule.is_active.is_(True)):
+            self._add(compile_rule(rule))
+        self._loaded_at = time.monotonic()
+
+    def _add(self, compiled):
+        self._rules[str(compiled.id)] = compiled
+        self._by_scope[compiled.scope, compiled.scope_id][str(compiled.id)] = compiled
+
+    def _apply_rule(self, rule_id):
+        """Replace one rule and drop the effective rules it may affect"""
+        affected = []
+        previous = self._rules.pop(rule_id, None)
+        if previous is not None:
+            self._by_scope[previous.scope, previous.scope_id].pop(rule_id, None)
+            affected.append(previous)
+        rule = AlertRule.query.get(rule_id)
+        if rule is not None and rule.is_active:
+            compiled = compile_rule(rule)
+            self._add(compiled)
+            affected.append(compiled)
+
+        for compiled in affected:
+            if compiled.scope == AlertRuleScope.GLOBAL:
+                self._effective.clear()
+            elif compiled.scope == AlertRuleScope.COMPANY:
+                for key, company_id in self._company_of.items():
+                    if company_id == compiled.scope_id:
+                        self._effective.pop(key, None)
+            else:
+                self._effective.pop(compiled.scope_id, None)
+
+    def _resolve(self, key):
+        company_id = self._company_of.get(key)
+        if company_id is None:
+            company_id = db.session.query(Equipment.company_id).filter(Equipment.id == key).scalar()
+            company_id = str(company_id) if company_id is not None else None
+            self._company_of[key] = company_id
+
+        by_type = {}
+        for scope, scope_id in zip(SCOPE_PRIORITY, (None, company_id, key)):
+            if scope != AlertRuleScope.GLOBAL and scope_id is None:
+                continue
+            scoped = defaultdict(list)
+            for compiled in self._by_scope.get((scope, scope_id), {}).values():
+                scoped[compiled.rule_type].append(compiled)
+            by_type.update(scoped)
+        rules = tuple(compiled for rules in by_type.values() for compiled in rules)
+        self._effective[key] = rules
+        return rules
+
+
+rule_index = RuleIndex()
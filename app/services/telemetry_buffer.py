@@ -0,0 +1,262 @@
+"""
+Telemetry Write-Behind Buffer
+Bounded buffer of accepted readings flushed to the hypertable in COPY batches
+"""
+from collections import deque
+from datetime import datetime
+import json
+import logging
+import threading
+import time
+import uuid
+
+import psycopg2
+from sqlalchemy.exc import OperationalError
+
+from app.services.background import PeriodicWorker
+from app.services.telemetry_store import copy_telemetry_rows
+
+logger = logging.getLogger(__name__)
+
+# Rows the database rejected, kept for inspection
+DEAD_LETTER_MAX_SIZE = 1000
+
+# KEYS[1] buffer; ARGV: max size, then encoded rows
+# Returns 0 when the rows do not fit
+PUSH_SCRIPT = """
+if redis.call('LLEN', KEYS[1]) + #ARGV - 1 > tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('RPUSH', KEYS[1], unpack(ARGV, 2))
+return 1
+"""
+
+
+class MemoryBackend:
+    """Per-worker deque; readings are lost only if the process dies without draining"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._rows = deque()
+        self._dead = deque(maxlen=DEAD_LETTER_MAX_SIZE)
+        self._lock = threading.Lock()
+
+    def push(self, rows):
+        with self._lock:
+            if len(self._rows) + len(rows) > self.max_size:
+                return False
+            self._rows.extend(rows)
+            return True
+
+    def pop(self, count):
+        with self._lock:
+            return [self._rows.popleft() for _ in range(min(count, len(self._rows)))]
+
+    def requeue(self, rows):
+        with self._lock:
+            self._rows.extendleft(reversed(rows))
+
+    def dead_letter(self, rows):
+        with self._lock:
+            self._dead.extend(rows)
+
+    def dead_letter_depth(self):
+        return len(self._dead)
+
+    def clear(self):
+        with self._lock:
+            self._rows.clear()
+            self._dead.clear()
+
+    def depth(self):
+        return len(self._rows)
+
+
+class RedisBackend:
+    """Redis list shared by every worker, so any worker's writer may flush it"""
+
+    def __init__(self, redis_url, max_size, key='telemetry:buffer'):
+        import redis
+
+        self.max_size = max_size
+        self.key = key
+        self.dead_key = f'{key}:dead'
+        self._redis = redis.Redis.from_url(redis_url)
+        self._push = self._redis.register_script(PUSH_SCRIPT)
+
+    @staticmethod
+    def _encode(row):
+        return json.dumps({
+            **row,
+            'time': row['time'].isoformat(),
+            'equipment_id': str(row['equipment_id']),
+        })
+
+    @staticmethod
+    def _decode(raw):
+        row = json.loads(raw)
+        row['time'] = datetime.fromisoformat(row['time'])
+        row['equipment_id'] = uuid.UUID(row['equipment_id'])
+        return row
+
+    def push(self, rows):
+        # Checked and pushed in one script so concurrent workers cannot overfill the list
+        return bool(self._push(keys=[self.key], args=[self.max_size, *[self._encode(row) for row in rows]]))
+
+    def pop(self, count):
+        pipe = self._redis.pipeline(transaction=True)
+        pipe.lrange(self.key, 0, count - 1)
+        pipe.ltrim(self.key, count, -1)
+        raw_rows, _ = pipe.execute()
+        return [self._decode(raw) for raw in raw_rows]
+
+    def requeue(self, rows):
+        if rows:
+            self._redis.lpush(self.key, *[self._encode(row) for row in reversed(rows)])
+
+    def dead_letter(self, rows):
+        pipe = self._redis.pipeline(transaction=True)
+        pipe.rpush(self.dead_key, *[self._encode(row) for row in rows])
+        pipe.ltrim(self.dead_key, -DEAD_LETTER_MAX_SIZE, -1)
+        pipe.execute()
+
+    def dead_letter_depth(self):
+        return self._redis.llen(self.dead_key)
+
+    def clear(self):
+        self._redis.delete(self.key, self.dead_key)
+
+    def depth(self):
+        return self._redis.llen(self.key)
+
+
+class TelemetryBuffer:
+    """
+    Write-behind buffer for the ingest endpoints
+
+    When TELEMETRY_WRITE_BEHIND is enabled, accepted rows are appended here
+    and the request is acknowledged with 202. A background writer flushes
+    the buffer with COPY whenever TELEMETRY_FLUSH_SIZE rows are pending or
+    TELEMETRY_FLUSH_INTERVAL seconds have passed, and drains it on shutdown.
+    A batch the database rejects is split in halves until the offending rows
+    are isolated; only those are moved to the dead-letter list.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.app = None
+        self.backend = None
+        self.flush_size = 5000
+        self.flush_interval = 1.0
+        self._flush_lock = threading.Lock()
+        self._writer = None
+        self._stats = {
+            'flushes': 0,
+            'flushed_rows': 0,
+            'failed_flushes': 0,
+            'dropped_rows': 0,
+            'last_flush_at': None,
+            'last_flush_rows': 0,
+            'last_flush_latency_ms': None,
+        }
+
+    def init_app(self, app):
+        # A previous init_app's writer drains into the database before being replaced
+        self.shutdown()
+        self._writer = None
+        self.app = app
+        self.enabled = app.config['TELEMETRY_WRITE_BEHIND']
+        if not self.enabled:
+            return
+
+        max_size = app.config['TELEMETRY_BUFFER_MAX_SIZE']
+        if app.config['TELEMETRY_BUFFER_BACKEND'] == 'redis':
+            self.backend = RedisBackend(app.config['REDIS_URL'], max_size)
+        else:
+            self.backend = MemoryBackend(max_size)
+        self.flush_size = app.config['TELEMETRY_FLUSH_SIZE']
+        self.flush_interval = app.config['TELEMETRY_FLUSH_INTERVAL']
+
+        self._writer = PeriodicWorker('telemetry-writer', self.flush_interval, self.flush)
+        if app.config['BACKGROUND_WORKERS_ENABLED']:
+            self._writer.start()
+
+    def append(self, rows):
+        """Queue rows for the writer; returns False when the buffer is full"""
+        if not self.backend.push(rows):
+            return False
+        if self.backend.depth() >= self.flush_size:
+            self._writer.wake()
+        return True
+
+    def flush(self):
+        """Write pending rows in COPY batches of at most TELEMETRY_FLUSH_SIZE"""
+        with self._flush_lock:
+            while True:
+                rows = self.backend.pop(self.flush_size)
+                if not rows:
+                    return
+                started = time.monotonic()
+                try:
+                    with self.app.app_context():
+                        dropped = self._write(rows)
+                except (psycopg2.OperationalError, OperationalError):
+                    # Database unreachable: keep the rows and retry on the next tick
+                    # (halves already written are skipped as duplicates)
+                    logger.exception('Telemetry flush failed, requeueing %d rows', len(rows))
+                    self.backend.requeue(rows)
+                    self._stats['failed_flushes'] += 1
+                    return
+
+                if dropped:
+                    self._stats['failed_flushes'] += 1
+                    self._stats['dropped_rows'] += dropped
+                self._stats['flushes'] += 1
+                self._stats['flushed_rows'] += len(rows) - dropped
+                self._stats['last_flush_at'] = datetime.utcnow().isoformat()
+                self._stats['last_flush_rows'] = len(rows)
+                self._stats['last_flush_latency_ms'] = round((time.monotonic() - started) * 1000, 2)
+                if len(rows) < self.flush_size:
+                    return
+
+    def clear(self):
+        """Drop every buffered row without writing it"""
+        if self.backend is not None:
+            self.backend.clear()
+
+    def _write(self, rows):
+        """
+        COPY rows, bisecting a rejected batch down to the offending rows
+
+        Returns:
+            number of rows moved to the dead-letter list
+        """
+        try:
+            copy_telemetry_rows(rows)
+            return 0
+        except (psycopg2.OperationalError, OperationalError):
+            raise
+        except Exception:
+            if len(rows) == 1:
+                logger.exception('Telemetry row rejected, dead-lettering %r', rows[0])
+                self.backend.dead_letter(rows)
+                return 1
+        middle = len(rows) // 2
+        return self._write(rows[:middle]) + self._write(rows[middle:])
+
+    def shutdown(self):
+        """Stop the writer and drain everything still buffered"""
+        if self._writer is not None:
+            self._writer.stop()
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'depth': self.backend.depth() if self.backend else 0,
+            'capacity': self.backend.max_size if self.backend else 0,
+            'dead_letters': self.backend.dead_letter_depth() if self.backend else 0,
+            **self._stats,
+        }
+
+
+telemetry_buffer = TelemetryBuffer()
@@ -0,0 +1,77 @@
+"""
+Telemetry Export
+Streams telemetry ranges as NDJSON or CSV with a server-side cursor
+"""
+import csv
+import io
+import json
+
+from app import db
+from app.models import Telemetry
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+EXPORT_COLUMNS = ('time', 'equipment_id', 'serial', 'temperature', 'pressure', 'door', 'heater', 'compressor', 'fan')
+
+
+def export_query(equipment_ids, start=None, end=None):
+    """
+    Telemetry rows as plain tuples, ordered by equipment then time
+
+    yield_per streams the result through a server-side cursor in batches,
+    so memory use does not depend on the size of the range.
+    """
+    query = db.session.query(
+        Telemetry.time, Telemetry.equipment_id, Telemetry.temperature, Telemetry.pressure,
+        Telemetry.door, Telemetry.heater, Telemetry.compressor, Telemetry.fan
+    ).filter(Telemetry.equipment_id.in_(list(equipment_ids)))
+    if start is not None:
+        query = query.filter(Telemetry.time >= start)
+    if end is not None:
+        query = query.filter(Telemetry.time <= end)
+    return query.order_by(Telemetry.equipment_id, Telemetry.time)
+
+
+def _values(row, serials):
+    time, equipment_id, temperature, pressure, door, heater, compressor, fan = row
+    return (
+        time.isoformat(), str(equipment_id), serials[equipment_id],
+        None if temperature is None else float(temperature),
+        None if pressure is None else float(pressure),
+        door, heater, compressor, fan
+    )
+
+
+def generate_export(query, serials, fmt, batch_size=5000):
+    """
+    Yield the export body in chunks of up to batch_size rows
+
+    Args:
+        query: query from export_query
+        serials: dict equipment_id -> serial
+        fmt: 'ndjson' or 'csv'
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if fmt == 'csv':
+        writer.writerow(EXPORT_COLUMNS)
+
+    pending = 0
+    for row in query.yield_per(batch_size):
+        values = _values(row, serials)
+        if fmt == 'csv':
+            writer.writerow(values)
+        else:
+            buffer.write(json.dumps(dict(zip(EXPORT_COLUMNS, values)), separators=(',', ':')))
+            buffer.write('\n')
+        pending += 1
+        if pending >= batch_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+
+    if buffer.tell():
+        yield buffer.getvalue()
@@ -0,0 +1,440 @@
+"""
+Telemetry Ingestion Service
+Validation and bulk persistence of equipment readings
+"""
+from collections import namedtuple
+from datetime import datetime, timezone
+
+import psycopg2
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models import Telemetry
+from app.services.alert_engine import alert_engine
+from app.services.credential_cache import credential_cache, is_company_active
+from app.services.dedup import sequence_deduplicator
+from app.services.last_seen import last_seen_tracker
+from app.services.offline_detector import offline_detector
+from app.services.rate_limit import telemetry_rate_limiter
+from app.services.telemetry_buffer import telemetry_buffer
+from app.services.telemetry_store import (
+    CsvRowStream, copy_telemetry_file, insert_telemetry_rows, is_foreign_key_violation
+)
+
+# Sensor and component fields accepted from equipment
+TELEMETRY_FIELDS = ('temperature', 'pressure', 'door', 'heater', 'compressor', 'fan')
+ANALOG_FIELDS = ('temperature', 'pressure')
+COMPONENT_FIELDS = ('door', 'heater', 'compressor', 'fan')
+
+
+def _numeric_limit(column):
+    """Magnitude a NUMERIC(p, s) column overflows at once rounded to s decimals"""
+    numeric = column.type
+    return 10 ** (numeric.precision - numeric.scale) - 10 ** -numeric.scale / 2
+
+
+# Readings are validated against the column types before being acknowledged,
+# so a write (or a write-behind flush) never fails on one out-of-range value
+ANALOG_LIMITS = {field: _numeric_limit(getattr(Telemetry, field)) for field in ANALOG_FIELDS}
+
+# accepted: rows written or queued; duplicates: replayed readings that were skipped;
+# rate_limited: batch readings dropped because their equipment exceeded its rate limit
+IngestResult = namedtuple(
+    'IngestResult',
+    ['accepted', 'duplicates', 'buffered', 'received_at', 'rate_limited'],
+    defaults=(0,)
+)
+
+
+class IngestError(Exception):
+    """Raised when a reading cannot be accepted"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+class RateLimitExceeded(IngestError):
+    """Raised when an equipment exceeds its telemetry rate limit"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message, 429)
+        self.retry_after = retry_after
+
+
+def utcnow():
+    """Timezone-aware server timestamp"""
+    return datetime.now(timezone.utc)
+
+
+def parse_device_time(value):
+    """
+    Parse an optional device-supplied timestamp
+
+    Accepts ISO 8601 strings or epoch seconds. Naive values are taken as UTC.
+    """
+    if value is None or value == '':
+        return None
+    try:
+        if isinstance(value, (int, float)):
+            return datetime.fromtimestamp(value, tz=timezone.utc)
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except (TypeError, ValueError, OverflowError, OSError):
+        raise IngestError(f'Invalid time: {value}')
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def _coerce_analog(field, value):
+    if value is None or value == '':
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise IngestError(f'Invalid {field}: {value}')
+    # Also rejects NaN and infinity
+    if not abs(number) < ANALOG_LIMITS[field]:
+        raise IngestError(f'{field} out of range: {value}')
+    return number
+
+
+def _coerce_component(field, value):
+    if value is None or value == '':
+        return None
+    try:
+        bit = int(value)
+    except (TypeError, ValueError):
+        raise IngestError(f'Invalid {field}: {value}')
+    if bit not in (0, 1):
+        raise IngestError(f'Invalid {field}: {value}')
+    return bit
+
+
+def build_row(equipment_id, reading, time):
+    """Build a telemetry row dict from a validated reading"""
+    row = {'time': time, 'equipment_id': equipment_id}
+    for field in ANALOG_FIELDS:
+        row[field] = _coerce_analog(field, reading.get(field))
+    for field in COMPONENT_FIELDS:
+        row[field] = _coerce_component(field, reading.get(field))
+    return row
+
+
+def _parse_counter(name, value):
+    if value is None or value == '':
+        return None
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise IngestError(f'Invalid {name}: {value}')
+    if number < 0:
+        raise IngestError(f'Invalid {name}: {value}')
+    return number
+
+
+def parse_seq(reading):
+    """
+    Parse a reading's optional device sequence number and boot counter
+
+    Devices that reset `seq` when they restart send an incremented `boot`
+    with it, so their first readings after the restart are not taken for
+    retries.
+
+    Returns:
+        None, or (seq, boot) with boot None when the device sends none
+    """
+    seq = _parse_counter('seq', reading.get('seq'))
+    if seq is None:
+        return None
+    return seq, _parse_counter('boot', reading.get('boot'))
+
+
+def resolve_equipment(authenticated, credentials):
+    """
+    Turn authenticated credentials into equipment ids
+
+    Args:
+        authenticated: dict serial -> EquipmentCredential for matching keys
+        credentials: dict serial -> api_key that was presented
+
+    Raises:
+        IngestError (401) listing every serial that failed authentication,
+        IngestError (403) when a device belongs to an inactive company
+    """
+    rejected = sorted(set(credentials) - set(authenticated))
+    if rejected:
+        raise IngestError(f'Invalid serial or API key: {", ".join(rejected)}', 401)
+
+    inactive = sorted(
+        serial for serial, credential in authenticated.items()
+        if not is_company_active(credential)
+    )
+    if inactive:
+        raise IngestError(f'Equipment belongs to an inactive company: {", ".join(inactive)}', 403)
+
+    return {serial: credential.equipment_id for serial, credential in authenticated.items()}
+
+
+def authenticate_devices(credentials):
+    """Authenticate a set of devices (serial -> api_key) against the credential cache"""
+    return resolve_equipment(credential_cache.authenticate_many(credentials), credentials)
+
+
+def equipment_gone(equipment_ids):
+    """
+    IngestError (401) for a write that hit the equipment foreign key
+
+    The credentials were cached before the equipment was deleted; they are
+    dropped so the device's next request fails authentication.
+    """
+    credential_cache.invalidate_equipment(equipment_ids)
+    return IngestError('Equipment no longer exists', 401)
+
+
+def check_rate_limit(serial):
+    allowed, retry_after = telemetry_rate_limiter.consume(serial)
+    if not allowed:
+        raise RateLimitExceeded(f'Rate limit exceeded for serial {serial}', retry_after)
+
+
+def prepare_reading(serial, reading, received_at):
+    """
+    Rate-limit and parse a single reading
+
+    The reading is stamped with its optional device `time` or the server
+    receive time; an optional `seq` (and `boot`) makes retries idempotent.
+
+    Returns:
+        list with one (index, serial, time, seq, reading) entry, seq as
+        returned by parse_seq()
+    """
+    check_rate_limit(serial)
+    time = parse_device_time(reading.get('time')) or received_at
+    return [(0, serial, time, parse_seq(reading), reading)]
+
+
+def prepare_batch(readings, received_at, default_api_key=None, api_keys=None, max_readings=None):
+    """
+    Validate a batch and drop readings of equipments over their rate limit
+
+    Nothing here touches the database.
+
+    Returns:
+        (parsed, credentials, rate_limited) where parsed is a list of
+        (index, serial, time, seq, reading) and credentials maps
+        serial -> api_key for the serials still in the batch
+    """
+    if not isinstance(readings, list) or not readings:
+        raise IngestError('readings must be a non-empty array')
+    if max_readings and len(readings) > max_readings:
+        raise IngestError(f'A batch may contain at most {max_readings} readings', 413)
+
+    api_keys = api_keys or {}
+    credentials = {}
+    parsed = []
+    undated = set()
+    for index, reading in enumerate(readings):
+        if not isinstance(reading, dict) or not reading.get('serial'):
+            raise IngestError(f'Reading {index}: serial is required')
+        serial = reading['serial']
+        api_key = api_keys.get(serial, default_api_key)
+        if not api_key:
+            raise IngestError(f'Reading {index}: no API key for serial {serial}', 401)
+        credentials[serial] = api_key
+        try:
+            device_time = parse_device_time(reading.get('time'))
+            seq = parse_seq(reading)
+        except IngestError as e:
+            raise IngestError(f'Reading {index}: {e.message}')
+        if device_time is None:
+            if serial in undated:
+                raise IngestError(
+                    f'Reading {index}: several readings for serial {serial} without time; '
+                    'readings for the same serial must carry distinct times'
+                )
+            undated.add(serial)
+        parsed.append((index, serial, device_time or received_at, seq, reading))
+
+    # Readings from equipments over their limit are dropped before authentication;
+    # a batch is one request for each of its serials, whatever its number of readings
+    limited = {}
+    for serial in credentials:
+        allowed, retry_after = telemetry_rate_limiter.consume(serial)
+        if not allowed:
+            limited[serial] = retry_after
+    if not limited:
+        return parsed, credentials, 0
+    if len(limited) == len(credentials):
+        raise RateLimitExceeded(
+            f'Rate limit exceeded for serial {", ".join(sorted(limited))}',
+            max(limited.values())
+        )
+    kept = [entry for entry in parsed if entry[1] not in limited]
+    credentials = {serial: key for serial, key in credentials.items() if serial not in limited}
+    return kept, credentials, len(parsed) - len(kept)
+
+
+def build_entries(parsed, equipment_ids):
+    """Build (row, seq) entries for authenticated readings"""
+    entries = []
+    for index, serial, time, seq, reading in parsed:
+        try:
+            entries.append((build_row(equipment_ids[serial], reading, time), seq))
+        except IngestError as e:
+            raise IngestError(f'Reading {index}: {e.message}')
+    return entries
+
+
+def claim_sequences(entries):
+    """
+    Drop readings whose sequence number was already seen
+
+    Returns:
+        (rows to store, claimed (equipment_id, seq, boot) to release if the write fails)
+    """
+    rows = []
+    claimed = []
+    for row, seq in entries:
+        if seq is not None:
+            if not sequence_deduplicator.accept(row['equipment_id'], *seq):
+                continue
+            claimed.append((row['equipment_id'], *seq))
+        rows.append(row)
+    return rows, claimed
+
+
+def release_sequences(claimed):
+    """Let the device's retry through after a failed write"""
+    for equipment_id, seq, boot in claimed:
+        sequence_deduplicator.forget(equipment_id, seq, boot)
+
+
+def write_rows(rows):
+    """
+    Persist rows synchronously or hand them to the write-behind buffer
+
+    Returns:
+        (rows written or queued, buffered) where buffered is True when the
+        rows were queued (acknowledge with 202) and False when committed
+    """
+    equipment_ids = {row['equipment_id'] for row in rows}
+    if telemetry_buffer.enabled:
+        if not telemetry_buffer.append(rows):
+            raise IngestError('Ingestion buffer is full, retry later', 503)
+        stored, buffered = len(rows), True
+    else:
+        try:
+            stored, buffered = insert_telemetry_rows(rows), False
+        except IntegrityError as e:
+            db.session.rollback()
+            if not is_foreign_key_violation(e):
+                raise
+            raise equipment_gone(equipment_ids)
+    return stored, buffered
+
+
+def rows_stored(rows):
+    """Record arrivals and evaluate alert rules on rows just written or queued"""
+    equipment_ids = {row['equipment_id'] for row in rows}
+    seen_at = utcnow()
+    last_seen_tracker.touch(equipment_ids, seen_at)
+    offline_detector.touch(equipment_ids, seen_at)
+    alert_engine.process(rows)
+
+
+def _store_entries(entries, received_at):
+    rows, claimed = claim_sequences(entries)
+    if not rows:
+        return IngestResult(0, len(entries), False, received_at)
+
+    try:
+        stored, buffered = write_rows(rows)
+    except Exception:
+        # Only a failed write releases the sequences: once committed, a retry is a duplicate
+        release_sequences(claimed)
+        raise
+    rows_stored(rows)
+    return IngestResult(stored, len(entries) - stored, buffered, received_at)
+
+
+def ingest_reading(serial, api_key, reading):
+    """
+    Rate-limit, authenticate and store a single reading
+
+    Returns:
+        IngestResult
+    """
+    received_at = utcnow()
+    parsed = prepare_reading(serial, reading, received_at)
+    equipment_ids = authenticate_devices({serial: api_key})
+    return _store_entries(build_entries(parsed, equipment_ids), received_at)
+
+
+def ingest_batch(readings, default_api_key=None, api_keys=None, max_readings=None):
+    """
+    Validate, authenticate and store a batch of readings
+
+    Args:
+        readings: list of reading dicts (serial, optional time and seq, sensor fields)
+        default_api_key: key used for serials without an entry in api_keys
+        api_keys: optional dict mapping serial -> api_key
+        max_readings: upper bound on the batch size
+
+    Returns:
+        IngestResult
+    """
+    received_at = utcnow()
+    parsed, credentials, rate_limited = prepare_batch(
+        readings, received_at, default_api_key, api_keys, max_readings
+    )
+    equipment_ids = authenticate_devices(credentials)
+    result = _store_entries(build_entries(parsed, equipment_ids), received_at)
+    return result._replace(rate_limited=rate_limited)
+
+
+def _backlog_rows(serial, equipment_id, readings):
+    for line, reading in readings:
+        try:
+            if reading.get('serial') not in (None, '', serial):
+                raise IngestError(f'serial {reading["serial"]} does not match {serial}')
+            time = parse_device_time(reading.get('time'))
+            if time is None:
+                raise IngestError('time is required')
+            yield build_row(equipment_id, reading, time)
+        except IngestError as e:
+            raise IngestError(f'Line {line}: {e.message}')
+
+
+def ingest_backlog(serial, api_key, readings):
+    """
+    Store the backlog of one equipment with a single streaming COPY
+
+    The whole upload counts as one request against the rate limit. Every
+    reading must carry its device time; readings already stored are skipped.
+    Any invalid line rolls the whole upload back.
+
+    Args:
+        readings: iterator of (line number, reading dict), consumed lazily
+                  while COPY runs
+
+    Returns:
+        IngestResult
+    """
+    received_at = utcnow()
+    check_rate_limit(serial)
+    equipment_id = authenticate_devices({serial: api_key})[serial]
+
+    stream = CsvRowStream(_backlog_rows(serial, equipment_id, readings))
+    try:
+        stored = copy_telemetry_file(stream)
+    except psycopg2.IntegrityError as e:
+        if not is_foreign_key_violation(e):
+            raise
+        raise equipment_gone({equipment_id})
+    if stream.count:
+        seen_at = utcnow()
+        last_seen_tracker.touch({equipment_id}, seen_at)
+        offline_detector.touch({equipment_id}, seen_at)
+    return IngestResult(stored, stream.count - stored, False, received_at)
@@ -0,0 +1,394 @@
+"""
+Telemetry Query Service
+Aggregated and keyset-paginated telemetry reads (PRD 11.11)
+
+1hour and 1day read the telemetry_hourly / telemetry_daily continuous
+aggregates; any other width (5min, 15min, 6hour, ...) is computed with
+time_bucket over the raw hypertable. Raw readings are paged with opaque
+cursors on (time, equipment_id) instead of OFFSET.
+"""
+from datetime import datetime, timedelta
+from itertools import groupby
+from operator import attrgetter
+from types import SimpleNamespace
+import base64
+import binascii
+import json
+import re
+import uuid
+
+import numpy as np
+from sqlalchemy import func, text, tuple_
+
+from app import db
+from app.models import Equipment, LatestTelemetry, Telemetry
+from app.services.aggregate_cache import aggregate_cache
+from app.services.downsampling import lttb
+
+INTERVAL_PATTERN = re.compile(r'^(\d+)(min|hour|day)$')
+INTERVAL_UNITS = {'min': 'minutes', 'hour': 'hours', 'day': 'days'}
+
+# Aggregate expressions over the raw hypertable, matching the continuous aggregates in schema.sql
+RAW_AGGREGATES = {
+    'avg_temperature': 'AVG(temperature)',
+    'min_temperature': 'MIN(temperature)',
+    'max_temperature': 'MAX(temperature)',
+    'avg_pressure': 'AVG(pressure)',
+    'min_pressure': 'MIN(pressure)',
+    'max_pressure': 'MAX(pressure)',
+    'door_open_count': 'SUM(CASE WHEN door = 1 THEN 1 ELSE 0 END)',
+    'compressor_on_count': 'SUM(CASE WHEN compressor = 1 THEN 1 ELSE 0 END)',
+    'data_points': 'COUNT(*)',
+}
+
+# Continuous aggregates: view, bucket column and the aggregate columns it materializes
+CONTINUOUS_AGGREGATES = {
+    timedelta(hours=1): ('telemetry_hourly', 'hour', tuple(RAW_AGGREGATES)),
+    timedelta(days=1): ('telemetry_daily', 'day', (
+        'avg_temperature', 'min_temperature', 'max_temperature', 'avg_pressure', 'data_points'
+    )),
+}
+
+COUNT_COLUMNS = ('door_open_count', 'compressor_on_count', 'data_points')
+
+# Per-reading series of the columnar format; time is always included and
+# equipment_id is given once at the top level
+SERIES_FIELDS = ('temperature', 'pressure', 'door', 'heater', 'compressor', 'fan')
+
+
+class QueryError(Exception):
+    """Raised for invalid query parameters"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def parse_interval(value):
+    """
+    Parse an `interval` parameter
+
+    Returns:
+        None for raw data, otherwise the bucket width as a timedelta
+    """
+    if not value or value == 'raw':
+        return None
+    match = INTERVAL_PATTERN.match(value)
+    if not match or int(match.group(1)) == 0:
+        raise QueryError(f'Invalid interval: {value} (expected raw or e.g. 5min, 1hour, 1day)')
+    return timedelta(**{INTERVAL_UNITS[match.group(2)]: int(match.group(1))})
+
+
+def _range_filters(column, start, end, params):
+    filters = []
+    if start is not None:
+        filters.append(f'{column} >= time_bucket(:width, CAST(:start AS timestamptz))')
+        params['start'] = start
+    if end is not None:
+        filters.append(f'{column} <= :end')
+        params['end'] = end
+    return ''.join(f' AND {condition}' for condition in filters)
+
+
+def _aggregate_columns(width, fields=None):
+    view = CONTINUOUS_AGGREGATES.get(width)
+    return _project_columns(view[2] if view else tuple(RAW_AGGREGATES), fields)
+
+
+def _aggregate_sql(width, start, end, params, fields=None):
+    table = Telemetry.__tablename__
+    view = CONTINUOUS_AGGREGATES.get(width)
+    columns = _aggregate_columns(width, fields)
+
+    if view is None:
+        select = ', '.join(f'{RAW_AGGREGATES[name]} AS {name}' for name in columns)
+        sql = (
+            f'SELECT time_bucket(:width, time) AS bucket, {select} FROM {table} '
+            f'WHERE equipment_id = :equipment_id{_range_filters("time", start, end, params)} '
+            'GROUP BY bucket'
+        )
+        return sql, columns
+
+    name, bucket_column, _ = view
+    raw_select = ', '.join(f'{RAW_AGGREGATES[column]} AS {column}' for column in columns)
+    # Buckets after the newest materialized one are not refreshed yet; compute them from raw rows
+    sql = (
+        f'WITH materialized AS ('
+        f'SELECT {bucket_column} AS bucket, {", ".join(columns)} FROM {name} '
+        f'WHERE equipment_id = :equipment_id{_range_filters(bucket_column, start, end, params)}'
+        f'), watermark AS ('
+        f'SELECT MAX(bucket) + :width AS cutoff FROM materialized'
+        f') '
+        f'SELECT * FROM materialized '
+        f'UNION ALL '
+        f'SELECT time_bucket(:width, time) AS bucket, {raw_select} FROM {table}, watermark '
+        f'WHERE equipment_id = :equipment_id '
+        f'AND (watermark.cutoff IS NULL OR time >= watermark.cutoff)'
+        f'{_range_filters("time", start, end, params)} '
+        f'GROUP BY 1'
+    )
+    return sql, columns
+
+
+def _project_columns(columns, fields):
+    """Keep the aggregates of the requested telemetry fields (data_points is always kept)"""
+    if not fields:
+        return columns
+    return tuple(
+        column for column in columns
+        if column == 'data_points'
+        or any(column.endswith(f'_{field}') or column.startswith(f'{field}_') for field in fields)
+    )
+
+
+def _number(name, value):
+    if value is None or isinstance(value, int):
+        return value
+    if name in COUNT_COLUMNS:
+        return int(value)
+    return round(float(value), 2)
+
+
+def _serialize(row, columns):
+    point = {'time': row.bucket.isoformat()}
+    for name in columns:
+        point[name] = _number(name, getattr(row, name))
+    return point
+
+
+def to_columnar(rows, columns, time_attribute='time'):
+    """
+    Per-series arrays built straight from row tuples
+
+    Returns:
+        {'time': [epoch seconds, ...], column: [value, ...], ...}
+    """
+    data = {'time': [int(getattr(row, time_attribute).timestamp()) for row in rows]}
+    for name in columns:
+        data[name] = [_number(name, getattr(row, name)) for row in rows]
+    return data
+
+
+def _bucket_rows(equipment_id, width, start, end, fields, limit=None, offset=0):
+    """Run the bucket query newest first, optionally one page of it"""
+    params = {'equipment_id': equipment_id, 'width': width}
+    sql, columns = _aggregate_sql(width, start, end, params, fields)
+    page = ''
+    if limit is not None:
+        page = ' LIMIT :limit OFFSET :offset'
+        params.update(limit=limit, offset=offset)
+    return db.session.execute(
+        text(f'SELECT * FROM ({sql}) AS buckets ORDER BY bucket DESC{page}'), params
+    ).all(), columns
+
+
+def aggregate_telemetry(equipment_id, width, start=None, end=None, limit=100, offset=0, fields=None,
+                        columnar=False):
+    """
+    Bucketed telemetry for one equipment, newest bucket first
+
+    With the aggregate cache enabled and a start date given, closed buckets
+    come from Redis and only the newer ones are queried (see
+    app.services.aggregate_cache).
+
+    Args:
+        width: bucket width from parse_interval
+        start, end: optional inclusive datetime bounds
+        limit, offset: page of buckets to return
+        fields: optional telemetry fields whose aggregates are returned
+        columnar: return per-series arrays (see to_columnar) instead of points
+
+    Returns:
+        (points, has_more)
+    """
+    if aggregate_cache.enabled and start is not None:
+        columns = _aggregate_columns(width, fields)
+
+        def compute(since):
+            rows, _ = _bucket_rows(equipment_id, width, since, end, fields)
+            return [
+                SimpleNamespace(bucket=row.bucket, **{name: _number(name, getattr(row, name)) for name in columns})
+                for row in rows
+            ]
+
+        rows = aggregate_cache.buckets(equipment_id, width, columns, start, end, compute, offset, limit + 1)
+    else:
+        rows, columns = _bucket_rows(equipment_id, width, start, end, fields, limit + 1, offset)
+    has_more = len(rows) > limit
+    if columnar:
+        return to_columnar(rows[:limit], columns, time_attribute='bucket'), has_more
+    return [_serialize(row, columns) for row in rows[:limit]], has_more
+
+
+def encode_cursor(direction, time, equipment_id):
+    """Opaque cursor pointing before ('next') or after ('prev') a reading"""
+    payload = json.dumps([direction, time.isoformat(), str(equipment_id)], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(value):
+    """
+    Returns:
+        (direction, time, equipment_id)
+    """
+    try:
+        padded = value + '=' * (-len(value) % 4)
+        direction, time, equipment_id = json.loads(base64.urlsafe_b64decode(padded))
+        if direction not in ('next', 'prev'):
+            raise ValueError(direction)
+        return direction, datetime.fromisoformat(time), uuid.UUID(equipment_id)
+    except (ValueError, TypeError, binascii.Error):
+        raise QueryError('Invalid cursor')
+
+
+def keyset_page(query, cursor=None, limit=100):
+    """
+    One page of a Telemetry query, newest first, without OFFSET
+
+    Seeks on the (time, equipment_id) primary key, so every page costs the
+    same index range scan regardless of its depth.
+
+    Returns:
+        (readings, next_cursor, prev_cursor); a cursor is None when there is
+        nothing further in that direction
+    """
+    key = tuple_(Telemetry.time, Telemetry.equipment_id)
+    direction = 'next'
+    if cursor:
+        direction, time, equipment_id = decode_cursor(cursor)
+        query = query.filter(key < (time, equipment_id) if direction == 'next' else key > (time, equipment_id))
+
+    if direction == 'next':
+        readings = query.order_by(Telemetry.time.desc(), Telemetry.equipment_id.desc()).limit(limit + 1).all()
+        has_more = len(readings) > limit
+        readings = readings[:limit]
+        has_next, has_prev = has_more, cursor is not None
+    else:
+        readings = query.order_by(Telemetry.time.asc(), Telemetry.equipment_id.asc()).limit(limit + 1).all()
+        has_more = len(readings) > limit
+        readings = readings[:limit][::-1]
+        has_next, has_prev = True, has_more
+
+    if not readings:
+        return readings, None, None
+    first, last = readings[0], readings[-1]
+    next_cursor = encode_cursor('next', last.time, last.equipment_id) if has_next else None
+    prev_cursor = encode_cursor('prev', first.time, first.equipment_id) if has_prev else None
+    return readings, next_cursor, prev_cursor
+
+
+def count_telemetry(equipment_id, start=None, end=None, estimate=False):
+    """
+    Number of readings of an equipment in a range
+
+    The exact count scans every matching row (including compressed chunks);
+    the estimate sums data_points from the hourly continuous aggregate, so it
+    is cheap but misses readings not yet materialized.
+    """
+    if estimate:
+        params = {'equipment_id': equipment_id, 'width': timedelta(hours=1)}
+        sql = (
+            'SELECT COALESCE(SUM(data_points), 0) FROM telemetry_hourly '
+            f'WHERE equipment_id = :equipment_id{_range_filters("hour", start, end, params)}'
+        )
+        return int(db.session.execute(text(sql), params).scalar())
+
+    query = db.session.query(func.count()).select_from(Telemetry)\
+        .filter(Telemetry.equipment_id == equipment_id)
+    if start is not None:
+        query = query.filter(Telemetry.time >= start)
+    if end is not None:
+        query = query.filter(Telemetry.time <= end)
+    return query.scalar()
+
+
+def downsample_telemetry(query, series, max_points, max_rows):
+    """
+    Reduce the readings of a range to at most max_points with LTTB
+
+    The shape is computed on the first analog series requested (temperature,
+    else pressure, else the first series) and the other series are sampled
+    at the same readings. Readings without a value for that series are left
+    out.
+
+    Args:
+        query: Telemetry query already filtered to one equipment and a bounded range
+        series: telemetry columns to return
+        max_rows: most readings loaded to downsample
+
+    Raises:
+        QueryError (400) when the range holds more than max_rows readings
+
+    Returns:
+        (rows newest first, number of readings in the range)
+    """
+    shape = next((name for name in ('temperature', 'pressure') if name in series), series[0])
+    rows = query.with_entities(
+        Telemetry.time, Telemetry.equipment_id, *(getattr(Telemetry, name) for name in series)
+    ).filter(getattr(Telemetry, shape).isnot(None)).order_by(Telemetry.time.asc()).limit(max_rows + 1).all()
+    if len(rows) > max_rows:
+        raise QueryError(
+            f'The range holds more than {max_rows} readings; narrow it or use interval aggregates'
+        )
+
+    x = np.fromiter((row.time.timestamp() for row in rows), dtype=np.float64, count=len(rows))
+    y = np.fromiter((getattr(row, shape) for row in rows), dtype=np.float64, count=len(rows))
+    return [rows[i] for i in lttb(x, y, max_points)[::-1]], len(rows)
+
+
+def history_version(equipment_ids):
+    """
+    Data version of closed ranges of the given equipments: the newest
+    history_changed_at, which moves whenever readings land behind the HTTP
+    cache horizon
+    """
+    return db.session.query(func.max(Equipment.history_changed_at)).filter(
+        Equipment.id.in_(list(equipment_ids))
+    ).scalar()
+
+
+def telemetry_by_equipment(equipment_ids, series, start, end, max_rows):
+    """
+    Raw readings of several equipments with one query, grouped per equipment
+
+    The query is ordered by (equipment_id, time DESC), the order of
+    idx_telemetry_equipment_id, and the rows are grouped in Python.
+
+    Raises:
+        QueryError (400) when the range holds more than max_rows readings
+
+    Returns:
+        dict equipment_id -> list of rows (time, equipment_id, *series), newest first
+    """
+    rows = db.session.query(
+        Telemetry.time, Telemetry.equipment_id, *(getattr(Telemetry, name) for name in series)
+    ).filter(
+        Telemetry.equipment_id.in_(list(equipment_ids)),
+        Telemetry.time >= start,
+        Telemetry.time <= end
+    ).order_by(Telemetry.equipment_id, Telemetry.time.desc()).limit(max_rows + 1).all()
+
+    if len(rows) > max_rows:
+        raise QueryError(
+            f'The range holds more than {max_rows} readings; narrow it or use the export endpoint'
+        )
+    return {equipment_id: list(group) for equipment_id, group in groupby(rows, key=attrgetter('equipment_id'))}
+
+
+def latest_readings(equipment_query):
+    """
+    Newest reading of every equipment of an Equipment query
+
+    Reads latest_telemetry by primary key instead of looking up the newest
+    hypertable row of each equipment. Equipment that never reported has
+    None readings.
+
+    Returns:
+        rows (equipment_id, serial, branch_id, status, time, *SERIES_FIELDS) ordered by serial
+    """
+    return equipment_query.outerjoin(LatestTelemetry, LatestTelemetry.equipment_id == Equipment.id)\
+        .with_entities(
+            Equipment.id.label('equipment_id'), Equipment.serial, Equipment.branch_id, Equipment.status,
+            LatestTelemetry.time, *(getattr(LatestTelemetry, name) for name in SERIES_FIELDS)
+        ).order_by(Equipment.serial).all()
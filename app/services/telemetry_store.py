@@ -0,0 +1,224 @@
+"""
+Telemetry Store
+Set-based writes of telemetry rows (multi-row INSERT and COPY)
+"""
+import csv
+from datetime import datetime, timedelta, timezone
+import io
+
+from flask import current_app
+import psycopg2
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+
+from app import db
+from app.models import Equipment, LatestTelemetry, Telemetry
+from app.services.aggregate_cache import aggregate_cache
+
+COPY_COLUMNS = ('time', 'equipment_id', 'temperature', 'pressure', 'door', 'heater', 'compressor', 'fan')
+
+VALUE_COLUMNS = tuple(column for column in COPY_COLUMNS if column != 'equipment_id')
+
+
+def is_foreign_key_violation(error):
+    """True for a write rejected because a row's equipment no longer exists"""
+    return isinstance(getattr(error, 'orig', error), psycopg2.errors.ForeignKeyViolation)
+
+
+def upsert_latest_sql(source):
+    """
+    SQL moving the newest row per equipment of `source` into latest_telemetry
+
+    `source` is a table or CTE name with the telemetry columns. Rows older
+    than the stored reading (e.g. replayed backlogs) leave it untouched.
+    """
+    table = LatestTelemetry.__tablename__
+    column_list = ', '.join(COPY_COLUMNS)
+    updates = ', '.join(f'{column} = EXCLUDED.{column}' for column in VALUE_COLUMNS)
+    return (
+        f'INSERT INTO {table} ({column_list}) '
+        f'SELECT DISTINCT ON (equipment_id) {column_list} FROM {source} '
+        f'ORDER BY equipment_id, time DESC '
+        f'ON CONFLICT (equipment_id) DO UPDATE SET {updates} '
+        f'WHERE {table}.time < EXCLUDED.time'
+    )
+
+
+def mark_history_sql(source, horizon):
+    """
+    SQL stamping history_changed_at on equipment with rows of `source` older
+    than `horizon` (an SQL expression in seconds)
+
+    Readings that land behind the HTTP cache horizon (replayed backlogs,
+    late batches) change ranges clients may hold cached; the stamp is part
+    of their ETag.
+    """
+    return (
+        f'UPDATE {Equipment.__tablename__} SET history_changed_at = now() '
+        f'WHERE id IN (SELECT equipment_id FROM {source} '
+        f'WHERE time < now() - make_interval(secs => {horizon}))'
+    )
+
+
+def mark_history_rows(rows):
+    """Stamp history_changed_at for row dicts older than the cache horizon; the caller commits"""
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=current_app.config['TELEMETRY_CACHE_HORIZON'])
+    equipment_ids = {
+        row['equipment_id'] for row in rows
+        if (row['time'] if row['time'].tzinfo else row['time'].replace(tzinfo=timezone.utc)) < cutoff
+    }
+    if equipment_ids:
+        Equipment.query.filter(Equipment.id.in_(equipment_ids)).update(
+            {Equipment.history_changed_at: func.now()}, synchronize_session=False
+        )
+
+
+def upsert_latest_rows(rows):
+    """Upsert the newest of the given row dicts per equipment; the caller commits"""
+    latest = {}
+    for row in rows:
+        current = latest.get(row['equipment_id'])
+        if current is None or current['time'] < row['time']:
+            latest[row['equipment_id']] = row
+    if not latest:
+        return
+    # Same lock order as DISTINCT ON in upsert_latest_sql, so concurrent batches cannot deadlock
+    ordered = sorted(latest.values(), key=lambda row: str(row['equipment_id']))
+    statement = insert(LatestTelemetry).values([
+        {column: row.get(column) for column in COPY_COLUMNS} for row in ordered
+    ])
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=[LatestTelemetry.equipment_id],
+        set_={column: statement.excluded[column] for column in VALUE_COLUMNS},
+        where=LatestTelemetry.time < statement.excluded.time
+    ))
+
+
+def insert_telemetry_rows(rows):
+    """
+    Write all rows with one multi-row INSERT in a single transaction
+
+    Rows whose (time, equipment_id) already exists are skipped, so replayed
+    readings cost no extra writes. latest_telemetry is updated in the same
+    transaction, along with the history stamp of equipment receiving late
+    readings, and cached aggregates after the commit. Returns the number
+    of rows inserted.
+    """
+    if not rows:
+        return 0
+    result = db.session.execute(insert(Telemetry).values(rows).on_conflict_do_nothing())
+    upsert_latest_rows(rows)
+    mark_history_rows(rows)
+    db.session.commit()
+    aggregate_cache.invalidate(rows)
+    return result.rowcount
+
+
+def rows_to_csv(rows):
+    """Serialize row dicts into an in-memory CSV file for COPY"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([row.get(column) for column in COPY_COLUMNS])
+    buffer.seek(0)
+    return buffer
+
+
+class CsvRowStream:
+    """
+    Read-only file object that serializes rows to CSV as COPY reads it
+
+    Lets COPY FROM STDIN consume a row generator without materializing the
+    whole CSV. `count` is the number of rows produced so far.
+    """
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._line = io.StringIO()
+        self._writer = csv.writer(self._line)
+        self._pending = ''
+        self.count = 0
+
+    def _next_line(self):
+        row = next(self._rows, None)
+        if row is None:
+            return None
+        self.count += 1
+        self._line.seek(0)
+        self._line.truncate()
+        self._writer.writerow([row.get(column) for column in COPY_COLUMNS])
+        return self._line.getvalue()
+
+    def read(self, size=-1):
+        chunks = [self._pending]
+        length = len(self._pending)
+        while size < 0 or length < size:
+            line = self._next_line()
+            if line is None:
+                break
+            chunks.append(line)
+            length += len(line)
+        data = ''.join(chunks)
+        if size < 0:
+            self._pending = ''
+            return data
+        self._pending = data[size:]
+        return data[:size]
+
+
+def copy_from_file(file, columns=COPY_COLUMNS):
+    """
+    COPY CSV data into the telemetry hypertable on the session's connection
+
+    Data is copied into a transaction-scoped staging table and moved with
+    INSERT ... SELECT ... ON CONFLICT DO NOTHING, since COPY itself cannot
+    skip duplicates; latest_telemetry and the history stamp of equipment
+    receiving late readings are updated from the same staging table. The
+    caller owns the transaction and must commit.
+
+    Returns:
+        (rows inserted, [{'equipment_id', 'time'}] oldest copied reading per
+        equipment, for aggregate cache invalidation once committed)
+    """
+    column_list = ', '.join(columns)
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.execute(
+            f'CREATE TEMP TABLE IF NOT EXISTS telemetry_staging '
+            f'(LIKE {Telemetry.__tablename__} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS'
+        )
+        cursor.copy_expert(f'COPY telemetry_staging ({column_list}) FROM STDIN WITH (FORMAT csv)', file)
+        cursor.execute(
+            f'INSERT INTO {Telemetry.__tablename__} ({column_list}) '
+            f'SELECT {column_list} FROM telemetry_staging ON CONFLICT DO NOTHING'
+        )
+        inserted = cursor.rowcount
+        cursor.execute(upsert_latest_sql('telemetry_staging'))
+        cursor.execute(mark_history_sql('telemetry_staging', int(current_app.config['TELEMETRY_CACHE_HORIZON'])))
+        earliest = []
+        if aggregate_cache.enabled:
+            cursor.execute('SELECT equipment_id, MIN(time) FROM telemetry_staging GROUP BY equipment_id')
+            earliest = [{'equipment_id': equipment_id, 'time': time} for equipment_id, time in cursor.fetchall()]
+        cursor.execute('TRUNCATE telemetry_staging')
+        return inserted, earliest
+    finally:
+        cursor.close()
+
+
+def copy_telemetry_file(file):
+    """COPY a CSV file object in a single transaction, skipping duplicates"""
+    try:
+        inserted, earliest = copy_from_file(file)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    aggregate_cache.invalidate(earliest)
+    return inserted
+
+
+def copy_telemetry_rows(rows):
+    """Write all rows with COPY in a single transaction, skipping duplicates"""
+    if not rows:
+        return 0
+    return copy_telemetry_file(rows_to_csv(rows))
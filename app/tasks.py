@@ -0,0 +1,20 @@
+"""
+Celery Tasks
+Scheduled by the beat schedule in app/celery.py
+"""
+import logging
+
+from celery import shared_task
+
+from app.services.alert_evaluator import evaluate_rules
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(name='alerts.evaluate_rules', ignore_result=True)
+def evaluate_alert_rules():
+    """Periodic set-based alert evaluation (every ALERT_EVALUATION_INTERVAL seconds)"""
+    created = evaluate_rules()
+    if created:
+        logger.info('Periodic evaluation raised %d alerts', created)
+    return created
@@ -0,0 +1,77 @@
+"""
+Benchmark: decode cost per reading for each ingest payload format
+
+Usage:
+    python -m benchmarks.bench_payload_decoding [--readings 500] [--repeat 5]
+
+Reports the best-of-N time to decode one single-reading body and one batch
+body per format, normalised to microseconds per reading, plus body sizes.
+"""
+import argparse
+import json
+import timeit
+from urllib.parse import urlencode
+
+from app.services.payload_decoding import (
+    FORM, JSON, MSGPACK, PACKED,
+    decode_batch, decode_reading, encode_packed_reading, msgpack
+)
+
+READING = {
+    'serial': 'EQ-BENCH-000001',
+    'temperature': -18.25,
+    'pressure': 120.5,
+    'door': 0,
+    'heater': 1,
+    'compressor': 1,
+    'fan': 1,
+}
+
+
+def _payloads(readings):
+    batch = [dict(READING, serial=f'EQ-BENCH-{i:06d}') for i in range(readings)]
+    single = {
+        JSON: json.dumps(READING).encode(),
+        FORM: urlencode(READING).encode(),
+        PACKED: encode_packed_reading(**READING),
+    }
+    batches = {
+        JSON: json.dumps({'readings': batch}).encode(),
+        PACKED: b''.join(encode_packed_reading(**reading) for reading in batch),
+    }
+    if msgpack is not None:
+        single[MSGPACK[0]] = msgpack.packb(READING)
+        batches[MSGPACK[0]] = msgpack.packb({'readings': batch})
+    return single, batches
+
+
+def _best_us(func, number, repeat):
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--readings', type=int, default=500, help='readings per batch body')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--number', type=int, default=2000, help='single-body decodes per repeat')
+    args = parser.parse_args()
+
+    single, batches = _payloads(args.readings)
+
+    print(f'{"format":<36} {"bytes":>6} {"single us/reading":>18} {"batch us/reading":>17}')
+    for mimetype, body in single.items():
+        single_us = _best_us(lambda: decode_reading(mimetype, body), args.number, args.repeat)
+        batch_body = batches.get(mimetype)
+        if batch_body is not None:
+            batch_us = _best_us(
+                lambda: decode_batch(mimetype, batch_body),
+                max(1, args.number // args.readings), args.repeat
+            ) / args.readings
+            batch_col = f'{batch_us:17.3f}'
+        else:
+            batch_col = f'{"n/a":>17}'
+        print(f'{mimetype:<36} {len(body):>6} {single_us:18.3f} {batch_col}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Benchmark: per-row cost of list responses, ORM + to_dict() vs the read layer
+
+Usage:
+    python -m benchmarks.bench_read_path [--rows 1000] [--repeat 5]
+    python -m benchmarks.bench_read_path --database [--rows 1000]
+
+Without --database, rows are built in memory: the ORM path instantiates
+mapped objects and serializes them with to_dict() and json.dumps (as
+jsonify does); the read layer copies tuples into slotted rows and encodes
+them with read_layer.dumps. With --database, both paths also run the query
+against the configured database (the newest telemetry rows), so ORM
+hydration and the identity map are included.
+"""
+import argparse
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+import json
+import timeit
+import uuid
+
+from app import create_app, db
+from app.models import Alert, AlertRuleType, AlertSeverity, AlertStatus, Telemetry
+from app.services import read_layer
+from app.services.projection import PROJECTABLE_FIELDS
+from app.services.read_layer import select_rows
+
+
+def _telemetry_values(count):
+    equipment_id = uuid.uuid4()
+    start = datetime(2024, 1, 15, tzinfo=timezone.utc)
+    return [
+        (start + timedelta(seconds=60 * i), equipment_id, Decimal('-18.25'), Decimal('120.50'), 0, 1, 1, 1)
+        for i in range(count)
+    ]
+
+
+def _alert_values(count):
+    created_at = datetime(2024, 1, 15, tzinfo=timezone.utc)
+    return [
+        (uuid.uuid4(), uuid.uuid4(), uuid.uuid4(), AlertRuleType.TEMPERATURE_HIGH, AlertSeverity.CRITICAL,
+         'Temperature above -15.0', AlertStatus.ACTIVE, None, None, None, None, created_at, created_at)
+        for _ in range(count)
+    ]
+
+
+class _Query:
+    """Stands in for a query so select_rows can be used without a database"""
+
+    def with_entities(self, *columns):
+        return self
+
+
+def _memory_paths(model, values):
+    fields = PROJECTABLE_FIELDS[model]
+    _, to_row = select_rows(_Query(), model, None)
+
+    def orm():
+        objects = [model(**dict(zip(fields, row))) for row in values]
+        return json.dumps([obj.to_dict() for obj in objects])
+
+    def rows():
+        return read_layer.dumps([to_row(row) for row in values])
+
+    return orm, rows
+
+
+def _database_paths(rows):
+    def orm():
+        objects = Telemetry.query.order_by(Telemetry.time.desc()).limit(rows).all()
+        payload = json.dumps([obj.to_dict() for obj in objects])
+        db.session.expunge_all()
+        return payload
+
+    def fast():
+        query, to_row = select_rows(Telemetry.query.order_by(Telemetry.time.desc()).limit(rows), Telemetry)
+        return read_layer.dumps([to_row(row) for row in query.all()])
+
+    return orm, fast
+
+
+def _best_us(func, number, repeat, rows):
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number / rows * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=1000, help='rows per response')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--number', type=int, default=20, help='responses per repeat')
+    parser.add_argument('--database', action='store_true', help='query the configured database')
+    args = parser.parse_args()
+
+    app = create_app()
+    encoder = 'orjson' if read_layer.orjson is not None else 'json'
+    print(f'read layer encoder: {encoder}')
+    print(f'{"case":<24} {"orm us/row":>11} {"rows us/row":>12} {"speedup":>8}')
+    with app.app_context():
+        if args.database:
+            cases = {'telemetry (database)': _database_paths(args.rows)}
+        else:
+            cases = {
+                'telemetry': _memory_paths(Telemetry, _telemetry_values(args.rows)),
+                'alerts': _memory_paths(Alert, _alert_values(args.rows)),
+            }
+        for name, (orm, rows) in cases.items():
+            orm_us = _best_us(orm, args.number, args.repeat, args.rows)
+            rows_us = _best_us(rows, args.number, args.repeat, args.rows)
+            print(f'{name:<24} {orm_us:11.3f} {rows_us:12.3f} {orm_us / rows_us:7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+"""
+Ingestion Gateway Entry Point
+Run the asyncio device ingestion gateway (see app/gateway.py)
+"""
+import os
+
+from aiohttp import web
+
+from app.gateway import create_gateway
+
+try:
+    import uvloop
+except ImportError:  # pragma: no cover - optional dependency
+    uvloop = None
+
+if __name__ == '__main__':
+    host = os.environ.get('GATEWAY_HOST', '0.0.0.0')
+    port = int(os.environ.get('GATEWAY_PORT', 5001))
+
+    if uvloop is not None:
+        uvloop.install()
+
+    app = create_gateway()
+
+    # reuse_port lets several gateway processes share the port (one per core)
+    web.run_app(
+        app,
+        host=host,
+        port=port,
+        reuse_port=True,
+        keepalive_timeout=app['gateway'].config['GATEWAY_KEEPALIVE_TIMEOUT'],
+        access_log=None
+    )
@@ -134,6 +134,7 @@ CREATE TABLE equipments (
     status equipment_status NOT NULL DEFAULT 'offline',
     api_key VARCHAR(255) NOT NULL UNIQUE,
     last_seen_at TIMESTAMPTZ,
+    history_changed_at TIMESTAMPTZ,
     installed_at TIMESTAMPTZ,
     created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
     updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
@@ -225,6 +226,23 @@ SELECT add_compression_policy('telemetry', INTERVAL '7 days', if_not_exists => T
 -- Add retention policy (drop data older than 2 years)
 SELECT add_retention_policy('telemetry', INTERVAL '2 years', if_not_exists => TRUE);
 
+-- ============================================================================
+-- LATEST TELEMETRY (newest reading per equipment)
+-- ============================================================================
+
+-- Upserted by the ingest path in the same transaction as the telemetry rows;
+-- real-time reads join it on its primary key instead of probing the hypertable
+CREATE TABLE latest_telemetry (
+    equipment_id UUID PRIMARY KEY REFERENCES equipments(id) ON DELETE CASCADE,
+    time TIMESTAMPTZ NOT NULL,
+    temperature DECIMAL(5, 2),
+    pressure DECIMAL(7, 2),
+    door SMALLINT,
+    heater SMALLINT,
+    compressor SMALLINT,
+    fan SMALLINT
+);
+
 -- ============================================================================
 -- CONTINUOUS AGGREGATES (Pre-computed Statistics)
 -- ============================================================================
@@ -295,6 +313,7 @@ CREATE TABLE alerts (
     acknowledgment_notes TEXT,
     resolved_at TIMESTAMPTZ,
     created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    last_matched_at TIMESTAMPTZ,
 
     CONSTRAINT alerts_acknowledged_check CHECK (
         (status = 'acknowledged' AND acknowledged_at IS NOT NULL AND acknowledged_by IS NOT NULL) OR
@@ -309,6 +328,10 @@ CREATE INDEX idx_alerts_severity ON alerts(severity);
 CREATE INDEX idx_alerts_created_at ON alerts(created_at DESC);
 CREATE INDEX idx_alerts_acknowledged_by ON alerts(acknowledged_by);
 
+-- At most one open alert per equipment and rule; repeated matches update last_matched_at
+CREATE UNIQUE INDEX alerts_open_rule_unique ON alerts(equipment_id, alert_rule_id)
+    WHERE status IN ('active', 'acknowledged');
+
 -- ============================================================================
 -- MAINTENANCE RECORDS TABLE
 -- ============================================================================
@@ -410,12 +433,7 @@ SELECT
 FROM equipments e
 JOIN branches b ON e.branch_id = b.id
 JOIN companies c ON e.company_id = c.id
-LEFT JOIN LATERAL (
-    SELECT * FROM telemetry
-    WHERE equipment_id = e.id
-    ORDER BY time DESC
-    LIMIT 1
-) t ON TRUE;
+LEFT JOIN latest_telemetry t ON t.equipment_id = e.id;
 
 -- Active alerts with equipment details
 CREATE VIEW active_alerts_detailed AS
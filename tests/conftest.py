@@ -3,7 +3,7 @@ Test Configuration and Fixtures
 Provides common fixtures and utilities for end-to-end API tests
 """
 import pytest
-from app import create_app, db
+from app import create_app, db, reset_services
 from app.models import (
     User, Company, Branch, Equipment, UserBranchAccess,
     UserRole, UserStatus, EquipmentType, BranchAccessType
@@ -33,9 +33,10 @@ def client(app):
 def init_database(app):
     """Initialize test database with clean state"""
     with app.app_context():
-        # Drop and recreate all tables
+        # Drop and recreate all tables, and the service state cached from them
         db.drop_all()
         db.create_all()
+        reset_services()
 
         # Create test data
         _create_test_data()
@@ -45,6 +46,7 @@ def init_database(app):
         # Cleanup after test
         db.session.remove()
         db.drop_all()
+        reset_services()
 
 
 def _create_test_data():
@@ -0,0 +1,367 @@
+"""
+Test Suite: Equipment Monitoring Flow (PRD 5.4)
+
+Tests how users read equipment telemetry for dashboards:
+1. User logs in
+2. User sees dashboard with equipment overview
+3. User filters by branch or status
+4. User clicks on equipment to see details
+5. User views temperature trends and alerts
+"""
+import pytest
+from tests.conftest import get_auth_headers, login_user
+
+
+def _send_readings(client, readings):
+    response = client.post(
+        '/v1/equipments/telemetry/batch',
+        headers={'X-API-Key': 'test_api_key_001'},
+        json={'readings': [dict(reading, serial='EQ-TEST-001') for reading in readings]}
+    )
+    assert response.status_code == 201
+
+
+def _equipment_id(client, access_token, serial='EQ-TEST-001'):
+    equipment_list = client.get(
+        '/v1/equipments',
+        headers=get_auth_headers(access_token)
+    ).get_json()['equipments']
+    return next(eq['id'] for eq in equipment_list if eq['serial'] == serial)
+
+
+def test_01_hourly_temperature_trend(client, init_database):
+    """
+    Test: User views an hourly temperature trend
+
+    Flow:
+    1. Equipment sends readings across two hours
+    2. User requests telemetry with interval=1hour
+    3. System returns one aggregated point per hour, newest first
+    """
+    _send_readings(client, [
+        {'time': '2024-01-15T10:05:00Z', 'temperature': 4.0, 'door': 0},
+        {'time': '2024-01-15T10:35:00Z', 'temperature': 5.0, 'door': 1},
+        {'time': '2024-01-15T11:05:00Z', 'temperature': 6.0, 'door': 0},
+    ])
+    access_token, _ = login_user(client, 'admin@testcompany.com', 'password123')
+    equipment_id = _equipment_id(client, access_token)
+
+    response = client.get(
+        f'/v1/equipments/{equipment_id}/telemetry?interval=1hour'
+        '&start_date=2024-01-15T00:00:00%2B00:00&end_date=2024-01-16T00:00:00%2B00:00',
+        headers=get_auth_headers(access_token)
+    )
+
+    assert response.status_code == 200
+    data = response.get_json()['data']
+    assert len(data) == 2
+    assert data[0]['time'].startswith('2024-01-15T11:00:00')
+    assert data[1]['avg_temperature'] == 4.5
+    assert data[1]['min_temperature'] == 4.0
+    assert data[1]['max_temperature'] == 5.0
+    assert data[1]['door_open_count'] == 1
+    assert data[1]['data_points'] == 2
+
+
+def test_02_custom_interval_buckets_raw_data(client, init_database):
+    """
+    Test: User views a 5-minute trend
+
+    Flow:
+    1. Equipment sends readings within one 5-minute window
+    2. User requests telemetry with interval=5min
+    3. System returns a single bucket
+    """
+    _send_readings(client, [
+        {'time': '2024-01-15T10:00:00Z', 'temperature': 4.0},
+        {'time': '2024-01-15T10:02:00Z', 'temperature': 5.0},
+    ])
+    access_token, _ = login_user(client, 'admin@testcompany.com', 'password123')
+    equipment_id = _equipment_id(client, access_token)
+
+    response = client.get(
+        f'/v1/equipments/{equipment_id}/telemetry?interval=5min',
+        headers=get_auth_headers(access_token)
+    )
+
+    assert response.status_code == 200
+    data = response.get_json()['data']
+    assert len(data) == 1
+    assert data[0]['data_points'] == 2
+
+
+def test_03_invalid_interval_is_rejected(client, init_database):
+    """
+    Test: An unknown interval returns 400
+
+    Flow:
+    1. User requests telemetry with interval=weekly
+    2. System rejects the request
+    """
+    access_token, _ = login_user(client, 'admin@testcompany.com', 'password123')
+    equipment_id = _equipment_id(client, access_token)
+
+    response = client.get(
+        f'/v1/equipments/{equipment_id}/telemetry?interval=weekly',
+        headers=get_auth_headers(access_token)
+    )
+
+    assert response.status_code == 400
+
+
+def test_04_raw_history_is_paged_with_cursors(client, init_database):
+    """
+    Test: User pages through raw readings with cursors
+
+    Flow:
+    1. Equipment sends three readings
+    2. User requests two readings per page with an exact count
+    3. User follows next_cursor to the last reading, then prev_cursor back
+    """
+    _send_readings(client, [
+        {'time': '2024-01-15T10:00:00Z', 'temperature': 4.0},
+        {'time': '2024-01-15T10:01:00Z', 'temperature': 5.0},
+        {'time': '2024-01-15T10:02:00Z', 'temperature': 6.0},
+    ])
+    access_token, _ = login_user(client, 'admin@testcompany.com', 'password123')
+    equipment_id = _equipment_id(client, access_token)
+    url = f'/v1/equipments/{equipment_id}/telemetry'
+
+    first = client.get(f'{url}?limit=2&count=exact', headers=get_auth_headers(access_token)).get_json()
+    assert [point['temperature'] for point in first['data']] == [6.0, 5.0]
+    assert first['pagination']['total'] == 3
+    assert first['pagination']['prev_cursor'] is None
+
+    second = client.get(
+        f'{url}?limit=2&cursor={first["pagination"]["next_cursor"]}',
+        headers=get_auth_headers(access_token)
+    ).get_json()
+    assert [point['temperature'] for point in second['data']] == [4.0]
+    assert second['pagination']['next_cursor'] is None
+
+    back = client.get(
+        f'{url}?limit=2&cursor={second["pagination"]["prev_cursor"]}',
+        headers=get_auth_headers(access_token)
+    ).get_json()
+    assert [point['temperature'] for point in back['data']] == [6.0, 5.0]
+
+
+def test_05_temperature_only_chart_requests_selected_fields(client, init_database):
+    """
+    Test: A temperature chart widget fetches only the fields it plots
+
+    Flow:
+    1. Equipment sends a reading
+    2. User requests raw telemetry with fields=temperature
+    3. User requests the equipment list with fields=id,serial,status
+    4. System returns only the requested fields
+    """
+    _send_readings(client, [{'time': '2024-01-15T10:00:00Z', 'temperature': 4.0, 'door': 1}])
+    access_token, _ = login_user(client, 'admin@testcompany.com', 'password123')
+    equipment_id = _equipment_id(client, access_token)
+
+    response = client.get(
+        f'/v1/equipments/{equipment_id}/telemetry?fields=time,temperature',
+        headers=get_auth_headers(access_token)
+    )
+    assert response.status_code == 200
+    assert response.get_json()['data'][0] == {'time': '2024-01-15T10:00:00+00:00', 'temperature': 4.0}
+
+    response = client.get('/v1/equipments?fields=id,serial,status', headers=get_auth_headers(access_token))
+    assert response.status_code == 200
+    for equipment in response.get_json()['equipments']:
+        assert set(equipment) == {'id', 'serial', 'status'}
+
+    response = client.get('/v1/equipments?fields=api_key', headers=get_auth_headers(access_token))
+    assert response.status_code == 400
+
+
+def test_06_audit_export_streams_csv(client, init_database):
+    """
+    Test: User exports a telemetry range as CSV for an audit
+
+    Flow:
+    1. Equipment sends two readings
+    2. User exports the equipment's telemetry as CSV
+    3. System streams a header line and one line per reading
+    """
+    _send_readings(client, [
+        {'time': '2024-01-15T10:00:00Z', 'temperature': 4.0},
+        {'time': '2024-01-15T10:01:00Z', 'temperature': 5.0},
+    ])
+    access_token, _ = login_user(client, 'admin@testcompany.com', 'password123')
+    equipment_id = _equipment_id(client, access_token)
+
+    response = client.get(
+        f'/v1/telemetry/export?equipment_ids={equipment_id}&format=csv',
+        headers=get_auth_headers(access_token)
+    )
+
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    lines = response.get_data(as_text=True).strip().splitlines()
+    assert lines[0].startswith('time,equipment_id,serial,temperature')
+    assert len(lines) == 3
+    assert 'EQ-TEST-001' in lines[1]
+
+
+def test_07_chart_requests_columnar_series(client, init_database):
+    """
+    Test: A chart receives per-series arrays instead of row objects
+
+    Flow:
+    1. Equipment sends two readings
+    2. User requests telemetry with format=columnar&fields=temperature
+    3. System returns index-aligned time and temperature arrays
+    """
+    _send_readings(client, [
+        {'time': '2024-01-15T10:00:00Z', 'temperature': 4.0},
+        {'time': '2024-01-15T10:01:00Z', 'temperature': 5.0},
+    ])
+    access_token, _ = login_user(client, 'admin@testcompany.com', 'password123')
+    equipment_id = _equipment_id(client, access_token)
+
+    response = client.get(
+        f'/v1/equipments/{equipment_id}/telemetry?format=columnar&fields=temperature',
+        headers=get_auth_headers(access_token)
+    )
+
+    assert response.status_code == 200
+    assert response.get_json()['data'] == {
+        'time': [1705312860, 1705312800],
+        'temperature': [5.0, 4.0],
+    }
+
+
+def test_08_long_range_is_downsampled_keeping_excursions(client, init_database):
+    """
+    Test: A long-range chart is downsampled without losing an excursion
+
+    Flow:
+    1. Equipment sends ten readings, one of them a temperature spike
+    2. User requests the range with max_points=4
+    3. System returns four points, including the spike
+    """
+    readings = [
+        {'time': f'2024-01-15T10:{minute:02d}:00Z', 'temperature': 4.0}
+        for minute in range(10)
+    ]
+    readings[5]['temperature'] = 12.0
+    _send_readings(client, readings)
+    access_token, _ = login_user(client, 'admin@testcompany.com', 'password123')
+    equipment_id = _equipment_id(client, access_token)
+
+    response = client.get(
+        f'/v1/equipments/{equipment_id}/telemetry?max_points=4&fields=temperature'
+        '&start_date=2024-01-15T00:00:00%2B00:00&end_date=2024-01-16T00:00:00%2B00:00',
+        headers=get_auth_headers(access_token)
+    )
+
+    assert response.status_code == 200
+    data = response.get_json()
+    assert len(data['data']) == 4
+    assert data['downsampling']['source_points'] == 10
+    assert 12.0 in [point['temperature'] for point in data['data']]
+
+
+def test_09_branch_dashboard_fetches_all_series_at_once(client, init_database):
+    """
+    Test: A dashboard loads several equipment in one request within access limits
+
+    Flow:
+    1. Equipment sends readings
+    2. Company admin requests telemetry for both equipment at once
+    3. System returns one series per equipment
+    4. Branch-restricted viewer cannot request equipment outside their branch
+    5. A malformed branch_id is rejected
+    """
+    _send_readings(client, [{'time': '2024-01-15T10:00:00Z', 'temperature': 4.0}])
+    access_token, _ = login_user(client, 'admin@testcompany.com', 'password123')
+    first = _equipment_id(client, access_token, 'EQ-TEST-001')
+    second = _equipment_id(client, access_token, 'EQ-TEST-002')
+    query = f'equipment_ids={first},{second}&start_date=2024-01-15T00:00:00%2B00:00&end_date=2024-01-16T00:00:00%2B00:00'
+
+    response = client.get(f'/v1/telemetry?{query}', headers=get_auth_headers(access_token))
+
+    assert response.status_code == 200
+    series = response.get_json()['series']
+    assert [item['serial'] for item in series] == ['EQ-TEST-001', 'EQ-TEST-002']
+    assert len(series[0]['data']) == 1
+    assert series[1]['data'] == []
+
+    restricted_token, _ = login_user(client, 'restricted@testcompany.com', 'restricted123')
+    response = client.get(f'/v1/telemetry?{query}', headers=get_auth_headers(restricted_token))
+    assert response.status_code == 404
+
+    response = client.get('/v1/telemetry?branch_id=not-a-uuid', headers=get_auth_headers(access_token))
+    assert response.status_code == 400
+
+
+def test_10_realtime_shows_newest_reading(client, init_database):
+    """
+    Test: Dashboard shows the current values of every equipment
+
+    Flow:
+    1. Equipment sends a reading, then replays an older one
+    2. User requests real-time data
+    3. System returns the newest reading per accessible equipment
+    4. Branch-restricted viewer only sees equipment of their branch
+    """
+    _send_readings(client, [{'time': '2024-01-15T11:00:00Z', 'temperature': 6.0, 'door': 1}])
+    _send_readings(client, [{'time': '2024-01-15T10:00:00Z', 'temperature': 4.0, 'door': 0}])
+    access_token, _ = login_user(client, 'admin@testcompany.com', 'password123')
+
+    response = client.get('/v1/telemetry/realtime', headers=get_auth_headers(access_token))
+
+    assert response.status_code == 200
+    equipments = {item['serial']: item for item in response.get_json()['equipments']}
+    assert equipments['EQ-TEST-001']['temperature'] == 6.0
+    assert equipments['EQ-TEST-001']['door'] == 'open'
+    assert equipments['EQ-TEST-001']['last_update'].startswith('2024-01-15T11:00:00')
+    assert equipments['EQ-TEST-002']['last_update'] is None
+
+    restricted_token, _ = login_user(client, 'restricted@testcompany.com', 'restricted123')
+    response = client.get('/v1/telemetry/realtime', headers=get_auth_headers(restricted_token))
+    assert [item['serial'] for item in response.get_json()['equipments']] == ['EQ-TEST-001']
+
+
+def test_11_closed_range_is_cached_by_etag(client, init_database):
+    """
+    Test: Dashboard refreshes of a past range are answered from the browser cache
+
+    Flow:
+    1. User requests an hourly trend for a past day
+    2. System answers with an ETag to revalidate against
+    3. User repeats the request with If-None-Match and gets 304
+    4. A replayed backlog reading lands in that day: the ETag changes
+    5. A range without end date only gets a short max-age
+    """
+    _send_readings(client, [{'time': '2024-01-15T10:05:00Z', 'temperature': 4.0}])
+    access_token, _ = login_user(client, 'admin@testcompany.com', 'password123')
+    equipment_id = _equipment_id(client, access_token)
+    url = (
+        f'/v1/equipments/{equipment_id}/telemetry?interval=1hour'
+        '&start_date=2024-01-15T00:00:00%2B00:00&end_date=2024-01-16T00:00:00%2B00:00'
+    )
+
+    response = client.get(url, headers=get_auth_headers(access_token))
+
+    assert response.status_code == 200
+    assert response.cache_control.no_cache
+    etag = response.headers['ETag']
+
+    response = client.get(url, headers={**get_auth_headers(access_token), 'If-None-Match': etag})
+    assert response.status_code == 304
+
+    _send_readings(client, [{'time': '2024-01-15T11:05:00Z', 'temperature': 5.0}])
+    response = client.get(url, headers={**get_auth_headers(access_token), 'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert len(response.get_json()['data']) == 2
+
+    response = client.get(
+        f'/v1/equipments/{equipment_id}/telemetry?interval=1hour',
+        headers=get_auth_headers(access_token)
+    )
+    assert 'ETag' not in response.headers
+    assert response.cache_control.max_age == 10
@@ -0,0 +1,337 @@
+"""
+Test Suite: Alert Management Flow (PRD 5.7)
+
+Tests how alerts are raised from equipment readings and shown to users:
+1. Global admin has configured alert rules
+2. Equipment sends readings
+3. Server evaluates the effective rules on every reading
+4. User sees the alerts of their equipment
+"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from tests.conftest import get_auth_headers, login_user
+
+from app import db
+from app.models import (
+    Alert, AlertRule, AlertRuleScope, AlertRuleType, AlertSeverity, AlertStatus, ComparisonOperator, Equipment,
+    User
+)
+from app.services.alert_engine import alert_engine
+from app.services.alert_evaluator import evaluate_rules
+from app.services.offline_detector import offline_detector
+from app.services.open_alerts import open_alert_index
+from app.services.rule_index import rule_index
+
+
+def _create_rule(**overrides):
+    admin = User.query.filter_by(email='admin@polosanca.com').one()
+    rule = AlertRule(**{
+        'name': 'Freezer too warm',
+        'rule_type': AlertRuleType.TEMPERATURE_HIGH,
+        'threshold_value': 8,
+        'comparison_operator': ComparisonOperator.GT,
+        'duration_seconds': 300,
+        'severity': AlertSeverity.CRITICAL,
+        'message_template': 'Temperature exceeded {{threshold}}°C: Current {{value}}°C',
+        'scope': AlertRuleScope.GLOBAL,
+        'created_by': admin.id,
+        **overrides
+    })
+    db.session.add(rule)
+    db.session.commit()
+    rule_index.rule_changed(rule.id)
+    return rule
+
+
+def _send_readings(client, readings):
+    response = client.post(
+        '/v1/equipments/telemetry/batch',
+        headers={'X-API-Key': 'test_api_key_001'},
+        json={'readings': [dict(reading, serial='EQ-TEST-001') for reading in readings]}
+    )
+    assert response.status_code == 201
+
+
+def _equipment_id(serial):
+    return str(Equipment.query.filter_by(serial=serial).one().id)
+
+
+def _equipment_status(client, equipment_id):
+    access_token, _ = login_user(client, 'admin@testcompany.com', 'password123')
+    response = client.get(f'/v1/equipments/{equipment_id}', headers=get_auth_headers(access_token))
+    assert response.status_code == 200
+    return response.get_json()['status']
+
+
+def _alerts(client):
+    access_token, _ = login_user(client, 'admin@testcompany.com', 'password123')
+    response = client.get('/v1/alerts', headers=get_auth_headers(access_token))
+    assert response.status_code == 200
+    return response.get_json()['alerts']
+
+
+def test_01_sustained_condition_raises_alert(client, init_database):
+    """
+    Test: A temperature above threshold for the rule's duration raises one alert
+
+    Flow:
+    1. Global rule: temperature > 8°C for 5 minutes
+    2. Equipment reports 9°C, 9.5°C and 10°C over 6 minutes
+    3. System raises a single critical alert with the rendered message
+    """
+    _create_rule()
+
+    _send_readings(client, [
+        {'time': '2024-01-15T10:00:00Z', 'temperature': 9.0},
+        {'time': '2024-01-15T10:03:00Z', 'temperature': 9.5},
+        {'time': '2024-01-15T10:06:00Z', 'temperature': 10.0},
+        {'time': '2024-01-15T10:07:00Z', 'temperature': 10.5},
+    ])
+
+    alerts = _alerts(client)
+    assert len(alerts) == 1
+    assert alerts[0]['type'] == 'temperature_high'
+    assert alerts[0]['severity'] == 'critical'
+    assert alerts[0]['status'] == 'active'
+    assert alerts[0]['message'] == 'Temperature exceeded 8°C: Current 10°C'
+
+
+def test_02_condition_cleared_before_duration(client, init_database):
+    """
+    Test: A condition that clears before its duration raises nothing
+
+    Flow:
+    1. Global rule: temperature > 8°C for 5 minutes
+    2. Equipment reports 9°C, back to 5°C, then 9°C again within 6 minutes
+    3. System raises no alert
+    """
+    _create_rule()
+
+    _send_readings(client, [
+        {'time': '2024-01-15T10:00:00Z', 'temperature': 9.0},
+        {'time': '2024-01-15T10:03:00Z', 'temperature': 5.0},
+        {'time': '2024-01-15T10:06:00Z', 'temperature': 9.0},
+    ])
+
+    assert _alerts(client) == []
+
+
+def test_03_equipment_rule_overrides_global_rule(client, init_database):
+    """
+    Test: An equipment rule replaces the global rule of the same type
+
+    Flow:
+    1. Global rule: temperature > 8°C; EQ-TEST-001 rule: temperature > 12°C
+    2. Equipment reports 10°C for 6 minutes: no alert
+    3. Equipment reports 13°C for 6 minutes: alert from the equipment rule
+    """
+    _create_rule()
+    _create_rule(
+        name='EQ-TEST-001 too warm', threshold_value=12,
+        scope=AlertRuleScope.EQUIPMENT, scope_id=_equipment_id('EQ-TEST-001')
+    )
+
+    _send_readings(client, [
+        {'time': '2024-01-15T10:00:00Z', 'temperature': 10.0},
+        {'time': '2024-01-15T10:06:00Z', 'temperature': 10.0},
+    ])
+    assert _alerts(client) == []
+
+    _send_readings(client, [
+        {'time': '2024-01-15T11:00:00Z', 'temperature': 13.0},
+        {'time': '2024-01-15T11:06:00Z', 'temperature': 13.0},
+    ])
+    alerts = _alerts(client)
+    assert len(alerts) == 1
+    assert alerts[0]['message'] == 'Temperature exceeded 12°C: Current 13°C'
+
+
+def test_04_deactivated_rule_stops_alerting(client, init_database):
+    """
+    Test: Deactivating a rule through the API takes effect on the next readings
+
+    Flow:
+    1. Global admin deactivates the global rule
+    2. Equipment reports 10°C for 6 minutes
+    3. System raises no alert
+    """
+    rule = _create_rule()
+    access_token, _ = login_user(client, 'admin@polosanca.com', 'admin123')
+    response = client.patch(
+        f'/v1/alert-rules/{rule.id}',
+        headers=get_auth_headers(access_token),
+        json={'is_active': False}
+    )
+    assert response.status_code == 200
+
+    _send_readings(client, [
+        {'time': '2024-01-15T10:00:00Z', 'temperature': 10.0},
+        {'time': '2024-01-15T10:06:00Z', 'temperature': 10.0},
+    ])
+
+    assert _alerts(client) == []
+
+
+def test_05_periodic_evaluation_catches_up(client, init_database, monkeypatch):
+    """
+    Test: The periodic evaluator raises alerts the inline evaluation missed
+
+    Flow:
+    1. Readings are stored without inline evaluation (e.g. worker restart)
+    2. Periodic evaluation runs at 10:07
+    3. System raises one alert; running it again raises no duplicate
+    """
+    _create_rule()
+    monkeypatch.setattr(alert_engine, 'enabled', False)
+
+    _send_readings(client, [
+        {'time': '2024-01-15T10:00:00Z', 'temperature': 9.0},
+        {'time': '2024-01-15T10:03:00Z', 'temperature': 9.5},
+        {'time': '2024-01-15T10:06:00Z', 'temperature': 10.0},
+    ])
+    assert _alerts(client) == []
+
+    now = datetime(2024, 1, 15, 10, 7, tzinfo=timezone.utc)
+    assert evaluate_rules(now) == 1
+    assert evaluate_rules(now) == 0
+
+    alerts = _alerts(client)
+    assert len(alerts) == 1
+    assert alerts[0]['message'] == 'Temperature exceeded 8°C: Current 10°C'
+
+
+def test_06_silent_equipment_goes_offline(client, init_database):
+    """
+    Test: Equipment that stops reporting is set offline and raises an offline alert
+
+    Flow:
+    1. Global equipment_offline rule
+    2. Equipment reports: next check sets it operational
+    3. No readings for 3 hours: check sets it offline and raises one alert
+    4. Equipment reports again: next check sets it operational and resolves the alert
+    """
+    _create_rule(
+        name='Equipment offline', rule_type=AlertRuleType.EQUIPMENT_OFFLINE, threshold_value=None,
+        severity=AlertSeverity.WARNING, message_template='No data since {{last_seen}}'
+    )
+    equipment_id = _equipment_id('EQ-TEST-001')
+
+    _send_readings(client, [{'time': '2024-01-15T10:00:00Z', 'temperature': 4.0}])
+    assert offline_detector.tick() == 0
+    assert _equipment_status(client, equipment_id) == 'operational'
+
+    assert offline_detector.tick(datetime.now(timezone.utc) + timedelta(hours=3)) == 1
+    assert _equipment_status(client, equipment_id) == 'offline'
+
+    alerts = _alerts(client)
+    assert len(alerts) == 1
+    assert alerts[0]['type'] == 'equipment_offline'
+    assert alerts[0]['message'].startswith('No data since ')
+
+    _send_readings(client, [{'time': '2024-01-15T10:01:00Z', 'temperature': 4.0}])
+    assert offline_detector.tick() == 0
+    assert _equipment_status(client, equipment_id) == 'operational'
+    assert [alert['status'] for alert in _alerts(client)] == ['resolved']
+
+
+def test_07_repeated_matches_update_open_alert(client, init_database):
+    """
+    Test: A rule that keeps matching updates its open alert instead of raising new ones
+
+    Flow:
+    1. Temperature stays above threshold over several batches
+    2. System keeps a single alert and moves its last_matched_at
+    3. Once the alert is resolved, the next match raises a new alert
+    """
+    _create_rule()
+
+    _send_readings(client, [
+        {'time': '2024-01-15T10:00:00Z', 'temperature': 9.0},
+        {'time': '2024-01-15T10:06:00Z', 'temperature': 10.0},
+    ])
+    _send_readings(client, [
+        {'time': '2024-01-15T10:10:00Z', 'temperature': 11.0},
+        {'time': '2024-01-15T10:20:00Z', 'temperature': 12.0},
+    ])
+    open_alert_index.flush()
+
+    alerts = _alerts(client)
+    assert len(alerts) == 1
+    assert datetime.fromisoformat(alerts[0]['last_matched_at']) == datetime(2024, 1, 15, 10, 20, tzinfo=timezone.utc)
+
+    alert = Alert.query.get(alerts[0]['id'])
+    alert.status = AlertStatus.RESOLVED
+    db.session.commit()
+    open_alert_index.closed(alert)
+
+    _send_readings(client, [{'time': '2024-01-15T10:30:00Z', 'temperature': 12.5}])
+
+    alerts = _alerts(client)
+    assert len(alerts) == 2
+    active = [a for a in alerts if a['status'] == 'active']
+    assert len(active) == 1
+    assert active[0]['message'] == 'Temperature exceeded 8°C: Current 12.5°C'
+
+
+def test_08_deleted_rule_does_not_block_other_alerts(client, init_database):
+    """
+    Test: A rule deleted behind the index's back does not lose the alerts of other rules
+
+    Flow:
+    1. Global rules for high temperature and open door are indexed
+    2. The temperature rule is deleted without notifying the index
+    3. A reading matches both rules
+    4. System raises the door alert and drops the deleted rule from the index
+    """
+    temperature_rule = _create_rule(duration_seconds=0)
+    _create_rule(
+        name='Door open', rule_type=AlertRuleType.DOOR_OPEN, threshold_value=None,
+        comparison_operator=ComparisonOperator.EQ, duration_seconds=0, severity=AlertSeverity.WARNING,
+        message_template='Door open'
+    )
+    equipment_id = _equipment_id('EQ-TEST-001')
+    assert len(rule_index.effective(equipment_id)) == 2
+
+    temperature_rule_id = temperature_rule.id
+    AlertRule.query.filter_by(id=temperature_rule_id).delete()
+    db.session.commit()
+
+    _send_readings(client, [{'time': '2024-01-15T10:00:00Z', 'temperature': 9.0, 'door': 1}])
+
+    alerts = _alerts(client)
+    assert len(alerts) == 1
+    assert alerts[0]['type'] == 'door_open'
+    assert temperature_rule_id not in [rule.id for rule in rule_index.effective(equipment_id)]
+
+
+def test_09_periodic_evaluation_of_instant_rule(client, init_database, monkeypatch):
+    """
+    Test: The periodic evaluator fires rules without duration on the latest reading
+
+    Flow:
+    1. Global rule: temperature > 8°C with no duration
+    2. Readings are stored without inline evaluation; the latest is 9°C
+    3. Periodic evaluation within the next interval raises one alert
+    4. Once the latest reading is back to normal, no further alert is raised
+    """
+    _create_rule(duration_seconds=0)
+    monkeypatch.setattr(alert_engine, 'enabled', False)
+
+    _send_readings(client, [
+        {'time': '2024-01-15T10:00:10Z', 'temperature': 4.0},
+        {'time': '2024-01-15T10:00:40Z', 'temperature': 9.0},
+    ])
+
+    assert evaluate_rules(datetime(2024, 1, 15, 10, 0, 50, tzinfo=timezone.utc)) == 1
+    alerts = _alerts(client)
+    assert len(alerts) == 1
+    assert alerts[0]['message'] == 'Temperature exceeded 8°C: Current 9°C'
+
+    alert = Alert.query.get(alerts[0]['id'])
+    alert.status = AlertStatus.RESOLVED
+    db.session.commit()
+    open_alert_index.closed(alert)
+
+    _send_readings(client, [{'time': '2024-01-15T10:01:20Z', 'temperature': 5.0}])
+    assert evaluate_rules(datetime(2024, 1, 15, 10, 1, 30, tzinfo=timezone.utc)) == 0
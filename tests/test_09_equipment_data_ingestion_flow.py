@@ -375,3 +375,316 @@ def test_10_high_frequency_telemetry_submissions(client, init_database):
     ).get_json()
 
     assert telemetry['count'] >= 10
+
+
+def test_11_gateway_batch_submission(client, init_database):
+    """
+    Test: Gateway submits readings for several equipments in one request
+
+    Flow:
+    1. Gateway posts readings for two serials, each with its own API key
+    2. Server authenticates each serial once and stores every reading
+    3. Readings are retrievable per equipment
+    """
+    response = client.post(
+        '/v1/equipments/telemetry/batch',
+        json={
+            'api_keys': {
+                'EQ-TEST-001': 'test_api_key_001',
+                'EQ-TEST-002': 'test_api_key_002'
+            },
+            'readings': [
+                {'serial': 'EQ-TEST-001', 'time': '2025-11-25T10:00:00Z', 'temperature': -18.0, 'door': 0},
+                {'serial': 'EQ-TEST-001', 'time': '2025-11-25T10:01:00Z', 'temperature': -17.5, 'door': 1},
+                {'serial': 'EQ-TEST-002', 'temperature': 4.2, 'pressure': 120.0, 'door': 0}
+            ]
+        }
+    )
+
+    assert response.status_code == 201
+    data = response.get_json()
+    assert data['success'] is True
+    assert data['accepted'] == 3
+
+    from tests.conftest import login_user
+
+    access_token, _ = login_user(client, 'admin@testcompany.com', 'password123')
+    equipment_list = client.get('/v1/equipments', headers=get_auth_headers(access_token)).get_json()['equipments']
+    equipment_ids = {eq['serial']: eq['id'] for eq in equipment_list}
+
+    first = client.get(
+        f'/v1/equipments/{equipment_ids["EQ-TEST-001"]}/telemetry',
+        headers=get_auth_headers(access_token)
+    ).get_json()['data']
+    assert [(r['time'][:19], r['temperature'], r['door']) for r in first] == [
+        ('2025-11-25T10:01:00', -17.5, 1),
+        ('2025-11-25T10:00:00', -18.0, 0),
+    ]
+
+    second = client.get(
+        f'/v1/equipments/{equipment_ids["EQ-TEST-002"]}/telemetry',
+        headers=get_auth_headers(access_token)
+    ).get_json()['data']
+    assert len(second) == 1
+    assert second[0]['temperature'] == 4.2
+    assert second[0]['pressure'] == 120.0
+
+
+def test_12_gateway_batch_rejects_invalid_credentials(client, init_database):
+    """
+    Test: A batch containing a device with a wrong API key is rejected as a whole
+    """
+    response = client.post(
+        '/v1/equipments/telemetry/batch',
+        headers={'X-API-Key': 'test_api_key_001'},
+        json={
+            'readings': [
+                {'serial': 'EQ-TEST-001', 'temperature': -18.0},
+                {'serial': 'EQ-TEST-002', 'temperature': 4.2}
+            ]
+        }
+    )
+
+    assert response.status_code == 401
+    assert 'EQ-TEST-002' in response.get_json()['error']
+
+
+def test_13_equipment_of_inactive_company_is_rejected(client, init_database):
+    """
+    Test: Equipment stops being accepted once its company is deactivated
+
+    Flow:
+    1. Equipment sends a reading (its credentials are now cached)
+    2. Global admin deactivates the company
+    3. The next reading is rejected
+    """
+    from tests.conftest import login_user
+
+    payload = {'serial': 'EQ-TEST-001', 'temperature': 4.5}
+    first = client.post('/v1/equipments/telemetry', headers={'X-API-Key': 'test_api_key_001'}, json=payload)
+    assert first.status_code in [200, 201]
+
+    access_token, _ = login_user(client, 'admin@polosanca.com', 'admin123')
+    companies = client.get('/v1/companies', headers=get_auth_headers(access_token)).get_json()['companies']
+    company_id = companies[0]['id']
+
+    # The route assigns the Enum(CompanyStatus) column directly, which takes member names
+    response = client.patch(
+        f'/v1/companies/{company_id}',
+        headers=get_auth_headers(access_token),
+        json={'status': 'INACTIVE'}
+    )
+    assert response.status_code == 200
+    assert response.get_json()['status'] == 'inactive'
+
+    second = client.post('/v1/equipments/telemetry', headers={'X-API-Key': 'test_api_key_001'}, json=payload)
+    assert second.status_code == 403
+
+
+def test_14_packed_binary_telemetry_submission(client, init_database):
+    """
+    Test: Low-power controllers can send the fixed-layout packed binary record
+    """
+    from app.services.payload_decoding import PACKED, encode_packed_reading
+
+    single = client.post(
+        '/v1/equipments/telemetry',
+        headers={'X-API-Key': 'test_api_key_001', 'Content-Type': PACKED},
+        data=encode_packed_reading('EQ-TEST-001', temperature=-18.5, pressure=150.0, door=0, heater=1, compressor=1, fan=1)
+    )
+    assert single.status_code == 201
+
+    truncated = client.post(
+        '/v1/equipments/telemetry',
+        headers={'X-API-Key': 'test_api_key_001', 'Content-Type': PACKED},
+        data=b'\x00' * 10
+    )
+    assert truncated.status_code == 400
+
+
+def test_15_retried_reading_is_not_stored_twice(client, init_database):
+    """
+    Test: A device retrying a POST with the same sequence number creates no duplicate
+
+    Flow:
+    1. Equipment sends a reading with seq=1
+    2. Equipment retries the same reading (lost response)
+    3. Server acknowledges the retry without writing another row
+    """
+    payload = {'serial': 'EQ-TEST-001', 'seq': 1, 'temperature': 4.5, 'door': 0}
+
+    first = client.post('/v1/equipments/telemetry', headers={'X-API-Key': 'test_api_key_001'}, json=payload)
+    assert first.status_code == 201
+    assert first.get_json()['duplicate'] is False
+
+    retry = client.post('/v1/equipments/telemetry', headers={'X-API-Key': 'test_api_key_001'}, json=payload)
+    assert retry.status_code == 200
+    assert retry.get_json()['duplicate'] is True
+
+
+def test_16_device_uploads_backlog_after_outage(client, init_database):
+    """
+    Test: A device back from an outage replays its backlog in one upload
+
+    Flow:
+    1. Equipment uploads an NDJSON backlog of timestamped readings
+    2. Server stores every reading
+    3. Equipment re-sends the same backlog as CSV
+    4. Server skips the readings it already has
+    """
+    ndjson = (
+        '{"time": "2024-01-15T10:00:00Z", "temperature": 4.5, "door": 0}\n'
+        '{"time": "2024-01-15T10:01:00Z", "temperature": 4.6, "door": 1}\n'
+    )
+    response = client.post(
+        '/v1/equipments/telemetry/backlog?serial=EQ-TEST-001',
+        headers={'X-API-Key': 'test_api_key_001'},
+        data=ndjson,
+        content_type='application/x-ndjson'
+    )
+    assert response.status_code == 201
+    assert response.get_json()['accepted'] == 2
+
+    csv_body = (
+        'time,temperature,door\n'
+        '2024-01-15T10:00:00Z,4.5,0\n'
+        '2024-01-15T10:01:00Z,4.6,1\n'
+    )
+    replay = client.post(
+        '/v1/equipments/telemetry/backlog?serial=EQ-TEST-001',
+        headers={'X-API-Key': 'test_api_key_001'},
+        data=csv_body,
+        content_type='text/csv'
+    )
+    assert replay.status_code == 200
+    assert replay.get_json()['duplicates'] == 2
+
+
+def test_17_backlog_with_invalid_line_is_rejected(client, init_database):
+    """
+    Test: A backlog containing an undated reading is rejected as a whole
+
+    Flow:
+    1. Equipment uploads a backlog whose second line has no time
+    2. Server returns 400 naming the line
+    """
+    response = client.post(
+        '/v1/equipments/telemetry/backlog?serial=EQ-TEST-001',
+        headers={'X-API-Key': 'test_api_key_001'},
+        data='{"time": "2024-01-15T10:00:00Z", "temperature": 4.5}\n{"temperature": 4.6}\n',
+        content_type='application/x-ndjson'
+    )
+    assert response.status_code == 400
+    assert 'Line 2' in response.get_json()['error']
+
+
+def test_18_equipment_deleted_by_another_worker_is_rejected(client, init_database):
+    """
+    Test: A device whose equipment was deleted elsewhere is rejected, not answered with 500
+
+    Flow:
+    1. Equipment sends a reading (its credentials are now cached)
+    2. The equipment is deleted without this worker being told
+    3. The next reading is rejected with 401
+    """
+    from app import db
+    from app.models import Equipment
+
+    payload = {'serial': 'EQ-TEST-001', 'temperature': 4.5}
+    first = client.post('/v1/equipments/telemetry', headers={'X-API-Key': 'test_api_key_001'}, json=payload)
+    assert first.status_code == 201
+
+    Equipment.query.filter_by(serial='EQ-TEST-001').delete()
+    db.session.commit()
+
+    second = client.post('/v1/equipments/telemetry', headers={'X-API-Key': 'test_api_key_001'}, json=payload)
+    assert second.status_code == 401
+
+    third = client.post('/v1/equipments/telemetry', headers={'X-API-Key': 'test_api_key_001'}, json=payload)
+    assert third.status_code == 401
+
+
+def test_19_out_of_range_reading_is_rejected(client, init_database):
+    """
+    Test: A reading the telemetry columns cannot store is rejected before it is acknowledged
+
+    Flow:
+    1. Equipment sends a temperature beyond the column's range
+    2. Server answers 400 naming the field
+    """
+    response = client.post(
+        '/v1/equipments/telemetry',
+        headers={'X-API-Key': 'test_api_key_001'},
+        json={'serial': 'EQ-TEST-001', 'temperature': 1000.0}
+    )
+    assert response.status_code == 400
+    assert 'temperature' in response.get_json()['error']
+
+
+def test_20_restarted_device_sequence_is_accepted(client, init_database):
+    """
+    Test: A device that restarts its sequence numbers after a reboot is not taken for a retry
+
+    Flow:
+    1. Equipment sends seq 1 and 2 in boot 1
+    2. Equipment reboots and sends seq 1 in boot 2
+    3. Server stores the new reading
+    """
+    headers = {'X-API-Key': 'test_api_key_001'}
+    for seq in (1, 2):
+        response = client.post('/v1/equipments/telemetry', headers=headers, json={
+            'serial': 'EQ-TEST-001', 'seq': seq, 'boot': 1, 'temperature': 4.5
+        })
+        assert response.status_code == 201
+
+    restarted = client.post('/v1/equipments/telemetry', headers=headers, json={
+        'serial': 'EQ-TEST-001', 'seq': 1, 'boot': 2, 'temperature': 4.7
+    })
+    assert restarted.status_code == 201
+    assert restarted.get_json()['duplicate'] is False
+
+    retry = client.post('/v1/equipments/telemetry', headers=headers, json={
+        'serial': 'EQ-TEST-001', 'seq': 1, 'boot': 2, 'temperature': 4.7
+    })
+    assert retry.get_json()['duplicate'] is True
+
+
+def test_21_rate_limit_charges_one_token_per_request(client, init_database, monkeypatch):
+    """
+    Test: The per-equipment rate limit counts requests, not readings
+
+    Flow:
+    1. Equipment sends a batch of more readings than its burst size
+    2. Server accepts it as one request
+    3. Equipment sends single readings until its burst is used up
+    4. Server answers 429 with Retry-After
+    """
+    import math
+
+    from app.services.rate_limit import telemetry_rate_limiter
+
+    monkeypatch.setattr(telemetry_rate_limiter, 'enabled', True)
+    headers = {'X-API-Key': 'test_api_key_001'}
+    burst = telemetry_rate_limiter.capacity
+
+    batch = client.post('/v1/equipments/telemetry/batch', headers=headers, json={
+        'readings': [
+            {'serial': 'EQ-TEST-001', 'time': f'2025-11-25T10:{minute:02d}:00Z', 'temperature': -18.0}
+            for minute in range(burst * 2)
+        ]
+    })
+    assert batch.status_code == 201
+    assert batch.get_json()['accepted'] == burst * 2
+
+    for _ in range(burst - 1):
+        response = client.post('/v1/equipments/telemetry', headers=headers, json={
+            'serial': 'EQ-TEST-001', 'temperature': -18.0
+        })
+        assert response.status_code == 201
+
+    limited = client.post('/v1/equipments/telemetry', headers=headers, json={
+        'serial': 'EQ-TEST-001', 'temperature': -18.0
+    })
+    assert limited.status_code == 429
+    # At most the time one token takes to refill
+    assert 0 < int(limited.headers['Retry-After']) <= math.ceil(1 / telemetry_rate_limiter.rate)